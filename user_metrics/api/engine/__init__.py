@@ -25,6 +25,27 @@
     users to be selected based on prior conditions that includes them in a
     given cohort.
 
+    Cohorts may be negated with ``^`` and grouped with parentheses, so that
+    ``1&^(2~3)`` selects the users of cohort 1 that are in neither cohort 2
+    nor 3.  AND binds tighter than OR.  A negated cohort has no users of its
+    own and must be combined with another cohort, the expression as a whole
+    may not be negated.
+
+    The users of each cohort are cached as sorted arrays of user IDs and
+    read again only once ``utm_touched`` of the cohort changes.  Expressions
+    are evaluated with numpy sorted set operations.
+
+    Cohort snapshots
+    ~~~~~~~~~~~~~~~~
+
+    The users of a cohort are also kept on disk in the data file directory,
+    in a snapshot file named for the cohort ID and its ``utm_touched``.  A
+    snapshot holds a short header followed by the zlib compressed
+    differences between consecutive sorted user IDs, stored in the
+    narrowest unsigned integer type that fits them.  Snapshots are memory
+    mapped and decoded with a cumulative sum, so that processes read a
+    cohort from ``usertags`` only once for each change to the cohort.
+
     Method Definitions
     ~~~~~~~~~~~~~~~~~~
 """
@@ -34,8 +55,18 @@ __email__ = "rfaulkner@wikimedia.org"
 __date__ = "january 11 2012"
 __license__ = "GPL (version 2 or later)"
 
-from re import search
+import os
+import mmap
+import zlib
+from glob import glob
+from struct import Struct, error as StructError
+from tempfile import mkstemp
+from re import search, findall
+from numpy import fromiter, unique, intersect1d, union1d, setdiff1d, \
+    int64, frombuffer, diff, concatenate, zeros
 from user_metrics.api import MetricsAPIError, query_mod
+from user_metrics.config import logging, settings
+from user_metrics.utils import format_mediawiki_timestamp
 
 #
 # Define remaining constants
@@ -59,11 +90,31 @@ DEFAULT_QUERY_VAL = 'present'
 # ======================
 
 # This regex must be matched to parse cohorts
-COHORT_REGEX = r'^([0-9]+[&~])*[0-9]+$'
+COHORT_REGEX = r'^[\^(]*[0-9]+\)*([&~][\^(]*[0-9]+\)*)*$'
+
+# Tokens of cohort expressions: cohort IDs, operators and parentheses
+COHORT_TOKEN_REGEX = r'[0-9]+|[&~^()]'
 
 COHORT_OP_AND = '&'
 COHORT_OP_OR = '~'
-# COHORT_OP_NOT = '^'
+COHORT_OP_NOT = '^'
+COHORT_OPEN = '('
+COHORT_CLOSE = ')'
+
+# Cached cohort users keyed on cohort ID.  Entries hold the ``utm_touched``
+# of the cohort when its users were read and a sorted array of user IDs.
+_COHORT_USERS = dict()
+
+# Cohort snapshot settings
+#
+# 1. Snapshot file name, formatted with cohort ID and ``utm_touched``
+# 2. Snapshot header: magic, byte width of the user ID deltas, user count
+# 3. Magic identifying snapshot files
+# 4. Byte widths the user ID deltas may be stored in
+COHORT_SNAPSHOT_FILE = 'cohort_{0}_{1}.snap'
+COHORT_SNAPSHOT_HEADER = Struct('<4sBQ')
+COHORT_SNAPSHOT_MAGIC = 'UMCS'
+COHORT_SNAPSHOT_WIDTHS = [1, 2, 4, 8]
 
 
 def parse_cohorts(expression):
@@ -84,38 +135,180 @@ def parse_cohorts(expression):
         raise MetricsAPIError()
 
     # parse expression
-    return parse(expression)
+    return [unicode(user_id) for user_id in parse(expression).tolist()]
+
+
+def get_cohort_user_ids(cohort_id):
+    """
+        Returns the sorted array of user IDs in a cohort.  The users are
+        read from the cache, or else from the cohort snapshot, unless the
+        cohort was modified since.
+    """
+    touched = query_mod.get_cohort_touched(cohort_id)
+    cached = _COHORT_USERS.get(cohort_id)
+    if cached and touched and cached[0] == touched:
+        return cached[1]
+
+    user_ids = read_cohort_snapshot(cohort_id, touched) if touched else None
+    if user_ids is None:
+        user_ids = unique(fromiter((long(user_id) for user_id in
+                                    query_mod.get_cohort_users(cohort_id)),
+                                   dtype=int64))
+        if touched:
+            write_cohort_snapshot(cohort_id, touched, user_ids)
+
+    if touched:
+        _COHORT_USERS[cohort_id] = (touched, user_ids)
+    return user_ids
+
+
+def get_cohort_snapshot_path(cohort_id, touched):
+    """ Path of the snapshot of a cohort as of ``touched`` """
+    return settings.__data_file_dir__ + COHORT_SNAPSHOT_FILE.format(
+        cohort_id, format_mediawiki_timestamp(touched))
+
+
+def read_cohort_snapshot(cohort_id, touched):
+    """
+        Returns the sorted array of user IDs stored in the snapshot of a
+        cohort as of ``touched``, None if there is no such snapshot.
+    """
+    path = get_cohort_snapshot_path(cohort_id, touched)
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot = mmap.mmap(snapshot_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+
+    try:
+        magic, width, count = COHORT_SNAPSHOT_HEADER.unpack_from(snapshot)
+        data = zlib.decompress(buffer(snapshot, COHORT_SNAPSHOT_HEADER.size))
+        deltas = frombuffer(data, dtype='<u%d' % width) if data else \
+            zeros(0, dtype=int64)
+        if magic != COHORT_SNAPSHOT_MAGIC or len(deltas) != count:
+            raise ValueError('Corrupt snapshot.')
+    except (ValueError, TypeError, StructError, zlib.error) as e:
+        logging.error(__name__ + ' :: Could not read cohort snapshot '
+                                 '{0}: {1}'.format(path, str(e)))
+        return None
+    finally:
+        snapshot.close()
+    return deltas.astype(int64).cumsum()
+
+
+def write_cohort_snapshot(cohort_id, touched, user_ids):
+    """
+        Stores the sorted array ``user_ids`` as the snapshot of a cohort as
+        of ``touched``, replacing older snapshots of the cohort.
+    """
+    path = get_cohort_snapshot_path(cohort_id, touched)
+    deltas = concatenate([user_ids[:1], diff(user_ids)])
+    largest = deltas.max() if len(deltas) else 0
+    width = [width for width in COHORT_SNAPSHOT_WIDTHS
+             if largest < 1 << (8 * width) or width == 8][0]
+    deltas = deltas.astype('<u%d' % width)
+    try:
+        fd, tmp_path = mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            snapshot_file.write(COHORT_SNAPSHOT_HEADER.pack(
+                COHORT_SNAPSHOT_MAGIC, width, len(deltas)))
+            snapshot_file.write(zlib.compress(deltas.tostring()))
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        logging.error(__name__ + ' :: Could not write cohort snapshot '
+                                 '{0}: {1}'.format(path, str(e)))
+        return
+
+    for old_path in glob(settings.__data_file_dir__ +
+                         COHORT_SNAPSHOT_FILE.format(cohort_id, '*')):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
 
 
 def parse(expression):
-    """ Top level parsing. Splits expression by OR then sub-expressions by
-        AND. returns a generator of ids included in the evaluated expression
     """
-    user_ids_seen = set()
-    for sub_exp_1 in expression.split(COHORT_OP_OR):
-        for user_id in intersect_ids(sub_exp_1.split(COHORT_OP_AND)):
-            if not user_ids_seen.__contains__(user_id):
-                user_ids_seen.add(user_id)
-                yield user_id
-
-
-def intersect_ids(cohort_id_list):
-
-    user_ids = dict()
-    # only a single cohort id in the expression - return all users of this
-    # cohort
-    if len(cohort_id_list) == 1:
-        for id in query_mod.get_cohort_users(cohort_id_list[0]):
-            yield id
-    else:
-        for cid in cohort_id_list:
-            for id in query_mod.get_cohort_users(cid):
-                if id in user_ids:
-                    user_ids[id] += 1
-                else:
-                    user_ids[id] = 1
-                    # Executes only in the case that there was more than one
-                    # cohort id in the expression
-        for key in user_ids:
-            if user_ids[key] > 1:
-                yield key
+        Top level parsing.  Evaluates the expression by recursive descent,
+        ``~`` over ``&`` over ``^`` over parenthesised expressions and
+        cohort IDs.  Returns the sorted array of user ids included in the
+        evaluated expression.
+    """
+    tokens = findall(COHORT_TOKEN_REGEX, expression)[::-1]
+    user_ids, negated = _parse_or(tokens)
+    if tokens:
+        raise MetricsAPIError(__name__ + ' :: Unexpected "%s" in cohort '
+                                         'expression.' % tokens[-1])
+    if negated:
+        raise MetricsAPIError(__name__ + ' :: Negated cohorts must be '
+                                         'combined with "&".')
+    return user_ids
+
+
+# Sets of users are carried as ``(user_ids, negated)``.  A negated set
+# stands for all users except ``user_ids``, which allows expressions to be
+# evaluated without a universe of users.
+def intersect_ids(a, b):
+    """ AND of two sets of users """
+    (x, x_neg), (y, y_neg) = a, b
+    if x_neg and y_neg:
+        return union1d(x, y), True
+    elif x_neg:
+        return setdiff1d(y, x), False
+    elif y_neg:
+        return setdiff1d(x, y), False
+    return intersect1d(x, y), False
+
+
+def union_ids(a, b):
+    """ OR of two sets of users """
+    (x, x_neg), (y, y_neg) = a, b
+    if x_neg and y_neg:
+        return intersect1d(x, y), True
+    elif x_neg:
+        return setdiff1d(x, y), True
+    elif y_neg:
+        return setdiff1d(y, x), True
+    return union1d(x, y), False
+
+
+def _parse_or(tokens):
+    result = _parse_and(tokens)
+    while tokens and tokens[-1] == COHORT_OP_OR:
+        tokens.pop()
+        result = union_ids(result, _parse_and(tokens))
+    return result
+
+
+def _parse_and(tokens):
+    result = _parse_not(tokens)
+    while tokens and tokens[-1] == COHORT_OP_AND:
+        tokens.pop()
+        result = intersect_ids(result, _parse_not(tokens))
+    return result
+
+
+def _parse_not(tokens):
+    if tokens and tokens[-1] == COHORT_OP_NOT:
+        tokens.pop()
+        user_ids, negated = _parse_not(tokens)
+        return user_ids, not negated
+    return _parse_cohort(tokens)
+
+
+def _parse_cohort(tokens):
+    if not tokens:
+        raise MetricsAPIError(__name__ + ' :: Incomplete cohort expression.')
+    token = tokens.pop()
+    if token == COHORT_OPEN:
+        result = _parse_or(tokens)
+        if not tokens or tokens.pop() != COHORT_CLOSE:
+            raise MetricsAPIError(__name__ + ' :: Unbalanced parentheses in '
+                                             'cohort expression.')
+        return result
+    elif token.isdigit():
+        return get_cohort_user_ids(token), False
+    raise MetricsAPIError(__name__ + ' :: Unexpected "%s" in cohort '
+                                     'expression.' % token)
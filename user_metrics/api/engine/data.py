@@ -17,27 +17,30 @@
 
     The other portion of data storage and retrieval is concerned with providing
     functionality that enables responses to be cached.  Request responses are
-    currently cached in the ``api_data`` OrderedDict_ defined in the run
-    module.  This object stores responses in a nested fashion using URL request
+    cached in the ``api_data`` table of a sqlite database stored in the data
+    file directory.  Responses are keyed on a hash of the URL request
     variables and their corresponding values.  For example, the url
     ``http://metrics-api.wikimedia.org/cohorts/e3_ob2b/revert_rate?t=10000``
-    maps to::
+    maps to the key values::
 
-        api_data['cohort_expr <==> e3_ob2b']['metric <==> revert_rate']
-        ['start <==> xx']['start <==> yy']['t <==> 10000']
+        ['cohort_expr--e3_ob2b', 'metric--revert_rate', 't--10000']
 
     The list of key values for a given request is referred to as it's "key
     signature".  The order of parameters is perserved.
 
-    The ``get_data`` method requires a reference to ``api_data``. Given this
-    reference and a RequestMeta object the method attempts to find an entry
-    for the request if one exists.  The ``set_data`` method does much the
-    same operation but performs storage into the hash reference passed.
-    The method ``get_url_from_keys`` builds URLs from nested hash references
-    using the key list and ``build_key_tree`` recursively builds a tree
-    representation of all of the key paths in the hash reference.
+    Given a RequestMeta object the ``get_data`` method attempts to find an
+    entry for the request if one exists.  The ``set_data`` method stores a
+    response along with its key signature.  Entries expire after
+    ``CACHE_TTL`` seconds, the least recently used entries are evicted once
+    the cache exceeds ``CACHE_MAX_SIZE`` bytes and entries are invalidated
+    when the cohort they were computed on has been refreshed since.  The
+    method ``get_url_from_keys`` builds URLs from key signatures.
 
-    .. _OrderedDict: http://docs.python.org/2/library/collections.html
+    Raw metric results are cached alongside responses by ``set_raw_data``
+    keyed on the "raw key signature" of a request, the key signature less
+    the parameters that only shape the response (see ``RAW_KEY_EXCLUDE``).
+    Requests differing only in their aggregator share these results through
+    ``get_raw_data``.
 
 """
 
@@ -50,14 +53,16 @@ __license__ = "GPL (version 2 or later)"
 
 from datetime import datetime
 from re import search
-from collections import OrderedDict
 from hashlib import sha1
+from os import getpid
+from time import time
 import cPickle
+import sqlite3
 
 import user_metrics.etl.data_loader as dl
 from user_metrics.config import logging
 from user_metrics.api.engine import COHORT_REGEX, parse_cohorts, \
-    DATETIME_STR_FORMAT
+    get_cohort_user_ids, DATETIME_STR_FORMAT
 from user_metrics.api.engine.request_meta import REQUEST_META_QUERY_STR,\
     REQUEST_META_BASE
 from user_metrics.api import MetricsAPIError, query_mod
@@ -68,18 +73,38 @@ from user_metrics.config import settings
 # e.g. "metric <==> blocks"
 HASH_KEY_DELIMETER = "--"
 
+# Response cache settings
+#
+# 1. Name of the cache database file in the data file directory
+# 2. Time in seconds after which cached responses expire
+# 3. Maximum total size in bytes of cached responses
+CACHE_FILE_NAME = 'api_data.db'
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_SIZE = 1 << 30
+
+# Request parameters that do not affect raw metric results and are left out
+# of raw key signatures
+RAW_KEY_EXCLUDE = ['aggregator', 'time_series', 'slice']
+
 
 def get_users(cohort_expr):
     """ get users from cohort """
 
     if search(COHORT_REGEX, cohort_expr):
         logging.info(__name__ + ' :: Processing cohort by expression.')
-        users = [user for user in parse_cohorts(cohort_expr)]
+        try:
+            users = parse_cohorts(cohort_expr)
+        except (MetricsAPIError, query_mod.UMQueryCallError) as e:
+            logging.error(__name__ + ' :: Could not parse cohort '
+                                     'expression {0}: {1}'.
+                format(cohort_expr, str(e)))
+            return []
     else:
         logging.info(__name__ + ' :: Processing cohort by tag name.')
         try:
             id = query_mod.get_cohort_id(cohort_expr)
-            users = [u for u in query_mod.get_cohort_users(id)]
+            users = [unicode(user_id)
+                     for user_id in get_cohort_user_ids(id).tolist()]
         except (IndexError, TypeError,
                 query_mod.UMQueryCallError) as e:
             logging.error(__name__ + ' :: Could not retrieve users '
@@ -96,15 +121,17 @@ def get_cohort_refresh_datetime(utm_id):
     """
 
     # @TODO MOVE DB REFS INTO QUERY MODULE
-    conn = dl.Connector(instance=settings.__cohort_data_instance__)
     query = """ SELECT utm_touched FROM usertags_meta WHERE utm_id = %s """
-    conn._cur_.execute(query, int(utm_id))
-
+    utm_id = int(utm_id)
+    conn = dl.get_connection(settings.__cohort_data_instance__)
     utm_touched = None
     try:
+        conn._cur_.execute(query, utm_id)
         utm_touched = conn._cur_.fetchone()[0]
     except ValueError:
         pass
+    finally:
+        dl.release_connection(conn)
 
     # Ensure the field was retrieved
     if not utm_touched:
@@ -112,90 +139,144 @@ def get_cohort_refresh_datetime(utm_id):
                                  str(utm_id))
         utm_touched = datetime.now()
 
-    del conn
     return utm_touched.strftime(DATETIME_STR_FORMAT)
 
 
-def get_data(request_meta, hash_result=True):
+def get_data(request_meta):
     """
-        Extract data from the global hash given a request object.  If an item
-        is successfully recovered data is returned
+        Extract data from the response cache given a request object.  If an
+        item is successfully recovered data is returned
     """
 
-    hash_table_ref = read_pickle_data()
-
-    # Traverse the hash key structure to find data
-    # @TODO rather than iterate through REQUEST_META_BASE &
-    #   REQUEST_META_QUERY_STR look only at existing attributes
-
     logging.debug(__name__ + " - Attempting to pull data for request " \
                              "COHORT {0}, METRIC {1}".
                   format(request_meta.cohort_expr, request_meta.metric))
 
-    key_sig = build_key_signature(request_meta, hash_result=hash_result)
-    item = find_item(hash_table_ref, key_sig)
-
-    if item:
-        # item[0] will be a stringified structure that
-        # is initialized, see set_data.
-        try:
-            return eval(item[0])
-        except SyntaxError:
-            logging.error(__name__ + ' :: Failed to retrieve {0}'.
-                          format(key_sig))
-            return None
-    else:
-        return None
+    return _get_cached(build_key_signature(request_meta, hash_result=True),
+                       request_meta)
 
 
-def set_data(data, request_meta, hash_result=True):
+def set_data(data, request_meta):
     """
-        Given request meta-data and a dataset create a key path in the global
-        hash to store the data
+        Given request meta-data and a dataset store the data in the
+        response cache keyed on the key signature of the request
     """
-    hash_table_ref = read_pickle_data()
-
-    key_sig = build_key_signature(request_meta, hash_result=hash_result)
-    logging.debug(__name__ + " :: Adding data to hash @ key signature = {0}".
+    key_sig = build_key_signature(request_meta, hash_result=True)
+    logging.debug(__name__ + " :: Adding data to cache @ key signature = {0}".
                   format(str(key_sig)))
-    if hash_result:
-        key_sig_full = build_key_signature(request_meta, hash_result=False)
-        hash_table_ref[key_sig] = (data, key_sig_full)
-    else:
-        last_item = key_sig[-1]
-        for item in key_sig:
-            if item == last_item:
-                hash_table_ref[last_item] = data
-            else:
-                hash_table_ref[item] = OrderedDict()
-            hash_table_ref = hash_table_ref[item]
-    write_pickle_data(hash_table_ref)
+    _set_cached(key_sig, build_key_signature(request_meta), data,
+                request_meta)
 
 
-def find_item(hash_table_ref, key_sig):
+def get_raw_data(request_meta):
+    """
+        Extract the raw metric results computed for a request, or any
+        request differing from it only in parameters in ``RAW_KEY_EXCLUDE``.
+        Returns None if no results are cached.
     """
-        For each key in the key signature add a nested key to the hash.
+    return _get_cached(build_raw_key_signature(request_meta,
+                                               hash_result=True),
+                       request_meta)
 
-        Parameters
-        ~~~~~~~~~~
+
+def set_raw_data(data, request_meta):
     """
-    if not hasattr(key_sig, '__iter___'):
-        key_sig = [key_sig]
-
-    last_item = key_sig[len(key_sig) - 1]
-    for key in key_sig:
-        if key != last_item:
-            if hasattr(hash_table_ref, 'keys') and key in hash_table_ref:
-                hash_table_ref = hash_table_ref[key]
-            else:
-                # Item not found
-                return None
-        else:
-            if hasattr(hash_table_ref, 'keys') and \
-                key in hash_table_ref:
-                    return hash_table_ref[key]
-            # Item not found
-            return None
+        Store raw metric results for a request keyed on its raw key
+        signature.  These entries are not listed by
+        ``get_cached_key_signatures``.
+    """
+    key_sig = build_raw_key_signature(request_meta, hash_result=True)
+    logging.debug(__name__ + " :: Adding raw results to cache @ key "
+                             "signature = {0}".format(str(key_sig)))
+    _set_cached(key_sig, None, data, request_meta)
+
+
+def _get_cached(key_sig, request_meta):
+    """ Fetch an unexpired entry of the response cache """
+    cache = _get_response_cache()
+    row = cache.execute('SELECT data, cohort_gen_timestamp, created '
+                        'FROM api_data WHERE key = ?', (key_sig,)).fetchone()
+    if not row:
+        return None
+
+    # Invalidate entries that have expired or that were computed before
+    # the latest refresh of the cohort
+    cohort_gen_timestamp = getattr(request_meta, 'cohort_gen_timestamp', None)
+    if row[2] + CACHE_TTL < time() or \
+            (cohort_gen_timestamp and row[1] and
+             str(cohort_gen_timestamp) != row[1]):
+        logging.debug(__name__ + ' :: Invalidating cached data for {0}'.
+                      format(key_sig))
+        cache.execute('DELETE FROM api_data WHERE key = ?', (key_sig,))
+        return None
+
+    cache.execute('UPDATE api_data SET accessed = ? WHERE key = ?',
+                  (time(), key_sig))
+    try:
+        return cPickle.loads(str(row[0]))
+    except (cPickle.UnpicklingError, EOFError, ValueError):
+        logging.error(__name__ + ' :: Failed to retrieve {0}'.
+                      format(key_sig))
+        return None
+
+
+def _set_cached(key_sig, key_sig_full, data, request_meta):
+    """ Store an entry in the response cache and evict stale entries """
+    blob = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+    cohort_gen_timestamp = getattr(request_meta, 'cohort_gen_timestamp', None)
+    if key_sig_full is not None:
+        key_sig_full = sqlite3.Binary(
+            cPickle.dumps(key_sig_full, cPickle.HIGHEST_PROTOCOL))
+    now = time()
+
+    cache = _get_response_cache()
+    cache.execute('INSERT OR REPLACE INTO api_data (key, key_sig, data, '
+                  'size, cohort_gen_timestamp, created, accessed) '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  (key_sig, key_sig_full, sqlite3.Binary(blob), len(blob),
+                   str(cohort_gen_timestamp) if cohort_gen_timestamp
+                   else None,
+                   now, now))
+    evict_data(now)
+
+
+def evict_data(now=None):
+    """
+        Remove expired responses from the cache, then the least recently used
+        responses while the cache exceeds ``CACHE_MAX_SIZE``.
+    """
+    now = now if now else time()
+    cache = _get_response_cache()
+    cache.execute('DELETE FROM api_data WHERE created < ?',
+                  (now - CACHE_TTL,))
+
+    excess = cache.execute('SELECT COALESCE(SUM(size), 0) FROM api_data').\
+        fetchone()[0] - CACHE_MAX_SIZE
+    if excess <= 0:
+        return
+
+    evicted = list()
+    for key, size in cache.execute('SELECT key, size FROM api_data '
+                                   'ORDER BY accessed'):
+        if excess <= 0:
+            break
+        evicted.append((key,))
+        excess -= size
+    cache.executemany('DELETE FROM api_data WHERE key = ?', evicted)
+    logging.debug(__name__ + ' :: Evicted {0} cached responses.'.
+                  format(len(evicted)))
+
+
+def get_cached_key_signatures():
+    """ Returns the key signatures of all cached responses """
+    key_sigs = list()
+    for row in _get_response_cache().execute('SELECT key_sig FROM api_data '
+                                             'WHERE key_sig IS NOT NULL'):
+        try:
+            key_sigs.append(cPickle.loads(str(row[0])))
+        except (cPickle.UnpicklingError, EOFError, ValueError):
+            logging.error(__name__ + ' :: Could not read key signature.')
+    return key_sigs
 
 
 def build_key_signature(request_meta, hash_result=False):
@@ -233,6 +314,24 @@ def build_key_signature(request_meta, hash_result=False):
         return key_sig
 
 
+def build_raw_key_signature(request_meta, hash_result=False):
+    """
+        Given a RequestMeta object contruct the key of its raw metric
+        results, the key signature omitting ``RAW_KEY_EXCLUDE`` parameters.
+        Hashed raw keys are distinct from hashed key signatures.
+    """
+    key_sig = build_key_signature(request_meta)
+    if not key_sig:
+        return ''
+    key_sig = [key for key in key_sig
+               if key.split(HASH_KEY_DELIMETER)[0] not in RAW_KEY_EXCLUDE]
+
+    if hash_result:
+        return sha1('raw' + str(key_sig).encode('utf-8')).hexdigest()
+    else:
+        return key_sig
+
+
 def get_url_from_keys(keys, path_root):
     """ Compose a url from a set of keys """
     query_str = ''
@@ -252,19 +351,30 @@ def get_url_from_keys(keys, path_root):
     return url
 
 
-def read_pickle_data():
-    try:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'rb') as pkl_file:
-            return cPickle.load(pkl_file)
-    except IOError:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'wb') as pkl_file:
-            data = OrderedDict()
-            cPickle.dump(data, pkl_file)
-            return data
-
-def write_pickle_data(obj):
-    with open(settings.__data_file_dir__ +
-              'api_data.pkl', 'wb') as pkl_file:
-        cPickle.dump(obj, pkl_file)
\ No newline at end of file
+# The response cache connection of this process, sqlite connections must
+# not be shared with forked children
+_CACHE_CONN = None
+_CACHE_PID = None
+
+
+def _get_response_cache():
+    """ Returns the connection to the response cache for this process """
+    global _CACHE_CONN, _CACHE_PID
+    if _CACHE_CONN is None or _CACHE_PID != getpid():
+        _CACHE_CONN = sqlite3.connect(settings.__data_file_dir__ +
+                                      CACHE_FILE_NAME,
+                                      timeout=30, isolation_level=None,
+                                      check_same_thread=False)
+        _CACHE_CONN.execute('PRAGMA journal_mode=WAL')
+        _CACHE_CONN.execute('CREATE TABLE IF NOT EXISTS api_data ('
+                            'key TEXT PRIMARY KEY, '
+                            'key_sig BLOB, '
+                            'data BLOB, '
+                            'size INTEGER, '
+                            'cohort_gen_timestamp TEXT, '
+                            'created REAL, '
+                            'accessed REAL)')
+        _CACHE_CONN.execute('CREATE INDEX IF NOT EXISTS api_data_accessed '
+                            'ON api_data (accessed)')
+        _CACHE_PID = getpid()
+    return _CACHE_CONN
@@ -21,6 +21,14 @@
     state.  The job remains in either of these states until it is cleared
     from the process queue.
 
+    Pending jobs are scheduled by request type, raw requests ahead of
+    aggregate requests ahead of time series requests, and up to
+    ``MAX_CONCURRENT_JOBS`` jobs run at once.  Each job posts a completion
+    message on the request queue so that the next job is dispatched as soon
+    as a slot frees.  Raw metric results are cached and shared by requests
+    that differ only in their aggregator, so a pending job is held back
+    while a job computing the same raw results is running.
+
     Response Data
     ^^^^^^^^^^^^^
 
@@ -40,7 +48,8 @@
             all cohorts in expression)
         metric := str, user metric handle
         timeseries := boolean, indicates if this is a timeseries
-        aggregator := str, aggregator used
+        aggregator := str, aggregator used, or comma separated aggregators
+            computed together e.g. "mean,median,max"
         start := str, start datetime of request
         end := str, end datetime of request
         metric_param := -, optional metric parameters
@@ -62,7 +71,9 @@
     - **Raw requests**.  Output is a set of datapoints that consist of the
       user IDs accompanied by metric results.
     - **Aggregate requests**.  Output is an aggregate of all user results based
-      on the type of aggregaion as defined in the aggregator module.
+      on the type of aggregaion as defined in the aggregator module.  When
+      several aggregators are requested their headers and data are
+      concatenated in the order requested.
     - **Time series requests**.  Outputs a time series list of data.  For this
       type of request a start and end time must be defined along with an
       interval length.  Further an aggregator must be provided which operates
@@ -85,18 +96,24 @@ from user_metrics.config import logging, settings
 from user_metrics.api import MetricsAPIError, error_codes, query_mod, \
     REQ_NCB_LOCK, REQUEST_PATH
 from user_metrics.api.engine.data import get_users, get_url_from_keys, \
-    build_key_signature
-from user_metrics.api.engine.request_meta import rebuild_unpacked_request
+    build_key_signature, build_raw_key_signature, get_raw_data, set_raw_data
+from user_metrics.api.engine.request_meta import rebuild_unpacked_request, \
+    get_request_type, request_types
 from user_metrics.metrics.users import MediaWikiUser
 from user_metrics.metrics.user_metric import UserMetricError
 from user_metrics.utils import unpack_fields
+import user_metrics.utils.multiprocessing_wrapper as mpw
 
 from multiprocessing import Process, Queue
 from collections import namedtuple
-from os import getpid
-from sys import getsizeof
+from os import getpid, fdopen, remove
 from Queue import Empty
 from time import sleep
+from tempfile import mkstemp
+from heapq import heappush, heappop
+from itertools import chain
+import cPickle
+import struct
 
 
 # API JOB HANDLER
@@ -109,12 +126,89 @@ api_response_queue = Queue()
 
 # MODULE CONSTANTS
 #
-# 1. Determines maximum block size of queue item
+# 1. Maximum size of a response payload sent inline over a queue, larger
+#    payloads are handed off in a temporary file
 # 2. Number of maximum concurrently running jobs
-# 3. Time to block on waiting for a new request to appear in the queue
-MAX_BLOCK_SIZE = 5000
-MAX_CONCURRENT_JOBS = 1
+# 3. Time to block on the request queue before checking for jobs that
+#    exited without signalling completion
+# 4. Number of worker processes of each concurrent job, jobs share
+#    ``settings.__process_max__``
+MAX_INLINE_RESPONSE_SIZE = 1 << 20
+MAX_CONCURRENT_JOBS = settings.__max_concurrent_jobs__
 QUEUE_WAIT = 5
+JOB_PROCESS_MAX = settings.__process_max__ / MAX_CONCURRENT_JOBS
+
+# Scheduling priority of each request type, pending jobs with lower values
+# are dispatched first and jobs of equal priority in order of arrival
+JOB_PRIORITY = {
+    request_types.raw: 0,
+    request_types.aggregator: 1,
+    request_types.time_series: 2,
+}
+
+# Message type posted on the request queue by jobs on completion
+JOB_COMPLETE = 'job_complete'
+
+# Response records are framed by a header holding the record type and the
+# payload length.  The payload is a protocol 2 pickle of the response, or
+# for file records the path of the temporary file storing the pickle.
+RESPONSE_HEADER = struct.Struct('!cQ')
+RESPONSE_INLINE = 'i'
+RESPONSE_FILE = 'f'
+RESPONSE_PICKLE_PROTOCOL = 2
+
+
+class ResponseTransportError(Exception):
+    """ Basic exception class for response records """
+    def __init__(self, message="Malformed response record."):
+        Exception.__init__(self, message)
+
+
+def pack_response(data):
+    """
+        Serialize a response into a framed record to be put on a queue.
+        Payloads larger than ``MAX_INLINE_RESPONSE_SIZE`` are written to a
+        temporary file that is removed by ``unpack_response``.
+    """
+    payload = cPickle.dumps(data, RESPONSE_PICKLE_PROTOCOL)
+    if len(payload) <= MAX_INLINE_RESPONSE_SIZE:
+        return RESPONSE_HEADER.pack(RESPONSE_INLINE, len(payload)) + payload
+
+    fd, path = mkstemp(prefix='um_response_')
+    with fdopen(fd, 'wb') as response_file:
+        response_file.write(payload)
+    return RESPONSE_HEADER.pack(RESPONSE_FILE, len(payload)) + path
+
+
+def unpack_response(record):
+    """ Deserialize a record built by ``pack_response`` """
+    try:
+        record_type, size = RESPONSE_HEADER.unpack_from(record)
+    except (struct.error, TypeError) as e:
+        raise ResponseTransportError(__name__ + ' :: ' + str(e))
+    body = record[RESPONSE_HEADER.size:]
+
+    if record_type == RESPONSE_FILE:
+        try:
+            with open(body, 'rb') as response_file:
+                payload = response_file.read()
+            remove(body)
+        except (IOError, OSError) as e:
+            raise ResponseTransportError(__name__ + ' :: ' + str(e))
+    elif record_type == RESPONSE_INLINE:
+        payload = body
+    else:
+        raise ResponseTransportError(__name__ + ' :: Unknown record type '
+                                                '"{0}".'.format(record_type))
+
+    if len(payload) != size:
+        raise ResponseTransportError(__name__ + ' :: Truncated response, '
+                                                'expected {0} bytes, got {1}.'.
+                                     format(size, len(payload)))
+    try:
+        return cPickle.loads(payload)
+    except (cPickle.UnpicklingError, EOFError, ValueError) as e:
+        raise ResponseTransportError(__name__ + ' :: ' + str(e))
 
 
 # Defines the job item type used to temporarily store job progress
@@ -123,127 +217,149 @@ job_item_type = namedtuple('JobItem', 'id process request queue')
 
 def job_control(request_queue, response_queue):
     """
-        Controls the execution of user metrics requests
+        Controls the execution of user metrics requests.  Pending requests
+        are scheduled by priority, see ``JOB_PRIORITY``, and dispatched as
+        soon as fewer than ``MAX_CONCURRENT_JOBS`` jobs are running.  Jobs
+        post a completion message on the request queue when they finish.
 
         Parameters
         ~~~~~~~~~~
 
         request_queue : multiprocessing.Queue
-           Queues incoming API requests.
+           Queues incoming API requests and job completion messages.
+
+        response_queue : multiprocessing.Queue
+           Queues responses of completed jobs for the response handler.
 
     """
 
-    # Store executed and pending jobs respectively
-    job_queue = list()
+    # Store running jobs keyed on job ID and a heap of pending jobs
+    job_queue = dict()
     wait_queue = list()
 
     # Global job ID number
     job_id = 0
 
-    # Tallies the number of concurrently running jobs
-    concurrent_jobs = 0
-
     log_name = '{0} :: {1}'.format(__name__, job_control.__name__)
 
     logging.debug('{0} - STARTING...'.format(log_name))
 
     while 1:
 
-        # Request Queue Processing
-        # ------------------------
+        # Process pending jobs
+        # --------------------
 
-        try:
-            # Pull an item off of the queue
+        # Jobs sharing raw results with a running job are deferred
+        deferred = list()
+        running_raw_keys = set(get_raw_key(job_item.request)
+                               for job_item in job_queue.itervalues())
 
-            req_item = request_queue.get(timeout=QUEUE_WAIT)
+        while wait_queue and len(job_queue) < MAX_CONCURRENT_JOBS:
+            wait_item = heappop(wait_queue)
+            priority, wait_id, wait_req = wait_item
 
-            logging.debug(log_name + ' :: PULLING item from request queue -> ' \
-                                     '\n\tCOHORT = {0} - METRIC = {1}'
-                .format(req_item['cohort_expr'], req_item['metric']))
+            raw_key = get_raw_key(wait_req)
+            if raw_key and raw_key in running_raw_keys:
+                deferred.append(wait_item)
+                continue
+            running_raw_keys.add(raw_key)
 
-        except Exception as e:
-            req_item = None
-            #logging.debug('{0} :: {1}  - Listening ...'
-            #.format(__name__, job_control.__name__))
+            req_q = Queue()
+            proc = Process(target=process_metrics,
+                           args=(req_q, wait_req, wait_id, request_queue))
+            proc.start()
 
+            job_queue[wait_id] = job_item_type(wait_id, proc, wait_req, req_q)
 
-        # Process complete jobs
-        # ---------------------
+            logging.debug(log_name + ' :: WAIT -> RUN - Job ID {0}' \
+                                     '\n\tConcurrent jobs = {1}, ' \
+                                     'COHORT = {2} - METRIC = {3}'\
+                .format(str(wait_id), len(job_queue),
+                        wait_req.cohort_expr, wait_req.metric))
 
-        for job_item in job_queue:
+        for wait_item in deferred:
+            heappush(wait_queue, wait_item)
 
-            # Look for completed jobs
-            if not job_item.queue.empty():
-
-                # Put request creds on res queue -- this goes to
-                # response_handler asynchronously
-                response_queue.put(unpack_fields(job_item.request),
-                                   block=True)
+        # Request Queue Processing
+        # ------------------------
 
-                # Pull data off of the queue and add it to response queue
-                while not job_item.queue.empty():
-                    data = job_item.queue.get(True)
-                    if data:
-                        response_queue.put(data, block=True)
+        try:
+            req_item = request_queue.get(timeout=QUEUE_WAIT)
+        except Empty:
+            # Reap jobs that exited without signalling completion
+            for job_item in job_queue.values():
+                if not job_item.process.is_alive():
+                    logging.error(log_name + ' :: Job ID {0} exited without '
+                                             'completing.'.format(job_item.id))
+                    complete_job(job_item, response_queue)
+                    del job_queue[job_item.id]
+            continue
 
-                del job_queue[job_queue.index(job_item)]
+        # Process complete jobs
+        # ---------------------
 
-                concurrent_jobs -= 1
+        if isinstance(req_item, tuple) and req_item[0] == JOB_COMPLETE:
+            if req_item[1] in job_queue:
+                complete_job(job_queue.pop(req_item[1]), response_queue)
 
                 logging.debug(log_name + ' :: RUN -> RESPONSE - Job ID {0}' \
                                          '\n\tConcurrent jobs = {1}'
-                    .format(str(job_item.id), concurrent_jobs))
-
-
-        # Process pending jobs
-        # --------------------
-
-        for wait_req in wait_queue:
-            if concurrent_jobs <= MAX_CONCURRENT_JOBS:
-                # prepare job from item
-
-                req_q = Queue()
-                proc = Process(target=process_metrics, args=(req_q, wait_req))
-                proc.start()
+                    .format(str(req_item[1]), len(job_queue)))
+            continue
 
-                job_item = job_item_type(job_id, proc, wait_req, req_q)
-                job_queue.append(job_item)
+        # Add newest job to the queue
+        # ---------------------------
 
-                del wait_queue[wait_queue.index(wait_req)]
+        logging.debug(log_name + ' :: PULLING item from request queue -> ' \
+                                 '\n\tCOHORT = {0} - METRIC = {1}'
+            .format(req_item['cohort_expr'], req_item['metric']))
 
-                concurrent_jobs += 1
-                job_id += 1
+        # Build the request item
+        rm = rebuild_unpacked_request(req_item)
 
-                logging.debug(log_name + ' :: WAIT -> RUN - Job ID {0}' \
-                                         '\n\tConcurrent jobs = {1}, ' \
-                                         'COHORT = {2} - METRIC = {3}'\
-                    .format(str(job_id), concurrent_jobs,
-                            wait_req.cohort_expr, wait_req.metric))
+        logging.debug(log_name + ' : REQUEST -> WAIT ' \
+                                 '\n\tCOHORT = {0} - METRIC = {1}'
+            .format(rm.cohort_expr, rm.metric))
+        heappush(wait_queue, (JOB_PRIORITY[get_request_type(rm)], job_id, rm))
+        job_id += 1
 
+        # Communicate with request notification callback about new job
+        key_sig = build_key_signature(rm, hash_result=True)
+        url = get_url_from_keys(build_key_signature(rm), REQUEST_PATH)
+        req_cb_add_req(key_sig, url, REQ_NCB_LOCK)
 
-        # Add newest job to the queue
-        # ---------------------------
-
-        if req_item:
+    logging.debug('{0} - FINISHING.'.format(log_name))
 
-            # Build the request item
-            rm = rebuild_unpacked_request(req_item)
 
-            logging.debug(log_name + ' : REQUEST -> WAIT ' \
-                                     '\n\tCOHORT = {0} - METRIC = {1}'
-                .format(rm.cohort_expr, rm.metric))
-            wait_queue.append(rm)
+def get_raw_key(request_meta):
+    """
+        Returns the hashed raw key signature of requests serviced from raw
+        metric results or None for time series requests.
+    """
+    if get_request_type(request_meta) == request_types.time_series:
+        return None
+    return build_raw_key_signature(request_meta, hash_result=True)
 
-            # Communicate with request notification callback about new job
-            key_sig = build_key_signature(rm, hash_result=True)
-            url = get_url_from_keys(build_key_signature(rm), REQUEST_PATH)
-            req_cb_add_req(key_sig, url, REQ_NCB_LOCK)
 
+def complete_job(job_item, response_queue):
+    """
+        Hands the response of a finished job to the response handler and
+        cleans up its process.
+    """
+    try:
+        record = job_item.queue.get(True, timeout=QUEUE_WAIT)
+    except Empty:
+        record = pack_response(__name__ + ' :: Job exited without a '
+                                          'response.')
 
-    logging.debug('{0} - FINISHING.'.format(log_name))
+    # Put request creds on res queue followed by the response record -- this
+    # goes to response_handler asynchronously
+    response_queue.put(unpack_fields(job_item.request), block=True)
+    response_queue.put(record, block=True)
+    job_item.process.join()
 
 
-def process_metrics(p, request_meta):
+def process_metrics(p, request_meta, job_id=None, event_queue=None):
     """
         Worker process for requests, forked from the job controller.  This
         method handles:
@@ -251,6 +367,33 @@ def process_metrics(p, request_meta):
             * Filtering cohort type: "regular" cohort, single user, user group
             * Secondary validation
             *
+
+        A single response record is always put on ``p``, on completion the
+        message ``(JOB_COMPLETE, job_id)`` is put on ``event_queue``.
+    """
+
+    log_name = '{0} :: {1}'.format(__name__, process_metrics.__name__)
+
+    # Concurrent jobs each get a share of the worker processes
+    mpw.limit_pool(JOB_PROCESS_MAX)
+
+    try:
+        response = _process_metrics(request_meta)
+    except Exception as e:
+        logging.error(log_name + ' - Job failed: {0}'.format(str(e)))
+        response = __name__ + ' :: Request failed. ' + str(e)
+
+    try:
+        p.put(pack_response(response), block=True)
+    finally:
+        if event_queue:
+            event_queue.put((JOB_COMPLETE, job_id), block=True)
+
+
+def _process_metrics(request_meta):
+    """
+        Computes the response for a request, see ``process_metrics``.
+        Returns the results of the request or an error message.
     """
 
     log_name = '{0} :: {1}'.format(__name__, process_metrics.__name__)
@@ -262,6 +405,7 @@ def process_metrics(p, request_meta):
 
     err_msg = __name__ + ' :: Request failed.'
     users = list()
+    raw_results = None
 
     # obtain user list - handle the case where a lone user ID is passed
     # !! The username should already be validated
@@ -277,16 +421,29 @@ def process_metrics(p, request_meta):
 
     # The "all" user group.  All users within a time period.
     elif request_meta.cohort_expr == 'all':
-        users = MediaWikiUser(query_type=1)
 
-        try:
-            users = [u for u in users.get_users(
-                request_meta.start, request_meta.end,
-                project=request_meta.project)]
+        # Cached raw results are used without opening a stream over the users
+        if not request_meta.refresh and get_request_type(request_meta) != \
+                request_types.time_series:
+            raw_results = get_raw_data(request_meta)
+
+        # Users are streamed, the first is read here so that a failed
+        # query is reported before the request is processed
+        if raw_results is not None:
             valid = True
-        except Exception:
-            valid = False
-            err_msg = error_codes[5]
+        else:
+            try:
+                users = MediaWikiUser(query_type=1).get_users(
+                    request_meta.start, request_meta.end,
+                    project=request_meta.project, stream=True)
+                users = chain([users.next()], users)
+                valid = True
+            except StopIteration:
+                users = []
+                valid = True
+            except Exception:
+                valid = False
+                err_msg = error_codes[5]
 
     # "TYPICAL" COHORT PROCESSING
     else:
@@ -305,33 +462,21 @@ def process_metrics(p, request_meta):
 
     if valid:
         # process request
-        results = process_data_request(request_meta, users)
-        results = str(results)
-        response_size = getsizeof(results, None)
-
-        if response_size > MAX_BLOCK_SIZE:
-            index = 0
-
-            # Dump the data in pieces - block until it is picked up
-            while index < response_size:
-                p.put(results[index:index+MAX_BLOCK_SIZE], block=True)
-                index += MAX_BLOCK_SIZE
-        else:
-            p.put(results, block=True)
+        results = process_data_request(request_meta, users,
+                                       raw_results=raw_results)
 
         logging.info(log_name + ' - END JOB'
                                 '\n\tCOHORT = {0} - METRIC = {1}'
                                 ' -  PID = {2})'.
             format(request_meta.cohort_expr, request_meta.metric, getpid()))
+        return results
 
     else:
-        p.put(err_msg, block=True)
         logging.info(log_name + ' - END JOB - FAILED.'
                                 '\n\tCOHORT = {0} - METRIC = {1}'
                                 ' -  PID = {2})'.
         format(request_meta.cohort_expr, request_meta.metric, getpid()))
-
-
+        return err_msg
 
 
 # REQUEST FLOW HANDLER
@@ -360,7 +505,7 @@ DEFAULT_INERVAL_LENGTH = 24
 # create shorthand method refs
 to_string = DataLoader().cast_elems_to_string
 
-def process_data_request(request_meta, users):
+def process_data_request(request_meta, users, raw_results=None):
     """
         Main entry point of the module, prepares results for a given request.
         Coordinates a request based on the following parameters::
@@ -370,6 +515,9 @@ def process_data_request(request_meta, users):
 
             users (list) - list of user IDs.
 
+            raw_results (list) - raw metric results already read from the
+            cache for the request, used in place of processing ``users``.
+
             **kwargs - Keyword arguments may contain a variety of variables.
             Most notably, "aggregator" if the request requires aggregation,
             "time_series" flag indicating a time series request.  The
@@ -391,6 +539,11 @@ def process_data_request(request_meta, users):
     # Initialize the results
     results, metric_class, metric_obj = format_response(request_meta)
 
+    # Only aggregate requests consume streamed users in batches
+    if not hasattr(users, '__len__') and \
+            results['type'] != request_types.aggregator:
+        users = list(users)
+
     start = metric_obj.datetime_start
     end = metric_obj.datetime_end
 
@@ -407,7 +560,8 @@ def process_data_request(request_meta, users):
         total_intervals = (date_parse(end) - date_parse(start)).\
                           total_seconds() / (3600 * request_meta.slice)
         time_threads = max(1, int(total_intervals / INTERVALS_PER_THREAD))
-        time_threads = min(MAX_THREADS, time_threads)
+        time_threads = min(MAX_THREADS, max(1, JOB_PROCESS_MAX),
+                           time_threads)
 
         logging.info(__name__ + ' :: Initiating time series for %(metric)s\n'
                                 '\tAGGREGATOR = %(agg)s\n'
@@ -468,17 +622,25 @@ def process_data_request(request_meta, users):
                                     })
 
         try:
-            metric_obj.process(users,
-                               k_=USER_THREADS,
-                               kr_=REVISION_THREADS,
-                               log_=True,
-                               **args)
+            if raw_results is not None or hasattr(users, '__len__'):
+                process_raw_results(metric_obj, users, request_meta, args,
+                                    raw_results=raw_results)
+                r = um.aggregator(aggregator_func, metric_obj,
+                                  metric_obj.header())
+            else:
+                # Results of streamed users are aggregated batch by batch
+                # and are not kept, so they are not added to the raw cache
+                r = um.stream_aggregator(aggregator_func, metric_obj, users,
+                                         metric_obj.header(),
+                                         k_=USER_THREADS,
+                                         kr_=REVISION_THREADS,
+                                         log_=True,
+                                         **args)
         except UserMetricError as e:
             logging.error(__name__ + ' :: Metrics call failed: ' + str(e))
             results['data'] = str(e)
             return results
 
-        r = um.aggregator(aggregator_func, metric_obj, metric_obj.header())
         results['header'] = to_string(r.header)
         results['data'] = r.data[1:]
 
@@ -492,11 +654,8 @@ def process_data_request(request_meta, users):
                                     'end': str(end),
                                     })
         try:
-            metric_obj.process(users,
-                               k_=USER_THREADS,
-                               kr_=REVISION_THREADS,
-                               log_=True,
-                               **args)
+            process_raw_results(metric_obj, users, request_meta, args,
+                                raw_results=raw_results)
         except UserMetricError as e:
             logging.error(__name__ + ' :: Metrics call failed: ' + str(e))
             results['data'] = str(e)
@@ -508,6 +667,32 @@ def process_data_request(request_meta, users):
     return results
 
 
+def process_raw_results(metric_obj, users, request_meta, args,
+                        raw_results=None):
+    """
+        Populates the results of ``metric_obj`` from the raw result cache,
+        otherwise processes the metric and caches its results for requests
+        differing only in aggregator.  Refreshed requests always process the
+        metric and replace any cached results.  Raw results already read
+        from the cache may be passed as ``raw_results``.
+    """
+    if raw_results is None and not request_meta.refresh:
+        raw_results = get_raw_data(request_meta)
+    if raw_results is not None:
+        logging.info(__name__ + ' :: Using cached raw results for '
+                                '{0}.'.format(str(request_meta)))
+        metric_obj._set_results(raw_results)
+        return metric_obj
+
+    metric_obj.process(users,
+                       k_=USER_THREADS,
+                       kr_=REVISION_THREADS,
+                       log_=True,
+                       **args)
+    set_raw_data(metric_obj._results, request_meta)
+    return metric_obj
+
+
 # REQUEST NOTIFICATIONS
 # #####################
 
@@ -595,6 +780,21 @@ def requests_notification_callback(msg_queue_in, msg_queue_out):
                     format(str(msg)))
             except (KeyError, ValueError):
                 logging.error(log_name + ' - Get URL failed: {0}'.format(str(msg)))
+
+        # Initialize request unless it is running - replies whether the
+        # request was initialized
+        elif type == 5:
+            try:
+                if msg[1] in job_list and job_list[msg[1]][0]:
+                    msg_queue_out.put([False], True)
+                else:
+                    job_list[msg[1]] = [True, msg[2]]
+                    msg_queue_out.put([True], True)
+                logging.debug(log_name + ' - Try initialize Request: ' \
+                                         '{0}.'.format(str(msg)))
+            except (KeyError, ValueError, IndexError):
+                logging.error(log_name + ' - Try initialize Request' \
+                                         ' failed: {0}'.format(str(msg)))
         else:
             logging.error(log_name + ' - Bad message: {0}'.format(str(msg)))
 
@@ -609,52 +809,76 @@ BLOCK_TIMEOUT = 1
 
 def req_cb_get_url(key, lock):
     lock.acquire()
-    req_notification_queue_in.put([4, key], block=True)
     try:
-        val = req_notification_queue_out.get(True, timeout=BLOCK_TIMEOUT)[0]
+        req_notification_queue_in.put([4, key], block=True)
+        return req_notification_queue_out.get(True,
+                                              timeout=BLOCK_TIMEOUT)[0]
     except Empty:
         logging.error(__name__ + ' :: req_cb_get_url -'
                                  ' Block time expired.')
         return ''
-    lock.release()
-    return val
+    finally:
+        lock.release()
 
 
 def req_cb_get_cache_keys(lock):
     lock.acquire()
-    req_notification_queue_in.put([3], block=True)
     try:
-        val =  req_notification_queue_out.get(block=True,
+        req_notification_queue_in.put([3], block=True)
+        return req_notification_queue_out.get(block=True,
                                               timeout=BLOCK_TIMEOUT)
     except Empty:
         logging.error(__name__ + ' :: req_cb_get_cache_keys -'
                                  ' Block time expired.')
         return []
-    lock.release()
-    return val
+    finally:
+        lock.release()
 
 
 def req_cb_get_is_running(key, lock):
     lock.acquire()
-    req_notification_queue_in.put([2, key], True)
     try:
-        val =  req_notification_queue_out.get(block=True,
+        req_notification_queue_in.put([2, key], True)
+        return req_notification_queue_out.get(block=True,
                                               timeout=BLOCK_TIMEOUT)[0]
     except Empty:
         logging.error(__name__ + ' :: req_cb_get_is_running -'
                                  ' Block time expired.')
         return False
-    lock.release()
-    return val
+    finally:
+        lock.release()
 
 
 def req_cb_add_req(key, url, lock):
     lock.acquire()
-    req_notification_queue_in.put([0, key, url])
-    lock.release()
+    try:
+        req_notification_queue_in.put([0, key, url])
+    finally:
+        lock.release()
+
+
+def req_cb_try_add_req(key, url, lock):
+    """
+        Atomically flags a request as running unless it already is.  Returns
+        True if the request was flagged by this call, in which case the
+        caller is responsible for queueing it.
+    """
+    lock.acquire()
+    try:
+        req_notification_queue_in.put([5, key, url], True)
+        return req_notification_queue_out.get(block=True,
+                                              timeout=BLOCK_TIMEOUT)[0]
+    except Empty:
+        logging.error(__name__ + ' :: req_cb_try_add_req -'
+                                 ' Block time expired.')
+        return False
+    finally:
+        lock.release()
 
 
 def req_cb_flag_job_complete(key, lock):
     lock.acquire()
-    req_notification_queue_in.put([1, key], True)
-    lock.release()
\ No newline at end of file
+    try:
+        req_notification_queue_in.put([1, key], True)
+    finally:
+        lock.release()
@@ -72,8 +72,11 @@ def RequestMetaFactory(cohort_expr, cohort_gen_timestamp, metric_expr):
             **cohort_gen_timestamp**    - string. Timestamp of last cohort
             update.
             **metric_expr**             - string. Metric id from url.
+
+        The ``refresh`` attribute is set on requests that must be recomputed
+        rather than served from the response cache.
     """
-    default_params = 'cohort_expr cohort_gen_timestamp metric '
+    default_params = 'cohort_expr cohort_gen_timestamp metric refresh '
     additional_params = ''
 
     try:
@@ -86,8 +89,8 @@ def RequestMetaFactory(cohort_expr, cohort_gen_timestamp, metric_expr):
     additional_params = additional_params[:-1]
     params = default_params + additional_params
 
-    arg_list = ['cohort_expr', 'cohort_gen_timestamp', 'metric_expr'] +\
-               ['None'] * \
+    arg_list = ['cohort_expr', 'cohort_gen_timestamp', 'metric_expr',
+                'None'] + ['None'] * \
                len(ParameterMapping.QUERY_PARAMS_BY_METRIC[metric_expr])
     arg_str = "(" + ",".join(arg_list) + ")"
 
@@ -316,6 +319,10 @@ from user_metrics.metrics.edit_rate import EditRate, edit_rate_agg, \
 from user_metrics.metrics.namespace_of_edits import NamespaceEdits, \
     namespace_edits_sum
 from user_metrics.metrics.live_account import LiveAccount, live_accounts_agg
+from user_metrics.etl.aggregator import build_multi_agg
+
+# Separates the handles of aggregators requested together
+AGGREGATOR_SEP = ','
 
 
 # Registered metrics types
@@ -360,11 +367,20 @@ def get_metric_type(metric):
 
 
 def get_aggregator_type(agg):
+    """
+        Returns the aggregator for a key of ``aggregator_dict``.  Keys joined
+        by ``AGGREGATOR_SEP`` give one aggregator computing all of them.
+    """
     try:
-        return aggregator_dict[agg]
-    except KeyError:
+        agg_methods = [aggregator_dict[key]
+                       for key in agg.split(AGGREGATOR_SEP)]
+    except (KeyError, AttributeError):
         raise MetricsAPIError(__name__ + ' :: Bad aggregator name.')
 
+    if len(agg_methods) == 1:
+        return agg_methods[0]
+    return build_multi_agg(agg_methods)
+
 
 def get_metric_names():
     """ Returns the names of metric handles as defined by this module """
@@ -382,14 +398,20 @@ def get_param_types(metric_handle):
 
 
 def get_agg_key(agg_handle, metric_handle):
-    """ Compose the metric dependent aggregator handle """
+    """
+        Compose the metric dependent aggregator handle.  Several aggregators
+        may be requested together by separating their handles with
+        ``AGGREGATOR_SEP``, e.g. "mean,median,max".
+    """
     try:
-        agg_key = '+'.join([agg_handle, metric_handle])
-        if agg_key in aggregator_dict:
-            return agg_key
-        else:
-            return ''
-    except TypeError:
+        agg_keys = ['+'.join([handle, metric_handle])
+                    for handle in agg_handle.split(AGGREGATOR_SEP)]
+    except (TypeError, AttributeError):
+        return ''
+
+    if all(agg_key in aggregator_dict for agg_key in agg_keys):
+        return AGGREGATOR_SEP.join(agg_keys)
+    else:
         return ''
 
 
@@ -13,14 +13,10 @@ from user_metrics.config import logging
 from user_metrics.api import REQ_NCB_LOCK
 from user_metrics.api.engine.request_meta import rebuild_unpacked_request
 from user_metrics.api.engine.data import set_data, build_key_signature
-from user_metrics.api.engine.request_manager import req_cb_flag_job_complete
-from Queue import Empty
+from user_metrics.api.engine.request_manager import \
+    req_cb_flag_job_complete, unpack_response, ResponseTransportError
 from flask import escape
 
-# Timeout in seconds to wait for data on the queue.  This should be long
-# enough to ensure that the full response can be received
-RESPONSE_TIMEOUT = 0.1
-
 
 # API RESPONSE HANDLER
 # ####################
@@ -33,8 +29,6 @@ def process_responses(response_queue, msg_in):
     logging.debug(log_name  + ' - STARTING...')
 
     while 1:
-        stream = ''
-
         # Block on the response queue
         try:
             res = response_queue.get(True)
@@ -43,41 +37,33 @@ def process_responses(response_queue, msg_in):
             logging.error(log_name + ' - Could not get request meta')
             continue
 
-        data = response_queue.get(True)
-        while data:
-            stream += data
-            try:
-                data = response_queue.get(True, timeout=1)
-            except Empty:
-                break
-
         try:
-            data = eval(stream)
-        except Exception as e:
+            data = unpack_response(response_queue.get(True))
+        except ResponseTransportError as e:
+            logging.error(log_name + ' - Request failed. {0}'.format(
+                e.message))
+            data = failed_response(e.message, request_meta)
 
-            # Report a fraction of the failed response data directly in the
-            # logger
-            if len(unicode(stream)) > 2000:
-                excerpt = stream[:1000] + ' ... ' + stream[-1000:]
-            else:
-                excerpt = stream
-
-            logging.error(log_name + ' - Request failed. {0}\n\n' \
-                                     'data excerpt: {1}'.format(e.message, excerpt))
-
-            # Format a response that will report on the failed request
-            stream = "OrderedDict([('status', 'Request failed.'), " \
-                     "('exception', '" + escape(unicode(e.message)) + "')," \
-                     "('request', '" + escape(unicode(request_meta)) + "'), " \
-                     "('data', '" + escape(unicode(stream)) + "')])"
+        # Failed jobs respond with an error message
+        if isinstance(data, basestring):
+            logging.error(log_name + ' - Request failed. {0}'.format(data))
+            data = failed_response(data, request_meta)
 
         key_sig = build_key_signature(request_meta, hash_result=True)
 
-        # Set request in list to "not alive"
-        req_cb_flag_job_complete(key_sig, REQ_NCB_LOCK)
-
         logging.debug(log_name + ' - Setting data for {0}'.format(
             str(request_meta)))
-        set_data(stream, request_meta)
+        set_data(data, request_meta)
+
+        # Set request in list to "not alive" - only once the response is
+        # stored so no request finds it neither running nor cached
+        req_cb_flag_job_complete(key_sig, REQ_NCB_LOCK)
 
     logging.debug(log_name + ' - SHUTTING DOWN...')
+
+
+def failed_response(message, request_meta):
+    """ Format a response that will report on a failed request """
+    return OrderedDict([('status', 'Request failed.'),
+                        ('exception', escape(unicode(message))),
+                        ('request', escape(unicode(request_meta)))])
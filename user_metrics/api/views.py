@@ -19,18 +19,20 @@ __license__ = "GPL (version 2 or later)"
 from flask import Flask, render_template, Markup, redirect, url_for, \
     request, escape, flash, jsonify, make_response
 
-from user_metrics.etl.data_loader import Connector
+from user_metrics.etl.data_loader import get_connection, release_connection
 from user_metrics.config import logging, settings
 from user_metrics.utils import unpack_fields
 from user_metrics.api.engine.data import get_cohort_refresh_datetime, \
-    get_data, get_url_from_keys, build_key_signature, read_pickle_data
+    get_data, get_url_from_keys, build_key_signature, \
+    get_cached_key_signatures
 from user_metrics.api import MetricsAPIError, error_codes, query_mod, \
-    REQ_NCB_LOCK
+    REQ_NCB_LOCK, REQUEST_PATH
 from user_metrics.api.engine.request_meta import filter_request_input, \
     format_request_params, RequestMetaFactory, \
     get_metric_names
 from user_metrics.api.engine.request_manager import api_request_queue, \
-    req_cb_get_cache_keys, req_cb_get_url, req_cb_get_is_running
+    req_cb_get_cache_keys, req_cb_get_url, req_cb_get_is_running, \
+    req_cb_try_add_req, req_cb_flag_job_complete
 from user_metrics.metrics.users import MediaWikiUser
 from user_metrics.api.session import APIUser
 
@@ -115,10 +117,12 @@ else:
 def api_root():
     """ View for root url - API instructions """
     #@@@ TODO make tag list generation a dedicated method
-    conn = Connector(instance=settings.__cohort_data_instance__)
-    conn._cur_.execute('select utm_name from usertags_meta')
-    data = [r[0] for r in conn._cur_]
-    del conn
+    conn = get_connection(settings.__cohort_data_instance__)
+    try:
+        conn._cur_.execute('select utm_name from usertags_meta')
+        data = [r[0] for r in conn._cur_]
+    finally:
+        release_connection(conn)
 
     if settings.__flask_login_exists__ and current_user.is_anonymous():
         return render_template('index_anon.html', cohort_data=data,
@@ -148,10 +152,12 @@ def all_metrics():
 def metric(metric=''):
     """ Display single metric documentation """
     #@@@ TODO make tag list generation a dedicated method
-    conn = Connector(instance=settings.__cohort_data_instance__)
-    conn._cur_.execute('select utm_name from usertags_meta')
-    data = [r[0] for r in conn._cur_]
-    del conn
+    conn = get_connection(settings.__cohort_data_instance__)
+    try:
+        conn._cur_.execute('select utm_name from usertags_meta')
+        data = [r[0] for r in conn._cur_]
+    finally:
+        release_connection(conn)
     #@@@ TODO validate user input against list of existing metrics
     return render_template('metric.html', m_str=metric, cohort_data=data)
 
@@ -166,10 +172,12 @@ def all_cohorts():
         return cohort(request.form['selectCohort'])
     else:
         #@@@ TODO make tag list generation a dedicated method
-        conn = Connector(instance=settings.__cohort_data_instance__)
-        conn._cur_.execute('select distinct utm_name from usertags_meta')
-        o = [r[0] for r in conn._cur_]
-        del conn
+        conn = get_connection(settings.__cohort_data_instance__)
+        try:
+            conn._cur_.execute('select distinct utm_name from usertags_meta')
+            o = [r[0] for r in conn._cur_]
+        finally:
+            release_connection(conn)
         return render_template('all_cohorts.html', data=o, error=error)
 
 
@@ -214,6 +222,7 @@ def output(cohort, metric):
     except MetricsAPIError as e:
         return redirect(url_for('all_cohorts') + '?error=' +
                         str(e.error_code))
+    rm.refresh = refresh
 
     filter_request_input(request, rm)
     try:
@@ -239,21 +248,28 @@ def output(cohort, metric):
     data = get_data(rm)
     key_sig = build_key_signature(rm, hash_result=True)
 
-    # Is the request already running?
-    is_running = req_cb_get_is_running(key_sig, REQ_NCB_LOCK)
-
     # Determine if request is already hashed
     if data and not refresh:
         return make_response(jsonify(data))
 
-    # Determine if the job is already running
-    elif is_running:
+    # Flag the request as running and queue it in one step - concurrent
+    # identical requests coalesce onto the job of whichever flagged it first
+    elif not req_cb_try_add_req(key_sig,
+                                get_url_from_keys(build_key_signature(rm),
+                                                  REQUEST_PATH),
+                                REQ_NCB_LOCK):
         return render_template('processing.html',
                                error=error_codes[0],
                                url_str=str(rm))
 
-    # Add the request to the queue
+    # Add the request to the queue - unless a job completed between the
+    # cache check and flagging the request, in which case the flag is
+    # cleared and the stored response returned
     else:
+        data = get_data(rm) if not refresh else None
+        if data:
+            req_cb_flag_job_complete(key_sig, REQ_NCB_LOCK)
+            return make_response(jsonify(data))
         api_request_queue.put(unpack_fields(rm), block=True)
 
     return render_template('processing.html', url_str=str(rm))
@@ -293,21 +309,9 @@ def job_queue():
 def all_urls():
     """ View for listing all requests.  Retrieves from cache """
 
-    # @TODO - this reads the entire cache into memory, filters will be needed
-    # This extracts ALL data from the cache, the data is assumed to be in the
-    # form of <hash key -> (data, key signature)> pairs.  The key signature is
-    # extracted to reconstruct the url.
-
-    all_data = read_pickle_data()
-    key_sigs = list()
-
-    for key, val in all_data.iteritems():
-        if hasattr(val, '__iter__'):
-            try:
-                key_sigs.append(val[1])
-            except (KeyError, IndexError):
-                logging.error(__name__ + ' :: Could not render key signature '
-                                         'from data, key = {0}'.format(key))
+    # The key signature of each cached response is used to reconstruct the
+    # url.
+    key_sigs = get_cached_key_signatures()
 
     # Compose urls from key sigs
     url_list = list()
@@ -43,6 +43,10 @@
 
     Aggregator Methods
     ~~~~~~~~~~~~~~~~~~
+
+    Aggregators operate on whole columns of results, see ``get_columns``.
+    Group-by aggregators sort the rows on their key and sum each group with
+    ``numpy.add.reduceat``.
 """
 
 __author__ = "ryan faulkner"
@@ -52,15 +56,28 @@ __license__ = "GPL (version 2 or later)"
 from types import FloatType
 from collections import namedtuple
 from itertools import izip
-from numpy import array, transpose
+from numpy import array, transpose, asarray, unique, concatenate, \
+    flatnonzero, diff, add, ones, empty, nan, nansum, where, count_nonzero
 from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_FLAG, \
     METRIC_AGG_METHOD_HEAD, \
     METRIC_AGG_METHOD_KWARGS, \
-    METRIC_AGG_METHOD_NAME
+    METRIC_AGG_METHOD_NAME, \
+    METRIC_AGG_METHOD_MERGE, \
+    MetricResults
 
 # Type used to carry aggregator meta data
 AggregatorMeta = namedtuple('AggregatorMeta', 'field_name index op')
 
+# Merge methods of numpy ops whose results over parts of a dataset combine
+# into the result over the whole dataset, keyed on op name
+NUMPY_OP_MERGE = {
+    'sum': sum,
+    'amin': min,
+    'min': min,
+    'amax': max,
+    'max': max,
+}
+
 
 def decorator_builder(header):
     """
@@ -84,6 +101,49 @@ def decorator_builder(header):
     return eval_data_model
 
 
+def get_columns(data, indices=None):
+    """
+        Returns arrays of the fields ``indices`` of a dataset, all fields if
+        ``indices`` is None.  ``data`` may be a metric, ``MetricResults`` or
+        an iterable of rows.  Columns of ``MetricResults`` are returned
+        without copying, otherwise rows lacking any of the fields are
+        skipped.
+    """
+    results = getattr(data, '_results', data)
+    if isinstance(results, MetricResults):
+        if indices is None:
+            indices = range(results.num_fields())
+        return [results.column(index) for index in indices]
+
+    rows = list(data.__iter__())
+    if indices is None:
+        indices = range(len(rows[0])) if rows else []
+
+    values = list()
+    for row in rows:
+        try:
+            values.append([row[index] for index in indices])
+        except (IndexError, TypeError, KeyError):
+            continue
+    if not values:
+        return [array([]) for index in indices]
+    return [MetricResults.build_column(column) for column in zip(*values)]
+
+
+def group_reduce(keys, columns):
+    """
+        Sums ``columns`` grouped on the values of ``keys``.  Returns the
+        sorted distinct keys, the size of each group and the sums of each
+        column by group.
+    """
+    keys, inverse = unique(keys, return_inverse=True)
+    order = inverse.argsort(kind='mergesort')
+    starts = concatenate([[0], flatnonzero(diff(inverse[order])) + 1])
+    counts = diff(concatenate([starts, [len(order)]]))
+    return keys, counts, [add.reduceat(column[order], starts)
+                          for column in columns]
+
+
 def list_sum_indices(l, indices):
     """
         Sums the elements of list indicated by numeric list `indices`.  The
@@ -96,9 +156,30 @@ def list_sum_indices(l, indices):
             >>> list_sum_indices(l,[1,2])
             [7, 57]
     """
-    return list(reduce(lambda x, y: x+y,
-                       [array([elem.__getitem__(i) for i in indices])
-                        for elem in l]))
+    sums = [column.sum() for column in get_columns(l, indices)]
+    return [value.tolist() if hasattr(value, 'tolist') else value
+            for value in sums]
+
+
+def merge_sums(partials):
+    """ Merges partial results of aggregators that sum fields """
+    return [sum(values) for values in izip(*partials)]
+setattr(list_sum_indices, METRIC_AGG_METHOD_MERGE, merge_sums)
+
+
+def merge_rates(partials):
+    """ Merges partial results of ``boolean_rate`` """
+    total = sum([partial[0] for partial in partials])
+    pos = sum([partial[1] for partial in partials])
+    return [total, pos, float(pos) / total if total else 0.0]
+
+
+def merge_weighted_rates(partials):
+    """ Merges partial results of ``weighted_rate`` """
+    count = sum([partial[0] for partial in partials])
+    total_weight = sum([partial[1] for partial in partials])
+    weighted_sum = sum([partial[2] * partial[0] for partial in partials])
+    return [count, total_weight, weighted_sum / count if count else 0.0]
 
 
 def list_sum_by_group(l, group_index):
@@ -114,23 +195,23 @@ def list_sum_by_group(l, group_index):
             >>> list_sum_by_group(l,0)
             [[1,4], [2,3]]
     """
-    d = dict()
-    for i in l:
-        summables = i[:group_index] + i[group_index+1:]
-        if i[group_index] in d:
-            d[i[group_index]] = map(sum, izip(summables, d[i[group_index]]))
-        else:
-            d[i[group_index]] = summables
-    return [d[k][:group_index] + [k] + d[k][group_index:] for k in d]
+    columns = get_columns(l)
+    if not columns or not len(columns[0]):
+        return []
+
+    keys, counts, sums = group_reduce(
+        columns[group_index],
+        columns[:group_index] + columns[group_index + 1:])
+    return _group_rows(keys, [column.tolist() for column in sums],
+                       group_index)
 
 
 def list_average_by_group(l, group_index):
     """
         Computes the average of the elements of list keyed on `key_index`.
         The elements must be summable (i.e. e1 + e2 is allowed for all e1 and
-        e2).  All elements outside of key are summed on matching keys. This
-        duplicates the code of `list_sum_by_group` since it needs to compute
-        counts in the loop also::
+        e2).  All elements outside of key are summed on matching keys and
+        divided by the size of the group::
 
             Returns: <list of averaged and keyed elements>
 
@@ -139,22 +220,61 @@ def list_average_by_group(l, group_index):
             >>> list_average(l,0)
             [[1, 4.0], [2, 1.5]]
     """
-    d = dict()
-    counts = dict()
-    for i in l:
-        summables = i[:group_index] + i[group_index+1:]
-        if i[group_index] in d:
-            d[i[group_index]] = map(sum,
-                                    izip(summables, d[i[group_index]]))
-            counts[i[group_index]] += 1
-        else:
-            d[i[group_index]] = summables
-            counts[i[group_index]] = 1
-
-    # use numpy array perform list operation
-    for k in counts:
-        d[k] = list(array(d[k]) / float(counts[k]))
-    return [d[k][:group_index] + [k] + d[k][group_index:] for k in d]
+    columns = get_columns(l)
+    if not columns or not len(columns[0]):
+        return []
+
+    keys, counts, sums = group_reduce(
+        columns[group_index],
+        columns[:group_index] + columns[group_index + 1:])
+    return _group_rows(keys, [(asarray(column, dtype=FloatType) /
+                               counts).tolist() for column in sums],
+                       group_index)
+
+
+def _group_rows(keys, columns, group_index):
+    """ Rows of grouped ``columns`` with the key at ``group_index`` """
+    return [list(values[:group_index]) + [key] +
+            list(values[group_index:])
+            for key, values in izip(keys.tolist(), izip(*columns))] \
+        if columns else [[key] for key in keys.tolist()]
+
+
+def _map_column(method, column):
+    """
+        Applies ``method`` to a column, to the whole array where it
+        supports this and otherwise to each element.  Returns the results
+        along with a mask of the elements it could be applied to.
+    """
+    try:
+        mapped = asarray(method(column))
+        if mapped.shape == column.shape:
+            return mapped, ones(len(column), dtype=bool)
+    except Exception:
+        pass
+
+    mapped = empty(len(column), dtype=object)
+    valid = ones(len(column), dtype=bool)
+    for index, value in enumerate(column):
+        try:
+            mapped[index] = method(value)
+        except (IndexError, TypeError):
+            valid[index] = False
+    return mapped, valid
+
+
+def _float_column(column):
+    """ Column as floats, elements that are not numbers are NaN """
+    try:
+        return asarray(column, dtype=FloatType)
+    except (TypeError, ValueError):
+        values = empty(len(column))
+        for index, value in enumerate(column):
+            try:
+                values[index] = float(value)
+            except (TypeError, ValueError):
+                values[index] = nan
+        return values
 
 
 def boolean_rate(iter, **kwargs):
@@ -174,17 +294,9 @@ def boolean_rate(iter, **kwargs):
     cmp_method = kwargs['cmp_method'] if 'cmp_method' in kwargs \
         else cmp_method_default
 
-    total = 0
-    pos = 0
-    for r in iter.__iter__():
-        try:
-            if cmp_method(r[val_idx]):
-                pos += 1
-            total += 1
-        except IndexError:
-            continue
-        except TypeError:
-            continue
+    matches, valid = _map_column(cmp_method, get_columns(iter, [val_idx])[0])
+    total = int(count_nonzero(valid))
+    pos = int(count_nonzero(asarray(matches[valid], dtype=bool)))
     if total:
         return [total, pos, float(pos) / total]
     else:
@@ -201,60 +313,81 @@ def weighted_rate(iter, **kwargs):
 
     weight_idx = kwargs['weight_idx'] if 'weight_idx' in kwargs else 1
     val_idx = kwargs['val_idx'] if 'val_idx' in kwargs else 1
-    weight_method = kwargs['weight_method'] if 'cmp_method' in kwargs else \
-        weight_method_default
+    weight_method = kwargs['weight_method'] if 'weight_method' in kwargs \
+        else weight_method_default
+
+    weight_column, val_column = get_columns(iter, [weight_idx, val_idx])
+    count = len(val_column)
+    if 'weight_method' in kwargs:
+        weights, valid = _map_column(weight_method, weight_column)
+        weights = _float_column(where(valid, weights, nan))
+    else:
+        weights = ones(count)
 
-    count = 0
-    total_weight = 0.0
-    weighted_sum = 0.0
-    for r in iter.__iter__():
-        try:
-            count += 1
-            weight = weight_method(r[weight_idx])
-            total_weight += r[weight_idx]
-            weighted_sum += weight * r[val_idx]
-        except IndexError:
-            continue
-        except TypeError:
-            continue
+    total_weight = float(nansum(_float_column(weight_column)))
+    weighted_sum = float(nansum(weights * _float_column(val_column)))
     if count:
         return [count, total_weight, weighted_sum / count]
     else:
         return [count, total_weight, 0.0]
 
 
+class FloatColumns(object):
+    """
+        Fields of a dataset as float arrays.  Each field is converted once,
+        when it is first read, so that several ``numpy_op`` aggregators may
+        share the conversion.
+
+            **data** - a UserMetric class with _results defined, or an
+            iterable of datapoints
+    """
+
+    def __init__(self, data):
+        # Columnar results are read directly, other datasets are converted to
+        # a numpy array and transposed
+        results = getattr(data, '_results', data)
+        if not isinstance(results, MetricResults):
+            results = transpose(array([list(r) for r in results]))
+        self._results = results
+        self._columns = dict()
+
+    def __getitem__(self, index):
+        if index not in self._columns:
+            if isinstance(self._results, MetricResults):
+                column = self._results.column(index)
+            else:
+                column = self._results[index, :]
+
+            # Convert elements to Python FloatType, float columns are not
+            # copied
+            self._columns[index] = asarray(column, dtype=FloatType)
+        return self._columns[index]
+
+
 def numpy_op(iter, **kwargs):
     """
         Computes specified numpy op from an iterator exposing a dataset.
 
             **iter** - assumed to be a UserMetric class with _results defined
             as a list of datapoints
+
+            **columns** - optional ``FloatColumns`` of ``iter`` shared
+            with other aggregators
     """
 
     # Retrieve indices on data for which to compute medians
     agg_meta = kwargs['agg_meta']
+    columns = kwargs['columns'] if 'columns' in kwargs else \
+        FloatColumns(iter)
     values = list()
 
-    # Convert data points to numpy array
-    if hasattr(iter, '_results'):
-        results = array(iter._results)
-    else:
-        results = list()
-        for i in iter:
-            results.append(i)
-        results = array(iter._results)
-
-    # Transpose the array and convert it's elements to Python FloatType
-    results = transpose(results)
-    results = results.astype(FloatType)
-
     # Compute the median of each specified data index
     for agg_meta_obj in agg_meta:
         if not hasattr(agg_meta_obj, 'op') or \
                 not hasattr(agg_meta_obj, 'index'):
             raise AggregatorError(__name__ + ':: Use AggregatorMeta object to '
                                              'pass aggregator meta data.')
-        values.append(agg_meta_obj.op(results[agg_meta_obj.index, :]))
+        values.append(agg_meta_obj.op(columns[agg_meta_obj.index]))
     return values
 
 
@@ -274,6 +407,14 @@ def build_numpy_op_agg(agg_meta_list, metric_header, method_handle):
                 'agg_meta': agg_meta_list
             }
             )
+
+    # Aggregates of ops such as sum, min and max may be merged
+    merges = [NUMPY_OP_MERGE.get(o.op.__name__) for o in agg_meta_list]
+    if all(merges):
+        def merge(partials):
+            return [op_merge(values)
+                    for op_merge, values in izip(merges, izip(*partials))]
+        setattr(agg_method, METRIC_AGG_METHOD_MERGE, merge)
     return agg_method
 
 
@@ -287,6 +428,60 @@ def build_agg_meta(op_list, field_prefix_names):
             for op in op_list]
 
 
+def build_multi_agg(agg_methods):
+    """
+        Combines metric aggregators into one aggregator that computes all of
+        them over the same results.  ``numpy_op`` aggregators share a single
+        ``FloatColumns`` conversion of the results.  The header and data of
+        the combined aggregator are those of ``agg_methods`` concatenated::
+
+            agg = build_multi_agg([ba_mean_agg, ba_median_agg, ba_max_agg])
+            r = um.aggregator(agg, metric, metric.header())
+    """
+    for agg_method in agg_methods:
+        if not getattr(agg_method, METRIC_AGG_METHOD_FLAG, False):
+            raise AggregatorError(__name__ + ':: Only metric aggregators may '
+                                             'be combined.')
+
+    def multi_agg(metric, **kwargs):
+        columns = FloatColumns(metric)
+        values = list()
+        for agg_method in agg_methods:
+            agg_kwargs = getattr(agg_method, METRIC_AGG_METHOD_KWARGS, {})
+            if 'agg_meta' in agg_kwargs:
+                agg_kwargs = dict(agg_kwargs, columns=columns)
+            values.extend(agg_method(metric, **agg_kwargs))
+        return values
+
+    setattr(multi_agg, METRIC_AGG_METHOD_FLAG, True)
+    setattr(multi_agg, METRIC_AGG_METHOD_NAME,
+            ','.join([getattr(agg_method, METRIC_AGG_METHOD_NAME)
+                      for agg_method in agg_methods]))
+    setattr(multi_agg, METRIC_AGG_METHOD_HEAD,
+            [field for agg_method in agg_methods
+             for field in getattr(agg_method, METRIC_AGG_METHOD_HEAD)])
+    setattr(multi_agg, METRIC_AGG_METHOD_KWARGS, {})
+
+    # Combined aggregates are merged by component when all components may
+    # be merged
+    merges = [getattr(agg_method, METRIC_AGG_METHOD_MERGE, None)
+              for agg_method in agg_methods]
+    if all(merges):
+        widths = [len(getattr(agg_method, METRIC_AGG_METHOD_HEAD))
+                  for agg_method in agg_methods]
+
+        def merge(partials):
+            values = list()
+            start = 0
+            for component_merge, width in izip(merges, widths):
+                values.extend(component_merge(
+                    [partial[start:start + width] for partial in partials]))
+                start += width
+            return values
+        setattr(multi_agg, METRIC_AGG_METHOD_MERGE, merge)
+    return multi_agg
+
+
 class AggregatorError(Exception):
     """ Basic exception class for aggregators """
     def __init__(self, message="Aggregation error."):
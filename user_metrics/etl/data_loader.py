@@ -52,7 +52,10 @@ __license__ = "GPL (version 2 or later)"
 
 
 from time import sleep
+from os import getpid
+from threading import Lock
 import MySQLdb
+import MySQLdb.cursors
 import operator
 import user_metrics.config.settings as projSet
 
@@ -74,6 +77,15 @@ class DataLoaderError(Exception):
         Exception.__init__(self, message)
 
 
+# Number of rows read from the server by each ``fetchmany`` call of
+# ``Connector.stream``
+STREAM_FETCH_SIZE = 10000
+
+# Seconds the server waits on a streaming client before aborting, rows may
+# be consumed slowly as they are processed in batches
+STREAM_NET_WRITE_TIMEOUT = 3600
+
+
 class ConnectorError(Exception):
     """ Basic exception class for UserMetric types """
     def __init__(self, message="Could not establish a connection."):
@@ -103,6 +115,11 @@ class Connector(object):
                 mysql_kwargs[key] = projSet.connections[kwargs['instance']][
                                     key]
 
+            # The owning process is the only one allowed to close the
+            # connection, a forked child shares the socket with its parent
+            self._instance = kwargs['instance']
+            self._pid = getpid()
+
             while retries:
                 try:
                     self._db_ = MySQLdb.connect(**mysql_kwargs)
@@ -122,6 +139,8 @@ class Connector(object):
 
     def close_db(self):
         """ Close the conection if it remains open """
+        if hasattr(self, '_pid') and self._pid != getpid():
+            return
         if hasattr(self, '_cur_'):
             try:
                 self._cur_.close()
@@ -133,6 +152,50 @@ class Connector(object):
             except MySQLdb.ProgrammingError:
                 pass
 
+    def reconnect(self):
+        """ Close the connection and establish a new one """
+        self.close_db()
+        self.set_connection(instance=self._instance)
+
+    def ping(self):
+        """
+            Health check on the connection.  A connection that has dropped
+            is reestablished, a fresh cursor is opened in either case.
+        """
+        try:
+            self._db_.ping()
+            self._cur_.close()
+            self._cur_ = self._db_.cursor()
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError) as e:
+            logging.debug(__name__ + ' :: Pooled connection dropped, '
+                                     'reconnecting: "{0}"'.format(e))
+            self.reconnect()
+
+    def stream(self, query, params=None, size=STREAM_FETCH_SIZE):
+        """
+            Generator over the rows of a query read with a server side
+            cursor, ``size`` rows at a time.  Rows are yielded while the
+            server is still sending results and are never all held in
+            memory.  The connection may not run other queries until the
+            generator is exhausted or closed.
+        """
+        cur = self._db_.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cur.execute('SET SESSION net_write_timeout = %s',
+                        (STREAM_NET_WRITE_TIMEOUT,))
+            if params:
+                cur.execute(query, params)
+            else:
+                cur.execute(query)
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cur.close()
+
     def get_column_names(self):
         """
             Return the column names from the connection cursor (latest
@@ -150,6 +213,94 @@ class Connector(object):
         return [elem[0] for elem in column_data]
 
 
+class ConnectionPool(object):
+    """
+        Pool of open connections to a single instance.  Connections are
+        borrowed with ``get`` and handed back with ``put``, at most ``size``
+        idle connections are retained.  ``size`` does not cap the number of
+        connections open at once: ``get`` opens a new connection whenever
+        none are idle, and surplus connections are closed on ``put``.
+        Borrowed connections are health checked with a ping and reopened if
+        they have dropped.
+    """
+
+    def __init__(self, instance, size):
+        self._instance = instance
+        self._size = size
+        self._idle = list()
+        self._lock = Lock()
+
+    def get(self):
+        """ Borrow a connection, opening a new one if none are idle """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return Connector(instance=self._instance)
+        conn.ping()
+        return conn
+
+    def put(self, conn):
+        """ Return a connection to the pool """
+
+        # End any open transaction so that the next borrower does not read
+        # from a stale snapshot
+        try:
+            conn._db_.rollback()
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+            conn.close_db()
+            return
+
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(conn)
+                return
+        conn.close_db()
+
+    def close(self):
+        """ Close all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, list()
+        for conn in idle:
+            conn.close_db()
+
+
+# Per-process registry of connection pools keyed on instance.  When the
+# registry is accessed from a forked child it is reinitialised, the pools
+# inherited from the parent are kept referenced so that their connections,
+# whose sockets are shared with the parent, are never closed by the child.
+_POOLS = dict()
+_POOLS_PID = getpid()
+_POOLS_LOCK = Lock()
+_INHERITED_POOLS = list()
+
+
+def get_pool(instance):
+    """ Returns the connection pool of this process for ``instance`` """
+    global _POOLS, _POOLS_PID
+
+    with _POOLS_LOCK:
+        if _POOLS_PID != getpid():
+            _INHERITED_POOLS.append(_POOLS)
+            _POOLS = dict()
+            _POOLS_PID = getpid()
+        if instance not in _POOLS:
+            _POOLS[instance] = ConnectionPool(
+                instance, projSet.__connection_pool_size__)
+        return _POOLS[instance]
+
+
+def get_connection(instance):
+    """ Borrow a connection to ``instance`` from the connection pool """
+    return get_pool(instance).get()
+
+
+def release_connection(conn):
+    """ Hand a connection obtained from ``get_connection`` back to its pool """
+    if conn._pid != getpid():
+        return
+    get_pool(conn._instance).put(conn)
+
+
 class DataLoader(object):
     """ Singleton class for performing operations on data sets.
         ETL class for xsv and RDBMS data sources. """
@@ -8,24 +8,36 @@ __date__ = "12/10/2012"
 __license__ = "GPL (version 2 or later)"
 
 import datetime
-import time
 import os
 from copy import deepcopy
 from dateutil.parser import parse as date_parse
 import operator
 import json
+from bisect import bisect_left, bisect_right
 
 from user_metrics.config import settings
 import user_metrics.metrics.user_metric as um
-from user_metrics.utils import format_mediawiki_timestamp
+from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE, \
+    get_registration_index, UMPBatch
+from user_metrics.etl.data_loader import DataLoader
+from user_metrics.utils import format_mediawiki_timestamp, \
+    mediawiki_timestamp_to_epoch, epoch_to_mediawiki_timestamp
+import user_metrics.utils.multiprocessing_wrapper as mpw
 from multiprocessing import Process, Queue
+from Queue import Empty
 
 from user_metrics.config import logging
 
-# Determines the amount of time to wait before picking completed threads off
-# of the queue
 MAX_THREADS = settings.__time_series_thread_max__
-PROCESS_SLEEP_TIME = 4
+
+# The listener blocks on the event queue, if no event arrives within this
+# many seconds it checks for workers that exited without signalling
+PROCESS_CHECK_TIMEOUT = 4
+
+# Event types sent by ``time_series_worker`` to the listener: rows of time
+# series data and completion of a worker
+TS_EVENT_DATA = 'data'
+TS_EVENT_DONE = 'done'
 
 
 def _get_timeseries(date_start, date_end, interval):
@@ -72,6 +84,10 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
             cohort : list(str).
                 list of user IDs
 
+            callback : method.
+                Optional keyword argument, called with each list of time
+                series rows as soon as it is computed
+
         e.g.
 
         >>> cohort = ['156171','13234584']
@@ -85,12 +101,18 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
     """
 
     log = bool(kwargs['log']) if 'log' in kwargs else False
+    callback = kwargs.pop('callback', None)
 
     # Get datetime types, and the number of threads
     start = date_parse(format_mediawiki_timestamp(start))
     end = date_parse(format_mediawiki_timestamp(end))
     k = kwargs['kt_'] if 'kt_' in kwargs else MAX_THREADS
 
+    if metric._time_series_decomposable:
+        return build_decomposed_time_series(start, end, interval, metric,
+                                            aggregator, cohort,
+                                            callback=callback, **kwargs)
+
     # Compute window size and ensure that all the conditions
     # necessary to generate a proper time series are met
     num_intervals = int((end - start).total_seconds() / (3600 * interval))
@@ -120,14 +142,116 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
         process_queue.append(p)
 
     # Call the listener
-    return time_series_listener(process_queue, event_queue)
+    return time_series_listener(process_queue, event_queue, callback)
+
+
+def _get_metric_kwargs(kwargs):
+    """ Re-map keyword args relating to thread counts for metric calls """
+    new_kwargs = deepcopy(kwargs)
+    if 'metric_threads' in new_kwargs:
+        d = json.loads(new_kwargs['metric_threads'])
+        for key in d:
+            new_kwargs[key] = d[key]
+        del new_kwargs['metric_threads']
+    return new_kwargs
 
 
-def time_series_listener(process_queue, event_queue):
+def build_decomposed_time_series(start, end, interval, metric, aggregator,
+                                 cohort, **kwargs):
+    """
+        Builds a timeseries dataset for metrics that set
+        ``_time_series_decomposable``.  Rather than processing the metric for
+        each interval the revisions of the cohort are fetched once for the
+        full range and bucketed by interval, the aggregator is then applied
+        to the results of each bucket.  Parameters and return value are
+        those of ``build_time_series``.
     """
-        Listener for ``time_series_worker``.  Blocks and logs until all
-        processes computing time series data are complete.  Returns time
-        dependent data from metrics.
+    log = bool(kwargs['log']) if 'log' in kwargs else False
+    callback = kwargs.pop('callback', None)
+    new_kwargs = _get_metric_kwargs(kwargs)
+
+    series = list(_get_timeseries(start, end, interval))
+    intervals = zip(series[:-1], series[1:])
+    if not intervals:
+        return []
+
+    metric_params = metric(datetime_start=start, datetime_end=end,
+                           **new_kwargs)
+    metric_params.assign_attributes(new_kwargs, 'process')
+    users = DataLoader().cast_elems_to_string(cohort)
+    bounds = [(format_mediawiki_timestamp(ts_s),
+               format_mediawiki_timestamp(ts_e)) for ts_s, ts_e in intervals]
+
+    # Determine the period of each user for each interval, in the
+    # registration case users are measured in the intervals in which they
+    # registered
+    if metric_params.group == USER_METRIC_PERIOD_TYPE.REGISTRATION:
+        user_ids, regs = get_registration_index(metric_params.project).\
+            lookup_array(users)
+        order = regs.argsort(kind='mergesort')
+        reg = UMPBatch(user_ids[order], regs[order],
+                       epoch_to_mediawiki_timestamp(
+                           mediawiki_timestamp_to_epoch(regs[order]) +
+                           int(metric_params.t) * 3600))
+        reg_ts = [str(ts) for ts in reg.start.tolist()]
+        reg_periods = [(str(p.user), p.start, p.end) for p in reg]
+        periods = [reg_periods[bisect_left(reg_ts, ts_s):
+                               bisect_right(reg_ts, ts_e)]
+                   for ts_s, ts_e in bounds]
+    else:
+        periods = [[(user, ts_s, ts_e) for user in users]
+                   for ts_s, ts_e in bounds]
+
+    period_users = list(set([p[0] for period in periods
+                             for p in period]))
+    data = list()
+    if period_users:
+        range_start = min([p[1] for period in periods for p in period])
+        range_end = max([p[2] for period in periods for p in period])
+
+        if log:
+            logging.info(__name__ + ' :: Fetching revisions for {0} users, '
+                                    '{1} - {2} ...'.format(len(period_users),
+                                                           range_start,
+                                                           range_end))
+
+        # Index the revisions of each user by timestamp
+        revs = sorted([(str(rev[1]), str(rev[0]), rev) for rev in
+                       metric._series_revisions(period_users, range_start,
+                                                range_end, metric_params)])
+        user_revs = dict()
+        for ts, user, rev in revs:
+            if user not in user_revs:
+                user_revs[user] = ([], [])
+            user_revs[user][0].append(ts)
+            user_revs[user][1].append(rev)
+    else:
+        user_revs = dict()
+
+    for (ts_s, ts_e), interval_periods in zip(intervals, periods):
+        interval_revs = dict()
+        for user, p_start, p_end in interval_periods:
+            ts, rows = user_revs[user] if user in user_revs else ([], [])
+            interval_revs[user] = rows[bisect_left(ts, p_start):
+                                       bisect_left(ts, p_end)]
+
+        metric_obj = metric(datetime_start=ts_s, datetime_end=ts_e,
+                            **new_kwargs)
+        metric_obj._set_results(metric._series_rows(interval_revs, users,
+                                                    metric_params))
+        r = um.aggregator(aggregator, metric_obj, metric.header())
+        data.append([str(ts_s), str(ts_e)] + r.data)
+        if callback:
+            callback(data[-1:])
+
+    return data
+
+
+def time_series_listener(process_queue, event_queue, callback=None):
+    """
+        Listener for ``time_series_worker``.  Blocks on the event queue until
+        all processes computing time series data have signalled completion.
+        Returns time dependent data from metrics.
 
         Parameters
         ~~~~~~~~~~
@@ -137,27 +261,45 @@ def time_series_listener(process_queue, event_queue):
 
             event_queue : multiprocessing.Queue
                 Asynchronous data coming in from worker processes.
+
+            callback : method
+                Called with each list of rows as it arrives from a worker.
     """
     data = list()
-
-    while 1:
-        # sleep before checking worker threads
-        time.sleep(PROCESS_SLEEP_TIME)
-
-        logging.info(__name__ + ' :: Time series process queue\n'
-                                '\t{0} threads. (PID = {1})'.
-            format(str(len(process_queue)), os.getpid()))
-
-        while not event_queue.empty():
-            data.extend(event_queue.get())
-        for p in process_queue:
-            if not p.is_alive():
-                p.terminate()
-                process_queue.remove(p)
-
-        # exit if all process have finished
-        if not len(process_queue):
-            break
+    active = dict((p.pid, p) for p in process_queue)
+
+    def handle_event(pid, event, rows):
+        if event == TS_EVENT_DATA:
+            data.extend(rows)
+            if callback:
+                callback(rows)
+        elif event == TS_EVENT_DONE and pid in active:
+            active.pop(pid).join()
+            logging.info(__name__ + ' :: Time series worker complete\n'
+                                    '\t{0} threads remaining. (PID = {1})'.
+                format(len(active), os.getpid()))
+
+    while active:
+        try:
+            handle_event(*event_queue.get(timeout=PROCESS_CHECK_TIMEOUT))
+        except Empty:
+            # Fallback liveness check - reap workers that exited without
+            # signalling completion.  A worker may have sent its last events
+            # after the timeout, these are drained once it is joined.
+            for pid in active.keys():
+                if pid not in active or active[pid].is_alive():
+                    continue
+                active[pid].join()
+                while True:
+                    try:
+                        handle_event(*event_queue.get_nowait())
+                    except Empty:
+                        break
+                if pid in active:
+                    logging.error(__name__ + ' :: Time series worker exited '
+                                             'without completing. '
+                                             '(PID = {0})'.format(pid))
+                    active.pop(pid)
 
     # sort
     return sorted(data, key=operator.itemgetter(0), reverse=False)
@@ -189,19 +331,31 @@ def time_series_worker(time_series,
 
             event_queue : multiporcessing.Queue
                 Asynchronous data-structure to communicate with parent proc.
+                The rows of each interval are sent as they are computed,
+                a completion event is always sent last.
+
+        Metrics are computed inline, the workers of a time series take the
+        place of the worker pool.
     """
+    mpw.limit_pool(0)
+    try:
+        _time_series_worker(time_series, metric, aggregator, cohort,
+                            event_queue, kwargs)
+    finally:
+        event_queue.put((os.getpid(), TS_EVENT_DONE, None))
+
+
+def _time_series_worker(time_series,
+                        metric,
+                        aggregator,
+                        cohort,
+                        event_queue,
+                        kwargs):
+    """ Computes the time series data for ``time_series_worker`` """
     log = bool(kwargs['log']) if 'log' in kwargs else False
 
-    data = list()
     ts_s = time_series.next()
-    new_kwargs = deepcopy(kwargs)
-
-    # re-map some keyword args relating to thread counts
-    if 'metric_threads' in new_kwargs:
-        d = json.loads(new_kwargs['metric_threads'])
-        for key in d:
-            new_kwargs[key] = d[key]
-        del new_kwargs['metric_threads']
+    new_kwargs = _get_metric_kwargs(kwargs)
 
     while 1:
         try:
@@ -225,11 +379,10 @@ def time_series_worker(time_series,
                                     '\t{0}, {1} - {2} ...'.format(os.getpid(),
                                                                   str(ts_s),
                                                                   str(ts_e)))
-        data.append([str(ts_s), str(ts_e)] + r.data)
+        event_queue.put((os.getpid(), TS_EVENT_DATA,
+                         [[str(ts_s), str(ts_e)] + r.data]))
         ts_s = ts_e
 
-    event_queue.put(data)
-
 
 class TimeSeriesException(Exception):
     """ Basic exception class for UserMetric types """
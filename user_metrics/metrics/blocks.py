@@ -8,7 +8,8 @@ from user_metrics.config import logging
 from collections import namedtuple
 import user_metric as um
 from user_metrics.metrics import query_mod
-from user_metrics.etl.aggregator import weighted_rate, decorator_builder
+from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
+    merge_weighted_rates
 
 
 class Blocks(um.UserMetric):
@@ -146,6 +147,7 @@ setattr(block_rate_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
 setattr(block_rate_agg, um.METRIC_AGG_METHOD_KWARGS, {
     'val_idx': 1,
 })
+setattr(block_rate_agg, um.METRIC_AGG_METHOD_MERGE, merge_weighted_rates)
 
 
 if __name__ == "__main__":
@@ -74,6 +74,8 @@ class BytesAdded(um.UserMetric):
             _data_model_meta['float_fields'],
         }
 
+    _time_series_decomposable = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(BytesAdded, self).__init__(**kwargs)
@@ -108,15 +110,56 @@ class BytesAdded(um.UserMetric):
                 self._results.append([user, 0, 0, 0, 0, 0])
         return self
 
+    @classmethod
+    def _series_revisions(cls, users, date_start, date_end, metric_params):
+        """
+            Revisions in the metric namespace as ``(user, timestamp, bytes
+            added)``.  Parent revision lengths are resolved for the full
+            range at once, bytes added is None where they are unknown.
+        """
+        query_args = namedtuple('QueryArgs', 'date_start date_end namespace')
+        revs = query_mod.rev_series_query(users, metric_params.project,
+                                          query_args(date_start, date_end,
+                                                     metric_params.namespace))
+        try:
+            parent_rev_lens = query_mod.rev_len_batch_query(
+                [row[4] for row in revs if row[4]], metric_params.project)
+        except query_mod.UMQueryCallError as e:
+            logging.error(__name__ + '::Could not produce parent revision '
+                                     'lengths: %s' % e.message)
+            parent_rev_lens = dict()
+
+        series_revs = list()
+        for row in revs:
+            if not row[4]:
+                parent_rev_len = 0
+            else:
+                parent_rev_len = parent_rev_lens.get(row[4])
+            try:
+                series_revs.append((row[0], row[1],
+                                    int(row[3]) - int(parent_rev_len)))
+            except TypeError:
+                series_revs.append((row[0], row[1], None))
+        return series_revs
+
+    @classmethod
+    def _series_rows(cls, user_revs, users, metric_params):
+        """ Bytes added - all users not measured have no activity """
+        bytes_added = dict()
+        for user in user_revs:
+            for rev in user_revs[user]:
+                if rev[2] is not None:
+                    _tally_bytes_added(bytes_added, user, rev[2])
+        return [[user] + bytes_added[user] if user in bytes_added
+                else [user, 0, 0, 0, 0, 0] for user in users]
+
 
 def _get_revisions(args):
     """ Retrieve total set of revision records for users within timeframe """
     um.log_pool_worker_start(__name__, _get_revisions.__name__, args[0], args[1])
 
     users = args[0]
-    state = args[1]
-
-    metric_params = um.UserMetric._unpack_params(state)
+    metric_params = args[1]
     query_args_type = namedtuple('QueryArgs', 'date_start date_end namespace')
 
     revs = list()
@@ -149,7 +192,7 @@ def _process_help(args):
 
             #. Get all revisions for the specified users in the given
                 timeframe
-            #. For each parent revision get its length
+            #. Get the lengths of all parent revisions in batches
             #. Compute the difference in length between each revision and its
                 parent
             #. Record edit count, raw bytes added (with sign and absolute),
@@ -164,9 +207,7 @@ def _process_help(args):
     um.log_pool_worker_start(__name__, _process_help.__name__, args[0], args[1])
 
     revs = args[0]
-    state = args[1]
-
-    metric_params = um.UserMetric._unpack_params(state)
+    metric_params = args[1]
     bytes_added = dict()
 
     # Get the difference for each revision length from the parent
@@ -175,6 +216,23 @@ def _process_help(args):
     missed_records = 0
     total_rows = len(revs)
 
+    # Resolve the lengths of all parent revisions in this slice at once -
+    # the cost scales with the number of batches rather than revisions
+    parent_rev_ids = set()
+    for row in revs:
+        try:
+            if row[2]:
+                parent_rev_ids.add(row[2])
+        except (IndexError, TypeError):
+            continue
+
+    try:
+        parent_rev_lens = query_mod.rev_len_batch_query(parent_rev_ids,
+                                                        metric_params.project)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + '::Could not produce parent revision '
+                                 'lengths: %s' % e.message)
+        parent_rev_lens = dict()
 
     for row in revs:
         try:
@@ -195,9 +253,8 @@ def _process_help(args):
             parent_rev_len = 0
         else:
             try:
-                parent_rev_len = query_mod.rev_len_query(parent_rev_id,
-                                                         metric_params.project)
-            except query_mod.UMQueryCallError:
+                parent_rev_len = parent_rev_lens[parent_rev_id]
+            except KeyError:
                 missed_records += 1
                 logging.error(__name__ +
                               '::Could not produce rev diff for %s on '
@@ -212,22 +269,7 @@ def _process_help(args):
             missed_records += 1
             continue
 
-        try:
-            # Exception where the user does not exist.  Handle this by
-            # creating the key
-            bytes_added[user][0] += bytes_added_bit
-        except KeyError:
-            bytes_added[user] = [0] * 5
-            bytes_added[user][0] += bytes_added_bit
-            pass
-
-        bytes_added[user][1] += abs(bytes_added_bit)
-        if bytes_added_bit > 0:
-            bytes_added[user][2] += bytes_added_bit
-        else:
-            bytes_added[user][3] += bytes_added_bit
-        bytes_added[user][4] += 1
-
+        _tally_bytes_added(bytes_added, user, bytes_added_bit)
         row_count += 1
 
     results = [[user] + bytes_added[user] for user in bytes_added]
@@ -239,6 +281,27 @@ def _process_help(args):
     return results
 
 
+def _tally_bytes_added(bytes_added, user, bytes_added_bit):
+    """
+        Add the byte difference of a revision to the running totals of
+        ``user`` in ``bytes_added``.
+    """
+    try:
+        # Exception where the user does not exist.  Handle this by
+        # creating the key
+        bytes_added[user][0] += bytes_added_bit
+    except KeyError:
+        bytes_added[user] = [0] * 5
+        bytes_added[user][0] += bytes_added_bit
+
+    bytes_added[user][1] += abs(bytes_added_bit)
+    if bytes_added_bit > 0:
+        bytes_added[user][2] += bytes_added_bit
+    else:
+        bytes_added[user][3] += bytes_added_bit
+    bytes_added[user][4] += 1
+
+
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
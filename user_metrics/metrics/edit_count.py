@@ -53,6 +53,8 @@ class EditCount(um.UserMetric):
         _data_model_meta['float_fields'],
     }
 
+    _time_series_decomposable = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(EditCount, self).__init__(**kwargs)
@@ -96,6 +98,20 @@ class EditCount(um.UserMetric):
         self._results = edit_count
         return self
 
+    @classmethod
+    def _series_revisions(cls, users, date_start, date_end, metric_params):
+        """ Revisions in all namespaces """
+        query_args = namedtuple('QueryArgs', 'date_start date_end namespace')
+        return query_mod.rev_series_query(users, metric_params.project,
+                                          query_args(date_start, date_end,
+                                                     None))
+
+    @classmethod
+    def _series_rows(cls, user_revs, users, metric_params):
+        """ Edit counts - all users not measured have an edit count of 0 """
+        return [[long(user), len(user_revs[user]) if user in user_revs else 0]
+                for user in users]
+
 
 def _process_help(args):
     """
@@ -104,25 +120,16 @@ def _process_help(args):
 
     # Unpack args
     users = args[0]
-    state = args[1]
-
-    metric_params = um.UserMetric._unpack_params(state)
-    query_args_type = namedtuple('QueryArgs', 'date_start date_end')
+    metric_params = args[1]
 
     logging.debug(__name__ + ':: Executing EditCount on '
                              '%s users (PID = %s)' % (len(users), getpid()))
 
-    # Call user period method
+    # Call user period method and count the edits of all users within their
+    # own periods at once
     umpd_obj = UMP_MAP[metric_params.group](users, metric_params)
-    results = list()
-    for t in umpd_obj:
-        args = query_args_type(t.start, t.end)
-
-        # Build edit count results list
-        results += query_mod.edit_count_user_query(t.user,
-                                                   metric_params.project,
-                                                   args)
-    return results
+    return query_mod.edit_count_batch_query(
+        [(t.user, t.start, t.end) for t in umpd_obj], metric_params.project)
 
 
 # Rudimentary Testing
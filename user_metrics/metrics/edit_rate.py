@@ -8,7 +8,7 @@ from dateutil.parser import parse as date_parse
 import user_metric as um
 import edit_count as ec
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, merge_weighted_rates
 from numpy import median, min, max, mean, std
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE as umpt
 from user_metrics.utils import enum, format_mediawiki_timestamp
@@ -157,6 +157,7 @@ setattr(edit_rate_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
 setattr(edit_rate_agg, um.METRIC_AGG_METHOD_KWARGS, {
     'val_idx': 2,
 })
+setattr(edit_rate_agg, um.METRIC_AGG_METHOD_MERGE, merge_weighted_rates)
 
 metric_header = EditRate.header()
 
@@ -12,7 +12,8 @@ from collections import namedtuple
 from os import getpid
 from dateutil.parser import parse as date_parse
 from datetime import datetime
-from user_metrics.etl.aggregator import decorator_builder, boolean_rate
+from user_metrics.etl.aggregator import decorator_builder, boolean_rate, \
+    merge_rates
 from user_metrics.metrics import query_mod
 
 
@@ -95,10 +96,8 @@ class LiveAccount(um.UserMetric):
 def _process_help(args):
 
     # Unpack args
-    state = args[1]
     users = args[0]
-
-    thread_args = um.UserMetric._unpack_params(state)
+    thread_args = args[1]
 
     # Log progress
     if thread_args.log_:
@@ -175,6 +174,7 @@ setattr(live_accounts_agg, um.METRIC_AGG_METHOD_NAME, 'live_accounts_agg')
 setattr(live_accounts_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
                                                        'is_live', 'rate'])
 setattr(live_accounts_agg, um.METRIC_AGG_METHOD_KWARGS, {'val_idx': 1})
+setattr(live_accounts_agg, um.METRIC_AGG_METHOD_MERGE, merge_rates)
 
 if __name__ == "__main__":
     users = ['17792132', '17797320', '17792130', '17792131', '17792136',
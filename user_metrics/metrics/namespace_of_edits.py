@@ -13,6 +13,8 @@ from user_metrics.etl.aggregator import decorator_builder
 from os import getpid
 from user_metrics.metrics import query_mod
 from user_metrics.metrics.users import UMP_MAP
+from operator import itemgetter
+import numpy as np
 
 
 class NamespaceEdits(um.UserMetric):
@@ -76,6 +78,8 @@ class NamespaceEdits(um.UserMetric):
         _data_model_meta['float_fields'],
     }
 
+    _time_series_decomposable = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(NamespaceEdits, self).__init__(**kwargs)
@@ -97,6 +101,43 @@ class NamespaceEdits(um.UserMetric):
                                               self.k_, args)
         return self
 
+    @classmethod
+    def _series_revisions(cls, users, date_start, date_end, metric_params):
+        """ Revisions in all namespaces """
+        query_args = namedtuple('QueryArgs', 'date_start date_end namespace')
+        return query_mod.rev_series_query(users, metric_params.project,
+                                          query_args(date_start, date_end,
+                                                     None))
+
+    @classmethod
+    def _series_rows(cls, user_revs, users, metric_params):
+        """ Tally counts of namespace edits for the users measured """
+        user_list = list(user_revs)
+        if not user_list:
+            return []
+        cells = [row * len(NAMESPACE_KEYS) + NAMESPACE_INDEX[rev[2]]
+                 for row, user in enumerate(user_list)
+                 for rev in user_revs[user] if rev[2] in NAMESPACE_INDEX]
+        counts = np.bincount(np.array(cells, dtype=int),
+                             minlength=len(user_list) * len(NAMESPACE_KEYS))
+        return namespace_rows(user_list, counts.reshape(
+            len(user_list), len(NAMESPACE_KEYS)))
+
+
+# Column of each valid namespace in matrices of namespace edit counts
+NAMESPACE_KEYS = [str(ns) for ns in NamespaceEdits.VALID_NAMESPACES]
+NAMESPACE_INDEX = dict((ns, col) for col, ns in
+                       enumerate(NamespaceEdits.VALID_NAMESPACES))
+
+
+def namespace_rows(users, counts):
+    """
+        Build result rows from a matrix of namespace edit counts of
+        ``users`` by ``NamespaceEdits.VALID_NAMESPACES``.
+    """
+    return [(user, OrderedDict(zip(NAMESPACE_KEYS, row)))
+            for user, row in zip(users, counts.tolist())]
+
 
 def _process_help(args):
     """
@@ -104,38 +145,36 @@ def _process_help(args):
     """
 
     users = args[0]
-    state = args[1]
-
-    metric_params = um.UserMetric._unpack_params(state)
-    query_args_type = namedtuple('QueryArgs', 'start end')
+    metric_params = args[1]
 
     if metric_params.log_:
         logging.info(__name__ + '::Computing namespace edits. (PID = %s)' %
                                 getpid())
 
-    # Tally counts of namespace edits
-    results = dict()
-    ump_res = UMP_MAP[metric_params.group](users, metric_params)
-    for ump_rec in ump_res:
-
-        results[str(ump_rec.user)] = OrderedDict()
-
-        for ns in NamespaceEdits.VALID_NAMESPACES:
-            results[str(ump_rec.user)][str(ns)] = 0
-
-        query_results = query_mod.namespace_edits_rev_query([ump_rec.user],
-            metric_params.project,
-            query_args_type(ump_rec.start, ump_rec.end))
-
-        for row in query_results:
-            try:
-                if row[1] in NamespaceEdits.VALID_NAMESPACES:
-                    results[str(row[0])][str(row[1])] = int(row[2])
-            except (KeyError, IndexError):
-                logging.error(__name__ + "::Could not process row: %s" % str(row))
-                continue
+    # Count the edits of all users by namespace within their own windows
+    # and tally them in a matrix of users by namespace
+    periods = list(UMP_MAP[metric_params.group](users, metric_params))
+    try:
+        query_results = query_mod.namespace_edits_batch_query(
+            [(p.user, p.start, p.end) for p in periods],
+            metric_params.project)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + '::Could not count namespace edits: ' +
+                      str(e))
+        return []
+
+    user_index = dict((long(p.user), row) for row, p in enumerate(periods))
+    counts = np.zeros((len(periods), len(NAMESPACE_KEYS)), dtype=int)
+    for row in query_results:
+        try:
+            if row[1] in NAMESPACE_INDEX:
+                counts[user_index[long(row[0])],
+                       NAMESPACE_INDEX[row[1]]] = int(row[2])
+        except (KeyError, IndexError, ValueError):
+            logging.error(__name__ + "::Could not process row: %s" % str(row))
+            continue
 
-    return [(user, results[user]) for user in results]
+    return namespace_rows([str(p.user) for p in periods], counts)
 
 
 # ==========================
@@ -147,16 +186,17 @@ def _process_help(args):
 @decorator_builder(NamespaceEdits.header())
 def namespace_edits_sum(metric):
     """ Computes the fraction of editors reaching a threshold """
-    summed_results = ["namespace_edits_sum", OrderedDict()]
-    for ns in NamespaceEdits.VALID_NAMESPACES:
-        summed_results[1][str(ns)] = 0
+    get_counts = itemgetter(*NAMESPACE_KEYS)
+    counts = list()
     for r in metric.__iter__():
         try:
-            for ns in NamespaceEdits.VALID_NAMESPACES:
-                summed_results[1][str(ns)] += r[1][str(ns)]
-        except (IndexError, TypeError):
+            counts.append(get_counts(r[1]))
+        except (IndexError, KeyError, TypeError):
             continue
-    return summed_results
+
+    totals = np.array(counts, dtype=int).reshape(-1, len(NAMESPACE_KEYS))
+    return ["namespace_edits_sum",
+            OrderedDict(zip(NAMESPACE_KEYS, totals.sum(axis=0).tolist()))]
 setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_FLAG, True)
 setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_NAME,
         'namespace_edits_aggregates')
@@ -166,6 +206,17 @@ setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_HEAD, ['type',
                                                          'total_editors',
                                                          'reverted_editors'])
 
+
+def merge_namespace_edits(partials):
+    """ Merges partial results of ``namespace_edits_sum`` """
+    totals = OrderedDict((key, 0) for key in NAMESPACE_KEYS)
+    for partial in partials:
+        for key, count in partial[1].iteritems():
+            totals[key] += count
+    return [partials[0][0], totals]
+setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_MERGE, merge_namespace_edits)
+
+
 if __name__ == "__main__":
     users = ['17792132', '17797320', '17792130', '17792131',
              '17792136', 13234584, 156171]
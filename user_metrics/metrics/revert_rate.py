@@ -10,7 +10,8 @@ from collections import namedtuple
 import user_metric as um
 import os
 import user_metrics.utils.multiprocessing_wrapper as mpw
-from user_metrics.etl.aggregator import decorator_builder, weighted_rate
+from user_metrics.etl.aggregator import decorator_builder, weighted_rate, \
+    merge_weighted_rates
 from user_metrics.metrics import query_mod
 from user_metrics.metrics.users import UMP_MAP
 from user_metrics.utils import format_mediawiki_timestamp
@@ -47,7 +48,9 @@ class RevertRate(um.UserMetric):
         In this call `look_ahead` and `look_back` indicate how many revisions
         in the past and in the future for a given article we are willing to
         look for a revert.  The identification of reverts is done by matching
-        sha1 checksum values over revision history.
+        sha1 checksum values over revision history.  The revision windows of
+        all pages edited by the users of a worker are fetched in batches and
+        reverts are detected in memory.
     """
 
     REV_SHA1_IDX = 2
@@ -100,58 +103,76 @@ class RevertRate(um.UserMetric):
         return self
 
 
-def __revert(rev_id, page_id, sha1, user_text, metric_args):
-    """ Returns the revision corresponding to a revision if it exists. """
-
-    history = {}
-    for rev in __history(rev_id, page_id, metric_args.look_back,
-                         metric_args.project, metric_args.namespace):
-        history[rev[RevertRate.REV_SHA1_IDX]] = rev
-
-    for rev in __future(rev_id, page_id, metric_args.look_ahead,
-                        metric_args.project, metric_args.namespace):
-        if rev[RevertRate.REV_SHA1_IDX] in history and \
-           rev[RevertRate.REV_SHA1_IDX] != sha1:
-            if user_text == rev[RevertRate.REV_USER_TEXT_IDX]:
-                return None
-            else:
-                return rev
-
+def _get_reverted_revisions(revisions, metric_args):
+    """
+        Returns the set of revision ids from ``revisions`` that were
+        reverted.  Revisions are tuples of the form ``(rev_id, rev_page,
+        rev_sha1, rev_user_text)``.
+
+        The ``look_back`` revisions preceding and ``look_ahead`` revisions
+        following each revision are fetched in batches by
+        ``page_rev_window_query``.  A revision is considered reverted if,
+        among the ``look_ahead`` revisions following it on the page, there
+        is one that restores the content (sha1) of one of the ``look_back``
+        revisions preceding it and that was made by another editor.
+    """
 
-def __history(rev_id, page_id, n, project, namespace):
-    """ Produce the n revisions on a page before a given revision
-            Returns a generator of revision objects """
+    # Build the ordered revision history surrounding the revisions of each
+    # page, windows of nearby revisions overlap and are merged on rev_id
+    rev_windows = set((long(rev[1]), long(rev[0])) for rev in revisions)
+    page_revs = dict()
     try:
-        history =  query_mod.page_rev_hist_query(rev_id, page_id, n, project,
-                                                 namespace, look_ahead=False)
+        for row in query_mod.page_rev_window_query(
+                sorted(rev_windows),
+                metric_args.project,
+                metric_args.look_back,
+                metric_args.look_ahead):
+            page_revs.setdefault(long(row[0]), dict())[long(row[1])] = \
+                tuple(row[1:])
     except query_mod.UMQueryCallError as e:
         logging.error(__name__ + ' :: Failed to '
-                                 'get revision history: {0}'.format(e.message))
-        history = list()
-    return history
+                                 'get revision windows: {0}'.format(e.message))
+        return set()
+
+    page_history = dict()
+    page_index = dict()
+    for page_id, page_rows in page_revs.iteritems():
+        page_history[page_id] = [page_rows[page_rev_id] for page_rev_id
+                                 in sorted(page_rows)]
+        page_index[page_id] = dict((page_rev[0], i) for i, page_rev in
+                                   enumerate(page_history[page_id]))
+
+    # Slide the look back/ahead window over each page history
+    reverted = set()
+    for rev in revisions:
+        rev_id, page_id = long(rev[0]), long(rev[1])
+        try:
+            history = page_history[page_id]
+            index = page_index[page_id][rev_id]
+        except KeyError:
+            continue
 
+        past_sha1s = set([r[RevertRate.REV_SHA1_IDX] for r in
+                          history[max(0, index - metric_args.look_back):
+                                  index]])
 
-def __future(rev_id, page_id, n, project, namespace):
-    """ Produce the n revisions on a page after a given revision
-            Returns a generator of revision objects """
-    try:
-        future = query_mod.page_rev_hist_query(rev_id, page_id, n, project,
-                                                namespace, look_ahead=True)
-    except query_mod.UMQueryCallError as e:
-        logging.error(__name__ + ' :: Failed to '
-                                 'get revision future: {0}'.format(e.message))
-        future = list()
-    return future
+        for future_rev in history[index + 1:
+                                  index + 1 + metric_args.look_ahead]:
+            if future_rev[RevertRate.REV_SHA1_IDX] in past_sha1s and \
+                    future_rev[RevertRate.REV_SHA1_IDX] != rev[2]:
+                if future_rev[RevertRate.REV_USER_TEXT_IDX] != rev[3]:
+                    reverted.add(rev_id)
+                break
+
+    return reverted
 
 
 def _process_help(args):
-    """ Used by Threshold::process() for forking.
+    """ Used by RevertRate::process() for forking.
         Should not be called externally. """
 
-    state = args[1]
     users = args[0]
-
-    thread_args = um.UserMetric._unpack_params(state)
+    thread_args = args[1]
 
     if thread_args.log_:
         logging.info(__name__ +
@@ -160,17 +181,11 @@ def _process_help(args):
     results_agg = list()
     dropped_users = 0
 
+    # Get user revisions in each user's time period
+    user_revisions = list()
     umpd_obj = UMP_MAP[thread_args.group](users, thread_args)
     for user_data in umpd_obj:
 
-        total_revisions = 0.0
-        total_reverts = 0.0
-
-        # Call query on revert rate for each user
-        #
-        # 1. Obtain user registration date
-        # 2. Compute end date based on 't'
-        # 3. Get user revisions in time period
         query_args = namedtuple('QueryArgs', 'date_start date_end namespace')\
             (format_mediawiki_timestamp(user_data.start),
              format_mediawiki_timestamp(user_data.end),
@@ -187,16 +202,21 @@ def _process_help(args):
             dropped_users += 1
             continue
 
-        results_thread = mpw.build_thread_pool(revisions, _revision_proc,
-                                               thread_args.kr_, state)
+        user_revisions.append((user_data.user, revisions))
 
-        for r in results_thread:
-            total_revisions += r[0]
-            total_reverts += r[1]
+    # Detect reverts over the revisions of all users at once
+    reverted = _get_reverted_revisions(
+        [rev for user, user_revs in user_revisions for rev in user_revs],
+        thread_args)
+
+    for user, revisions in user_revisions:
+        total_revisions = float(len(revisions))
+        total_reverts = float(len([rev for rev in revisions
+                                   if long(rev[0]) in reverted]))
         if not total_revisions:
-            results_agg.append([user_data.user, 0.0, total_revisions])
+            results_agg.append([user, 0.0, total_revisions])
         else:
-            results_agg.append([user_data.user, total_reverts / total_revisions,
+            results_agg.append([user, total_reverts / total_revisions,
                                 total_revisions])
 
     if thread_args.log_:
@@ -206,23 +226,6 @@ def _process_help(args):
     return results_agg
 
 
-def _revision_proc(args):
-    """ helper method for computing reverts """
-
-    state = args[1]
-    thread_args = um.UserMetric._unpack_params(state)
-
-    rev_data = args[0]
-
-    revision_count = 0.0
-    revert_count = 0.0
-    for rev in rev_data:
-        if __revert(rev[0], rev[1], rev[2], rev[3], thread_args):
-            revert_count += 1.0
-        revision_count += 1.0
-    return [(revision_count, revert_count)]
-
-
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
@@ -239,5 +242,6 @@ setattr(revert_rate_avg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
                                                     'average_rate',])
 setattr(revert_rate_avg, um.METRIC_AGG_METHOD_KWARGS, {'val_idx' : 1,
                                                        'weight_idx' : 1})
+setattr(revert_rate_avg, um.METRIC_AGG_METHOD_MERGE, merge_weighted_rates)
 
 
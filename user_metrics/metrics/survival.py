@@ -5,7 +5,8 @@ __license__ = "GPL (version 2 or later)"
 
 import user_metric as um
 import threshold as th
-from user_metrics.etl.aggregator import decorator_builder, boolean_rate
+from user_metrics.etl.aggregator import decorator_builder, boolean_rate, \
+    merge_rates
 
 
 class Survival(um.UserMetric):
@@ -77,11 +78,15 @@ class Survival(um.UserMetric):
         """
 
         # Utilize threshold, survival is denoted by making at least one
-        # revision
+        # revision.  Threshold counts the revisions of all users in batch.
         kwargs['survival_'] = True
         kwargs['n'] = 1
 
-        self._results = th.Threshold(**kwargs).\
+        init_kwargs = dict((name, getattr(self, name))
+                           for name in self._param_types['init'])
+        init_kwargs['n'] = 1
+
+        self._results = th.Threshold(**init_kwargs).\
             process(user_handle, **kwargs)._results
         return self
 
@@ -102,3 +107,4 @@ setattr(survival_editors_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
                                                           'has_survived',
                                                           'rate'])
 setattr(survival_editors_agg, um.METRIC_AGG_METHOD_KWARGS, {'val_idx': 1})
+setattr(survival_editors_agg, um.METRIC_AGG_METHOD_MERGE, merge_rates)
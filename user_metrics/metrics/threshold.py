@@ -8,7 +8,8 @@ from user_metrics.config import logging
 import os
 import user_metrics.utils.multiprocessing_wrapper as mpw
 import user_metric as um
-from user_metrics.etl.aggregator import decorator_builder, boolean_rate
+from user_metrics.etl.aggregator import decorator_builder, boolean_rate, \
+    merge_rates
 from user_metrics.metrics import query_mod
 from user_metrics.metrics.users import UMP_MAP
 
@@ -103,9 +104,7 @@ def _process_help(args):
 
     # Unpack args
     users = args[0]
-    state = args[1]
-
-    metric_params = um.UserMetric._unpack_params(state)
+    metric_params = args[1]
 
     if metric_params.log_:
         logging.info(__name__ + ' :: Processing revision data ' +
@@ -117,23 +116,23 @@ def _process_help(args):
     if not len(users):
         return []
 
-    results = list()
+    # Count the revisions of all users within their own windows at once
+    user_windows = [(long(t.user), t.start, t.end) for t in
+                    UMP_MAP[metric_params.group](users, metric_params)]
     dropped_users = 0
-    umpd_obj = UMP_MAP[metric_params.group](users, metric_params)
-    for t in umpd_obj:
-        uid = long(t.user)
-        try:
-            count = query_mod.rev_count_query(uid,
-                                              metric_params.survival_,
-                                              metric_params.namespace,
-                                              metric_params.project,
-                                              t.start,
-                                              t.end)
-        except query_mod.UMQueryCallError:
-            dropped_users += 1
-            continue
-
-        if count < metric_params.n:
+    try:
+        counts = query_mod.rev_count_batch_query(user_windows,
+                                                 metric_params.survival_,
+                                                 metric_params.namespace,
+                                                 metric_params.project)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Could not count revisions: ' + str(e))
+        dropped_users = len(user_windows)
+        user_windows = list()
+
+    results = list()
+    for uid, start, end in user_windows:
+        if counts.get(uid, 0) < metric_params.n:
             results.append((uid, 0))
         else:
             results.append((uid, 1))
@@ -162,6 +161,7 @@ setattr(threshold_editors_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
                                                            'threshold_reached',
                                                            'rate'])
 setattr(threshold_editors_agg, um.METRIC_AGG_METHOD_KWARGS, {'val_idx': 1})
+setattr(threshold_editors_agg, um.METRIC_AGG_METHOD_MERGE, merge_rates)
 
 # testing
 if __name__ == "__main__":
@@ -7,12 +7,12 @@ __license__ = "GPL (version 2 or later)"
 from user_metrics.config import logging
 from os import getpid
 
-from dateutil.parser import parse as date_parse
 import user_metric as um
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, merge_weighted_rates
 from user_metrics.metrics import query_mod
-from numpy import median, min, max
+from numpy import median, min, max, array
+from user_metrics.utils import mediawiki_timestamp_to_epoch
 import user_metrics.utils.multiprocessing_wrapper as mpw
 
 # Constants for threshold events
@@ -113,26 +113,37 @@ def _process_help(args):
     """
 
     # Unpack args
-    state = args[1]
     users = args[0]
-
-    thread_args = um.UserMetric._unpack_params(state)
+    thread_args = args[1]
 
     if thread_args.log_:
         logging.debug(__name__ + '::Computing Time to threshold on '
                                  '{0} users. (PID = {1})'.format(len(users),
                                                                  getpid()))
-    minutes_to_threshold = list()
-
-    # For each user gather their revisions and produce a time diff
-    for user in users:
-        revs = query_mod.\
-            time_to_threshold_revs_query(user, thread_args.project, None)
-        revs = [rev[0] for rev in revs]
-        minutes_to_threshold.append(
-            [user, get_minute_diff_result(revs,
-                                          thread_args.threshold_edit,
-                                          thread_args.first_edit)])
+    # Fetch only the revisions marking the first and threshold events
+    first = thread_args.first_edit
+    threshold = thread_args.threshold_edit
+    try:
+        timestamps = query_mod.rev_offset_timestamp_query(
+            users, [first, threshold], thread_args.project)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + '::Could not fetch revisions: ' + str(e))
+        return []
+
+    minutes_to_threshold = [[user, -1] for user in users]
+    reached = [(index, timestamps[(long(user), first)],
+                timestamps[(long(user), threshold)])
+               for index, user in enumerate(users)
+               if (long(user), first) in timestamps and
+               (long(user), threshold) in timestamps]
+
+    if reached:
+        indices, start_ts, end_ts = zip(*reached)
+        minutes = abs(
+            mediawiki_timestamp_to_epoch(array(end_ts, dtype='i8')) -
+            mediawiki_timestamp_to_epoch(array(start_ts, dtype='i8'))) // 60
+        for index, diff in zip(indices, minutes.tolist()):
+            minutes_to_threshold[index][1] = int(diff)
 
     if thread_args.log_:
         logging.info(__name__ + '::Processed PID = {0}.'.format(getpid()))
@@ -140,37 +151,6 @@ def _process_help(args):
     return minutes_to_threshold
 
 
-def get_minute_diff_result(results, first, threshold):
-    """
-        Helper method.  This computes the minutes
-        to threshold for the timestamp results.
-
-            - Parameters:
-                - **results** - list.  list of revision records with
-                    timestamp for a given user.
-    """
-    if threshold == REGISTRATION and len(results):
-        dat_obj_end = date_parse(results[0])
-    elif threshold == LAST_EDIT and len(results):
-        dat_obj_end = date_parse(results[len(results) - 1])
-    elif threshold < len(results):
-        dat_obj_end = date_parse(results[threshold])
-    else:
-        return -1
-
-    if first == REGISTRATION and len(results) > 0:
-        dat_obj_start = date_parse(results[0])
-    elif first == LAST_EDIT and len(results):
-        dat_obj_start = date_parse(results[len(results) - 1])
-    elif first < len(results):
-        dat_obj_start = date_parse(results[first])
-    else:
-        return -1
-
-    time_diff = dat_obj_end - dat_obj_start
-    return int(time_diff.seconds / 60) + abs(time_diff.days) * 24
-
-
 # ==========================
 # DEFINE METRIC AGGREGATORS
 # ==========================
@@ -185,6 +165,7 @@ setattr(ttt_avg_agg, um.METRIC_AGG_METHOD_HEAD, ['total_users',
                                                  'total_weight',
                                                  'average'])
 setattr(ttt_avg_agg, um.METRIC_AGG_METHOD_KWARGS, {'val_idx': 1})
+setattr(ttt_avg_agg, um.METRIC_AGG_METHOD_MERGE, merge_weighted_rates)
 
 
 metric_header = TimeToThreshold.header()
@@ -42,6 +42,16 @@
     at the Wikimedia Foundation.  The guidelines for this development may
     be found at https://meta.wikimedia.org/wiki/Research:Metrics.
 
+    Once processed the results of a metric are held in a ``MetricResults``
+    object which stores each field of the results in a column.  Iterating
+    the results yields a row view per user that behaves as the list of
+    field values, while aggregators read whole columns with ``column``.
+
+    Large cohorts may be processed in batches of users with ``process_iter``,
+    which accepts any iterable of users and yields the results of each
+    batch.  ``stream_aggregator`` aggregates these batches as they are
+    produced for aggregators that define a merge method.
+
 """
 
 __author__ = "Ryan Faulkner"
@@ -53,8 +63,11 @@ from user_metrics.config import logging
 import user_metrics.etl.data_loader as dl
 from collections import namedtuple
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
-from user_metrics.utils import build_namedtuple
 from os import getpid
+from ast import literal_eval
+from itertools import islice
+from types import IntType, LongType, FloatType, BooleanType
+import numpy as np
 import user_metrics.config.settings as conf
 
 
@@ -79,10 +92,16 @@ def pre_metrics_init(init_f):
 # 2. header attribute for a type of metric aggregation methods
 # 3. name attribute for a type of metric aggregation methods
 # 4. keyword arg attribute for a type of metric aggregation methods
+# 5. merge attribute for metric aggregation methods whose results over
+#    batches of users may be merged, see ``stream_aggregator``
 METRIC_AGG_METHOD_FLAG = 'metric_agg_flag'
 METRIC_AGG_METHOD_HEAD = 'metric_agg_head'
 METRIC_AGG_METHOD_NAME = 'metric_agg_name'
 METRIC_AGG_METHOD_KWARGS = 'metric_agg_kwargs'
+METRIC_AGG_METHOD_MERGE = 'metric_agg_merge'
+
+# Number of users processed in each batch by ``UserMetric.process_iter``
+PROCESS_BATCH_SIZE = 10000
 
 # Class for storing aggregate data
 aggregate_data_class = namedtuple("AggregateData", "header data")
@@ -104,15 +123,53 @@ def aggregator(agg_method, metric, data_header):
         data = [getattr(agg_method, METRIC_AGG_METHOD_NAME)] + agg_method(
             metric, **kwargs)
     else:
-        # Generic aggregators that are metric agnostic
+        # Generic aggregators that are metric agnostic, columnar results are
+        # passed whole so that they may be aggregated by column
         agg_header = ['type'] + [
             data_header[i] for i in metric._agg_indices[agg_method.__name__]]
-        data = [agg_method.__name__] + agg_method(metric.__iter__(),
+        results = metric._results if isinstance(metric._results,
+                                                MetricResults) \
+            else metric.__iter__()
+        data = [agg_method.__name__] + agg_method(results,
                                                   metric._agg_indices[
                                                   agg_method.__name__])
     return aggregate_data_class(agg_header, data)
 
 
+def stream_aggregator(agg_method, metric, users, data_header,
+                      batch_size=PROCESS_BATCH_SIZE, **kwargs):
+    """
+        Aggregates ``metric`` over ``users``, any iterable of user IDs,
+        processed in batches by ``UserMetric.process_iter``.  Keyword
+        arguments are passed to ``process``.
+
+        Aggregators defining a merge method are applied to the results of
+        each batch and the partial aggregates merged, so that only one batch
+        of results is held at a time.  Other aggregators are applied once to
+        the results of all batches, joined column by column, so results for
+        the whole cohort are held in memory for these.
+    """
+    merge = getattr(agg_method, METRIC_AGG_METHOD_MERGE, None)
+    aggregate = None
+    batches = list()
+
+    for results in metric.process_iter(users, batch_size=batch_size,
+                                       **kwargs):
+        if merge:
+            partial = aggregator(agg_method, metric, data_header)
+            aggregate = partial if aggregate is None else \
+                aggregate_data_class(aggregate.header, aggregate.data[:1] +
+                                     merge([aggregate.data[1:],
+                                            partial.data[1:]]))
+        else:
+            batches.append(results)
+
+    if aggregate is not None:
+        return aggregate
+    metric._set_results(MetricResults.concatenate(batches))
+    return aggregator(agg_method, metric, data_header)
+
+
 def log_pool_worker_start(metric_name, worker_name, data, args):
     """
         Logging method for processing pool workers.
@@ -133,6 +190,204 @@ def log_pool_worker_end(metric_name, worker_name, extra=''):
                   '\t{3}'.format(metric_name, worker_name, getpid(), extra))
 
 
+# Columns of results are stored in numeric arrays when all of their values
+# share one of these types, otherwise in object arrays
+RESULT_COLUMN_TYPES = [
+    ((IntType, LongType, np.integer), 'i8'),
+    ((FloatType, np.floating), 'f8'),
+    ((BooleanType, np.bool_), 'b1'),
+]
+
+
+class MetricRow(object):
+    """
+        View of a row of ``MetricResults``, indexes and compares as the list
+        of its field values.
+    """
+
+    __slots__ = ['_columns', '_index']
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in xrange(*key.indices(len(self)))]
+        value = self._columns[key][self._index]
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self._columns)))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+class MetricResults(object):
+    """
+        Column oriented store of metric results.  Built from the rows
+        produced by a metric, the fields in ``id_fields`` and
+        ``date_fields`` of ``data_model_meta`` are kept as objects, other
+        fields are stored in typed numpy arrays where their values allow.
+        Iterating yields a ``MetricRow`` for each row. ::
+
+            >>> r = MetricResults([[1, 5], [2, 7]], {'id_fields': [0]})
+            >>> r.column(1)
+            array([5, 7])
+            >>> list(r)
+            [[1, 5], [2, 7]]
+    """
+
+    def __init__(self, rows, data_model_meta=None):
+        rows = list(rows)
+        meta = data_model_meta if data_model_meta else dict()
+        object_fields = set(meta.get('id_fields', []) +
+                            meta.get('date_fields', []))
+
+        self._columns = list()
+        if not rows:
+            return
+        if len(set([len(row) for row in rows])) != 1:
+            raise UserMetricError('Metric result rows differ in length.')
+
+        for index, values in enumerate(zip(*rows)):
+            self._columns.append(self.build_column(
+                values, index not in object_fields))
+
+    @staticmethod
+    def build_column(values, typed=True):
+        """ Store column values in an array of their common type """
+        if typed:
+            for value_types, dtype in RESULT_COLUMN_TYPES:
+                if all([isinstance(value, value_types) and
+                        (dtype == 'b1' or not isinstance(value, BooleanType))
+                        for value in values]):
+                    try:
+                        return np.array(values, dtype=dtype)
+                    except OverflowError:
+                        break
+
+        column = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            column[index] = value
+        return column
+
+    @classmethod
+    def concatenate(cls, results):
+        """
+            Join ``MetricResults`` column by column.  Columns whose type
+            differs between results are joined as object arrays.
+        """
+        results = [r for r in results if r.num_fields()]
+        if len(set([r.num_fields() for r in results])) > 1:
+            raise UserMetricError('Metric result rows differ in length.')
+
+        joined = cls([])
+        for index in xrange(results[0].num_fields() if results else 0):
+            columns = [r.column(index) for r in results]
+            if len(set([column.dtype for column in columns])) != 1:
+                columns = [column.astype(object) for column in columns]
+            joined._columns.append(np.concatenate(columns))
+        return joined
+
+    def column(self, index):
+        """ Returns the array storing field ``index`` of all rows """
+        if not self._columns:
+            return np.zeros(0)
+        return self._columns[index]
+
+    def num_fields(self):
+        """ Returns the number of fields in each row """
+        return len(self._columns)
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Metric result index out of range.')
+        return MetricRow(self._columns, index)
+
+    def __iter__(self):
+        return (MetricRow(self._columns, index)
+                for index in xrange(len(self)))
+
+
+class MetricParams(object):
+    """
+        Read only metric parameters passed to pool workers.  A subclass with
+        the parameter names as ``__slots__`` is created once for each set of
+        names by ``build_metric_params``.  Instances pickle as the names and
+        the values only.
+    """
+
+    __slots__ = []
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Metric parameters are read only.')
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'MetricParams(' + ', '.join(
+            ['%s=%r' % (name, getattr(self, name))
+             for name in self.__slots__]) + ')'
+
+    def __reduce__(self):
+        return build_metric_params, (tuple(self.__slots__), tuple(self))
+
+
+# Classes of metric parameters keyed on parameter names
+_PARAM_CLASSES = dict()
+
+
+def build_metric_params(names, values):
+    """ Builds ``MetricParams`` with attributes ``names`` """
+    names = tuple(names)
+    if names not in _PARAM_CLASSES:
+        _PARAM_CLASSES[names] = type('MetricParams', (MetricParams,),
+                                     {'__slots__': names})
+    return _PARAM_CLASSES[names](*values)
+
+
+def cast_param(param_type, value):
+    """
+        Casts a parameter value to ``param_type``.  Parameters may arrive
+        from requests as strings, these are read as Python literals for
+        parameters that are not strings.
+    """
+    if param_type == str:
+        return str(value)
+    if isinstance(value, basestring):
+        try:
+            return literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
 class UserMetricError(Exception):
     """ Basic exception class for UserMetric types """
     def __init__(self, message="Unable to process results using "
@@ -154,6 +409,13 @@ class UserMetric(object):
     _data_model_meta = dict()
     _agg_indices = dict()
 
+    # Metrics whose results over a period depend only on the revisions made
+    # by each user within that period set this flag and implement
+    # ``_series_revisions`` and ``_series_rows``.  Time series for these
+    # metrics are computed from a single pass over the revisions of the full
+    # range, see ``time_series_process_methods``.
+    _time_series_decomposable = False
+
     # Structure that defines parameters for UserMetric class
     _param_types = {
         'init': {
@@ -189,37 +451,17 @@ class UserMetric(object):
 
     def _pack_params(self):
         """
-            This method packs the metric parameters into a list of tuples.  The
-            tuple contains ``(<param name>, <value>, <type cast method>)``.
-            This is mainly useful for passing args to thread pools.
-        """
-        return [(i, getattr(self, i), self._param_types['init'][i][0])
-                for i in self._param_types['init']] +\
-            [(i, getattr(self, i), self._param_types['process'][i][0])
-                for i in self._param_types['process']]
-
-    @staticmethod
-    def _unpack_params(args):
-        """
-            Expects the output from ``_pack_params``.  This is meant to be used
-            in conjunction with _pack_params from within thread pool targets.
-
-                Parameters
-                ~~~~~~~~~~
-
-                args : list
-                    List of parameter data returned by ``_pack_params``.
+            This method packs the metric parameters into a ``MetricParams``
+            object with each value cast to the type of its parameter.  This
+            is mainly useful for passing args to thread pools.
         """
-
         names = list()
-        types = list()
         values = list()
-
-        for n, v, t in args:
-            names.append(n)
-            types.append(t)
-            values.append(v)
-        return build_namedtuple(names, types, values)
+        for arg_type in ['init', 'process']:
+            for name, param in self._param_types[arg_type].iteritems():
+                names.append(name)
+                values.append(cast_param(param[0], getattr(self, name)))
+        return build_metric_params(names, values)
 
     def assign_attributes(self, kwargs, arg_type):
         """ Apply parameter defaults where necessary """
@@ -273,6 +515,25 @@ class UserMetric(object):
     def header():
         raise NotImplementedError()
 
+    @classmethod
+    def _series_revisions(cls, users, date_start, date_end, metric_params):
+        """
+            Returns the revisions of ``users`` in the range ``[date_start,
+            date_end)``.  Each revision is a sequence whose first two
+            elements are the user ID and the MediaWiki revision timestamp.
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def _series_rows(cls, user_revs, users, metric_params):
+        """
+            Returns the metric results for a single time series interval.
+            ``user_revs`` maps each user measured in the interval to the
+            revisions, as returned by ``_series_revisions``, it made within
+            its period.  ``users`` is the full list of users processed.
+        """
+        raise NotImplementedError()
+
     @staticmethod
     def pre_process_metric_call(proc_func):
         def wrapper(self, users, **kwargs):
@@ -291,8 +552,32 @@ class UserMetric(object):
             if hasattr(self, 'log_') and self.log_:
                 logging.info(__name__ + ' :: parameters = ' + str(kwargs))
 
-            return proc_func(self, users, **kwargs)
+            ret = proc_func(self, users, **kwargs)
+            self._set_results(self._results)
+            return ret
         return wrapper
 
+    def _set_results(self, rows):
+        """ Store result rows in columns, see ``MetricResults`` """
+        if not isinstance(rows, MetricResults):
+            rows = MetricResults(rows, self._data_model_meta)
+        self._results = rows
+
     def process(self, users, **kwargs):
         raise NotImplementedError()
+
+    def process_iter(self, users, batch_size=PROCESS_BATCH_SIZE, **kwargs):
+        """
+            Processes ``users``, any iterable of user IDs including
+            generators, ``batch_size`` users at a time and yields the
+            ``MetricResults`` of each batch.  Keyword arguments are passed
+            to ``process``.  Only one batch of users and results is held at
+            a time.
+        """
+        users = iter(users)
+        while True:
+            batch = list(islice(users, batch_size))
+            if not batch:
+                break
+            self.process(batch, **kwargs)
+            yield self._results
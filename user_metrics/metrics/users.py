@@ -22,7 +22,19 @@
     ``USER_METRIC_PERIOD_DATA`` is a simple carrier for the tuples that define
     each users range.  Finally, the ``UserMetricPeriod`` themselves define a
     ``get`` method which returns ``USER_METRIC_PERIOD_DATA`` objects containing
-    the ranges for each user.
+    the ranges for each user.  Registration periods are computed for the
+    whole cohort at once and returned as a ``UMPBatch``, a columnar set of
+    periods that iterates as ``USER_METRIC_PERIOD_DATA``.
+
+    Registration Index
+    ~~~~~~~~~~~~~~~~~~
+
+    Registration dates are read through a ``RegistrationIndex``, a sorted
+    file of user IDs and registration timestamps per project kept in the
+    data file directory and memory mapped by readers.  Users missing from
+    the index are resolved in bulk with ``get_registration_dates`` and added
+    to it, so dates are queried once and then shared by all metric runs and
+    processes.  ``get_registration_index`` returns the index of a project.
 """
 
 __author__ = "ryan faulkner"
@@ -31,13 +43,19 @@ __email__ = 'rfaulkner@wikimedia.org'
 
 from user_metrics.config import logging, settings
 
-from user_metrics.etl.data_loader import Connector
+import os
+import fcntl
+import numpy as np
+from tempfile import mkstemp
+
+from user_metrics.etl.data_loader import get_connection, release_connection
 from datetime import datetime, timedelta
 from user_metrics.metrics import query_mod
 from collections import namedtuple
-from user_metrics.utils import enum, format_mediawiki_timestamp
-from dateutil.parser import parse as date_parse
-from user_metrics.query.query_calls_sql import sub_tokens, escape_var
+from user_metrics.utils import enum, format_mediawiki_timestamp, \
+    mediawiki_timestamp_to_epoch, epoch_to_mediawiki_timestamp
+from user_metrics.query.query_calls_sql import sub_tokens, escape_var, \
+    stream_query_results
 
 # Module level query definitions
 # @TODO move these to the query package
@@ -151,11 +169,12 @@ def generate_test_cohort(project,
     except ValueError as e:
         raise Exception(__name__ + ' :: Bad params ' + str(e))
 
-    conn = Connector(instance=settings.PROJECT_DB_MAP[project])
-    conn._cur_.execute(query, params)
-
-    users = [row for row in conn._cur_]
-    del conn
+    conn = get_connection(settings.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        users = [row[0] for row in conn._cur_]
+    finally:
+        release_connection(conn)
 
     # get latest cohort id & cohort name
     utm_name = generate_test_cohort_name(project)
@@ -164,7 +183,7 @@ def generate_test_cohort(project,
     if write:
         logging.info(__name__ + ' :: Inserting records...\n\n'
                                 '\tCohort name - {0}\n'
-                                '\t{2} - {3} record(s)\n'.
+                                '\t{1} - {2} record(s)\n'.
                                 format(utm_name,
                                        settings.__cohort_db__,
                                        len(users)))
@@ -217,9 +236,12 @@ class MediaWikiUser(object):
         self._query_type = query_type
         super(MediaWikiUser, self).__init__()
 
-    def get_users(self, date_start, date_end, project='enwiki'):
+    def get_users(self, date_start, date_end, project='enwiki',
+                  stream=False):
         """
-            Returns a Generator for MediaWiki user IDs.
+            Returns a Generator for MediaWiki user IDs.  With ``stream``
+            the IDs are read from the server in batches as they are
+            consumed rather than all being buffered by the query.
         """
 
         # @TODO MOVE DB REFS INTO QUERY MODULE
@@ -228,13 +250,25 @@ class MediaWikiUser(object):
             'date_start': format_mediawiki_timestamp(date_start),
             'date_end': format_mediawiki_timestamp(date_end),
         }
-        conn = Connector(instance=settings.PROJECT_DB_MAP[project])
         query = sub_tokens(self.QUERY_TYPES[self._query_type],
             db=escape_var(project))
-        conn._cur_.execute(query, params)
+        if stream:
+            rows = stream_query_results(settings.PROJECT_DB_MAP[project],
+                                        query, params)
+        else:
+            conn = get_connection(settings.PROJECT_DB_MAP[project])
+            rows = conn._cur_
 
-        for row in conn._cur_:
-            yield row[0]
+        try:
+            if not stream:
+                conn._cur_.execute(query, params)
+            for row in rows:
+                yield row[0]
+        finally:
+            if stream:
+                rows.close()
+            else:
+                release_connection(conn)
 
     @staticmethod
     def is_user_name(user_name, project):
@@ -288,6 +322,178 @@ def get_registration_dates(users, project):
     return reg
 
 
+# Registration index settings
+#
+# 1. Name of the index file of a project in the data file directory
+# 2. Record type of index entries, registration timestamps are stored as
+#    integers in the MediaWiki timestamp format
+# 3. Registration of users that have no registration date, these are never
+#    stored and are resolved again on the next lookup since they may be
+#    users not yet replicated
+REGISTRATION_INDEX_FILE = 'registration_{0}.npy'
+REGISTRATION_INDEX_DTYPE = [('user', 'u8'), ('reg', 'u8')]
+REGISTRATION_UNKNOWN = 0
+
+
+class RegistrationIndex(object):
+    """
+        Map of user IDs to registration timestamps for a project, stored
+        sorted on user ID in a numpy file.  The file is replaced atomically
+        on update and remapped by readers when it changes. ::
+
+            >>> RegistrationIndex('enwiki').lookup([13234584])
+            {13234584L: '20100916194802'}
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.path = settings.__data_file_dir__ + \
+            REGISTRATION_INDEX_FILE.format(project)
+        self._index = np.zeros(0, dtype=REGISTRATION_INDEX_DTYPE)
+        self._stat = None
+
+    def lookup(self, users):
+        """
+            Returns a dict of registration timestamps keyed on user ID.
+            Users not yet indexed are resolved in bulk and added to the
+            index.  Users without a registration date are absent from the
+            result and are not indexed.
+        """
+        user_ids, regs = self.lookup_array(users)
+        return dict((long(user), str(reg)) for user, reg in
+                    zip(user_ids, regs))
+
+    def lookup_array(self, users):
+        """
+            Like ``lookup`` but returns arrays of user IDs, sorted, and of
+            their registration timestamps as integers.
+        """
+        user_ids = set()
+        for user in users:
+            try:
+                user_ids.add(long(user))
+            except (TypeError, ValueError):
+                logging.error(__name__ + ' :: Invalid user ID "{0}".'.
+                              format(str(user)))
+        user_ids = np.array(sorted(user_ids), dtype='u8')
+
+        entries, missing = self._find(user_ids)
+        if len(missing):
+            entries = np.concatenate([entries, self._resolve(missing)])
+            entries.sort(order='user')
+
+        entries = entries[entries['reg'] != REGISTRATION_UNKNOWN]
+        return entries['user'], entries['reg']
+
+    def _find(self, user_ids):
+        """
+            Returns the index entries of ``user_ids`` along with the IDs
+            missing from the index.  Entries without a registration date
+            count as missing.
+        """
+        index = self._load()
+        if not len(index):
+            return index[:0], user_ids
+
+        pos = np.minimum(np.searchsorted(index['user'], user_ids),
+                         len(index) - 1)
+        found = (index['user'][pos] == user_ids) & \
+            (index['reg'][pos] != REGISTRATION_UNKNOWN)
+        return np.array(index[pos[found]]), user_ids[~found]
+
+    def _resolve(self, user_ids):
+        """ Fetch registration dates of ``user_ids`` and index them """
+        entries = np.zeros(len(user_ids), dtype=REGISTRATION_INDEX_DTYPE)
+        entries['user'] = user_ids
+
+        # Keep the earliest registration of users with several records
+        regs = dict()
+        for row in get_registration_dates([str(uid) for uid in user_ids],
+                                          self.project):
+            if not row[1]:
+                continue
+            reg = long(format_mediawiki_timestamp(str(row[1])))
+            regs[long(row[0])] = min(reg, regs.get(long(row[0]), reg))
+        entries['reg'] = [regs.get(long(uid), REGISTRATION_UNKNOWN)
+                          for uid in user_ids]
+
+        resolved = entries[entries['reg'] != REGISTRATION_UNKNOWN]
+        if len(resolved):
+            self._store(resolved)
+        return entries
+
+    def _store(self, entries):
+        """ Merge entries into the index file, replacing existing ones """
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = np.concatenate([entries, np.array(self._load())])
+                index = index[np.unique(index['user'],
+                                        return_index=True)[1]]
+
+                fd, tmp_path = mkstemp(dir=os.path.dirname(self.path),
+                                       suffix='.tmp')
+                with os.fdopen(fd, 'wb') as index_file:
+                    np.save(index_file, index)
+                os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        """ Returns the index, remapping the index file if it changed """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self._index
+
+        stat = (stat.st_ino, stat.st_size, stat.st_mtime)
+        if stat != self._stat:
+            try:
+                self._index = np.load(self.path, mmap_mode='r')
+                self._stat = stat
+            except (IOError, ValueError) as e:
+                logging.error(__name__ + ' :: Could not load registration '
+                                         'index {0}: {1}'.format(self.path,
+                                                                 str(e)))
+        return self._index
+
+
+# Registration indices of this process keyed on project
+_REGISTRATION_INDICES = dict()
+
+
+def get_registration_index(project):
+    """ Returns the ``RegistrationIndex`` of ``project`` """
+    if project not in _REGISTRATION_INDICES:
+        _REGISTRATION_INDICES[project] = RegistrationIndex(project)
+    return _REGISTRATION_INDICES[project]
+
+
+class UMPBatch(object):
+    """
+        Columnar set of user metric periods.  ``user``, ``start`` and
+        ``end`` are arrays of user IDs and of period bounds as integer
+        MediaWiki timestamps.  Iterating yields ``USER_METRIC_PERIOD_DATA``
+        objects with string timestamps. ::
+
+            >>> list(UMPBatch([1], [20130101000000], [20130102000000]))
+            [UMPData(user=1L, start='20130101000000', end='20130102000000')]
+    """
+
+    def __init__(self, user, start, end):
+        self.user = np.asarray(user, dtype='u8')
+        self.start = np.asarray(start, dtype='u8')
+        self.end = np.asarray(end, dtype='u8')
+
+    def __len__(self):
+        return len(self.user)
+
+    def __iter__(self):
+        for user, start, end in zip(self.user.tolist(), self.start.tolist(),
+                                    self.end.tolist()):
+            yield USER_METRIC_PERIOD_DATA(long(user), str(start), str(end))
+
+
 class UserMetricPeriod(object):
     """
         Base class of family.  Sub-classes define 1) the ``start`` and ``end``
@@ -323,24 +529,16 @@ class UMPRegistration(UserMetricPeriod):
 
     @staticmethod
     def get(users, metric):
-        reg = get_registration_dates(users, metric.project)
-        for row in reg:
-
-            user = row[0]
-            reg = date_parse(row[1])
-
-            start = format_mediawiki_timestamp(metric.datetime_start)
-            end = format_mediawiki_timestamp(metric.datetime_end)
-
-            if date_parse(start) <= reg <= date_parse(end):
-                reg_plus_t = reg + timedelta(hours=int(metric.t))
-                yield USER_METRIC_PERIOD_DATA(user,
-                    format_mediawiki_timestamp
-                        (reg),
-                    format_mediawiki_timestamp
-                        (reg_plus_t))
-            else:
-                continue
+        user_ids, regs = get_registration_index(metric.project).\
+            lookup_array(users)
+
+        start = long(format_mediawiki_timestamp(metric.datetime_start))
+        end = long(format_mediawiki_timestamp(metric.datetime_end))
+        in_period = (regs >= start) & (regs <= end)
+        user_ids, regs = user_ids[in_period], regs[in_period]
+
+        return UMPBatch(user_ids, regs, epoch_to_mediawiki_timestamp(
+            mediawiki_timestamp_to_epoch(regs) + int(metric.t) * 3600))
 
 
 class UMPInput(UserMetricPeriod):
@@ -21,6 +21,11 @@ def rev_count_query(uid, is_survival, namespace, project,
     return 0L
 rev_count_query.__query_name__ = 'rev_count_query'
 
+def rev_count_batch_query(user_windows, is_survival, namespace, project):
+    """ Get the revision counts of many users for Threshold metrics """
+    return {}
+rev_count_batch_query.__query_name__ = 'rev_count_batch_query'
+
 def live_account_query(users, project, args):
     """ Format query for live_account metric """
     return []
@@ -36,6 +41,11 @@ def rev_len_query(rev_id, project):
     return 0L
 rev_len_query.__query_name__ = 'rev_len_query'
 
+def rev_len_batch_query(rev_ids, project):
+    """ Get revision lengths keyed on revision id - returns dict """
+    return {}
+rev_len_batch_query.__query_name__ = 'rev_len_batch_query'
+
 def rev_user_query(project, start, end):
     """ Produce all users that made a revision within period """
     return []
@@ -49,6 +59,11 @@ def revert_rate_future_revs_query(rev_id, page_id, n, project):
     """ Compute revision future pegged to a given rev """
     return []
 
+def page_rev_window_query(rev_windows, project, look_back, look_ahead):
+    """ Fetch the page history surrounding a set of revisions """
+    return []
+page_rev_window_query.__query_name__ = 'page_rev_window_query'
+
 def revert_rate_user_revs_query(user, project, args):
     """ Get revision history for a user """
     return []
@@ -59,6 +74,11 @@ def time_to_threshold_revs_query(user_id, project, args):
     return []
 time_to_threshold_revs_query.__query_name__ = 'time_to_threshold_revs_query'
 
+def rev_offset_timestamp_query(users, offsets, project):
+    """ Fetch timestamps of revisions at offsets of user histories """
+    return {}
+rev_offset_timestamp_query.__query_name__ = 'rev_offset_timestamp_query'
+
 def blocks_user_map_query(users):
     """ Obtain map to generate uname to uid"""
     return {}
@@ -73,29 +93,51 @@ def edit_count_user_query(users, project, args):
     return []
 edit_count_user_query.__query_name__ = 'edit_count_user_query'
 
+def edit_count_batch_query(user_windows, project):
+    """ Obtain revision counts of many users """
+    return []
+edit_count_batch_query.__query_name__ = 'edit_count_batch_query'
+
 def namespace_edits_rev_query(users, project, args):
     """ Obtain revisions by namespace """
     return []
 namespace_edits_rev_query.__query_name__ = 'namespace_edits_rev_query'
 
+def namespace_edits_batch_query(user_windows, project):
+    """ Obtain revision counts by namespace of many users """
+    return []
+namespace_edits_batch_query.__query_name__ = 'namespace_edits_batch_query'
+
+def rev_series_query(users, project, args):
+    """ Obtain the revisions of users over a time series range """
+    return []
+rev_series_query.__query_name__ = 'rev_series_query'
+
 def user_registration_date(users, project, args):
     return []
 user_registration_date.__query_name__ = 'user_registration_date'
 
 query_store = {
     rev_count_query.__query_name__: None,
+    rev_count_batch_query.__query_name__: None,
     live_account_query.__query_name__: None,
     rev_query.__query_name__: None,
     rev_len_query.__query_name__: None,
+    rev_len_batch_query.__query_name__: None,
     rev_user_query.__query_name__: None,
     revert_rate_past_revs_query.__name__: None,
     revert_rate_future_revs_query.__name__: None,
+    page_rev_window_query.__query_name__: None,
     revert_rate_user_revs_query.__query_name__: None,
     time_to_threshold_revs_query.__query_name__: None,
+    rev_offset_timestamp_query.__query_name__: None,
     blocks_user_map_query.__name__: None,
     blocks_user_query.__query_name__: None,
     edit_count_user_query.__query_name__: None,
+    edit_count_batch_query.__query_name__: None,
     namespace_edits_rev_query.__query_name__: None,
+    namespace_edits_batch_query.__query_name__: None,
+    rev_series_query.__query_name__: None,
     user_registration_date.__query_name__: None,
     }
 
@@ -11,7 +11,8 @@ __license__ = "GPL (version 2 or later)"
 import user_metrics.config.settings as conf
 
 from user_metrics.utils import format_mediawiki_timestamp
-from user_metrics.etl.data_loader import DataLoader, Connector, ConnectorError
+from user_metrics.etl.data_loader import DataLoader, ConnectorError, \
+    get_connection, release_connection
 from MySQLdb import escape_string, ProgrammingError, OperationalError
 from copy import deepcopy
 from datetime import datetime
@@ -27,6 +28,22 @@ COMP1_TOKEN = '<comparator_1>'
 USERS_TOKEN = '<users>'
 ORDER_TOKEN = '<order>'
 
+# MySQL client errors raised when the server connection has been lost:
+# CR_SERVER_GONE_ERROR and CR_SERVER_LOST
+LOST_CONNECTION_ERRORS = (2006, 2013)
+
+# Maximum number of values bound to a single "IN (...)" condition by the
+# batched query calls
+MAX_IN_CLAUSE_SIZE = 1000
+
+# Maximum number of rows of a derived table of user windows, see
+# ``format_user_window_table``
+USER_WINDOW_CHUNK_SIZE = 2000
+
+# Number of cohort users inserted by each ``executemany`` batch of
+# ``add_cohort_data``, keeps statements within ``max_allowed_packet``
+COHORT_INSERT_CHUNK_SIZE = 10000
+
 
 class UMQueryCallError(Exception):
     """ Basic exception class for UserMetric types """
@@ -115,10 +132,63 @@ def format_namespace(namespace, col='page_namespace'):
     return ns_cond
 
 
+def format_user_window_table(num_windows):
+    """
+        Returns a derived table of ``num_windows`` user windows with columns
+        ``uid``, ``start_ts`` and ``end_ts``.  Values are bound as
+        positional parameters, three per window, in that order.
+    """
+    return '(' + ' UNION ALL '.join(
+        ['SELECT %s AS uid, %s AS start_ts, %s AS end_ts'] +
+        ['SELECT %s, %s, %s'] * (num_windows - 1)) + ')'
+
+
+def format_user_window_params(user_windows):
+    """
+        Flattens ``(uid, start, end)`` tuples to the parameters of a table
+        built by ``format_user_window_table``.
+    """
+    params = list()
+    try:
+        for uid, start, end in user_windows:
+            params.extend([long(uid), str(start), str(end)])
+    except (TypeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    return params
+
+
+def stream_query_results(instance, query, params=None):
+    """
+        Generator over the rows of ``query`` on ``instance`` read in batches
+        with a server side cursor.  A connection is only taken from the pool
+        once iteration starts and is released once the rows are exhausted or
+        the generator is closed, generators that are never iterated hold no
+        connection.
+    """
+    try:
+        conn = get_connection(instance)
+    except ConnectorError:
+        logging.error(__name__ + ' :: Could not establish a connection.')
+        raise UMQueryCallError(__name__ + ' :: Could not '
+                                          'establish a connection.')
+    try:
+        for row in conn.stream(query, params):
+            yield row
+    except (OperationalError, ProgrammingError) as e:
+        logging.error(__name__ +
+                      ' :: Query failed: {0}, params = {1}'.
+                      format(query, str(params)))
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    finally:
+        release_connection(conn)
+
+
 def query_method_deco(f):
     """ Decorator that handles setup and tear down of user
-        query dependent on user cohort & project """
-    def wrapper(users, project, args):
+        query dependent on user cohort & project.  Results are returned as
+        a list, or with ``stream=True`` as a generator over the rows as
+        they are read from the server. """
+    def wrapper(users, project, args, stream=False):
         # ensure the handles are iterable
         if not hasattr(users, '__iter__'):
             users = [users]
@@ -144,36 +214,60 @@ def query_method_deco(f):
         query, params = f(users, project, args)
         query = sub_tokens(query, db=project, users=user_str)
         try:
-            conn = Connector(instance=conf.PROJECT_DB_MAP[project])
+            instance = conf.PROJECT_DB_MAP[project]
         except KeyError:
             logging.error(__name__ + ' :: Project does not exist.')
             return []
+
+        if stream:
+            return stream_query_results(instance, query, params)
+
+        try:
+            conn = get_connection(instance)
         except ConnectorError:
             logging.error(__name__ + ' :: Could not establish a connection.')
             raise UMQueryCallError(__name__ + ' :: Could not '
                                               'establish a connection.')
 
         try:
-            if params:
-                conn._cur_.execute(query, params)
-            else:
-                conn._cur_.execute(query)
-        except (OperationalError, ProgrammingError) as e:
-            logging.error(__name__ +
-                          ' :: Query failed: {0}, params = {1}'.
-                          format(query, str(params)))
-            raise UMQueryCallError(__name__ + ' :: ' + str(e))
-        results = [row for row in conn._cur_]
-        del conn
-        return results
+            # Retry once on a fresh connection if the connection drops
+            retries = 1
+            while True:
+                try:
+                    if params:
+                        conn._cur_.execute(query, params)
+                    else:
+                        conn._cur_.execute(query)
+                    break
+                except OperationalError as e:
+                    if retries and e.args and \
+                            e.args[0] in LOST_CONNECTION_ERRORS:
+                        logging.debug(__name__ + ' :: Connection lost, '
+                                                 'reconnecting: ' + str(e))
+                        retries -= 1
+                        try:
+                            conn.reconnect()
+                            continue
+                        except ConnectorError:
+                            pass
+                    logging.error(__name__ +
+                                  ' :: Query failed: {0}, params = {1}'.
+                                  format(query, str(params)))
+                    raise UMQueryCallError(__name__ + ' :: ' + str(e))
+                except ProgrammingError as e:
+                    logging.error(__name__ +
+                                  ' :: Query failed: {0}, params = {1}'.
+                                  format(query, str(params)))
+                    raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            return [row for row in conn._cur_]
+        finally:
+            release_connection(conn)
     return wrapper
 
 
 def rev_count_query(uid, is_survival, namespace, project,
                     start_ts, threshold_ts):
     """ Get count of revisions associated with a UID for Threshold metrics """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
-
     # The key difference between survival and threshold is that threshold
     # measures a level of activity before a point whereas survival
     # (generally) measures any activity after a point
@@ -189,16 +283,69 @@ def rev_count_query(uid, is_survival, namespace, project,
 
     query = query_store[rev_count_query.__name__] + timestamp_cond
     query = sub_tokens(query, db=escape_var(project), where=ns_cond)
-    conn._cur_.execute(query, {'uid': int(uid), 'ts': str(threshold_ts)})
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
-        count = int(conn._cur_.fetchone()[0])
-    except (IndexError, ValueError):
-        raise UMQueryCallError()
-    del conn
-    return count
+        conn._cur_.execute(query, {'uid': int(uid), 'ts': str(threshold_ts)})
+        try:
+            count = int(conn._cur_.fetchone()[0])
+        except (IndexError, ValueError):
+            raise UMQueryCallError()
+        return count
+    finally:
+        release_connection(conn)
 rev_count_query.__query_name__ = 'rev_count_query'
 
 
+def rev_count_batch_query(user_windows, is_survival, namespace, project):
+    """
+        Get the revision counts of many users for Threshold metrics.
+        ``user_windows`` is a list of ``(uid, start, end)`` tuples, for
+        threshold the revisions in ``(start, end]`` are counted and for
+        survival those after ``end``, matching ``rev_count_query``.  Each
+        chunk of ``USER_WINDOW_CHUNK_SIZE`` windows is counted by a single
+        grouped statement joining a derived table of the windows.
+
+        Returns a dict of counts keyed on user ID.  Users without matching
+        revisions are absent from the result.
+    """
+    user_windows = list(user_windows)
+    counts = dict()
+    if not user_windows:
+        return counts
+
+    if is_survival:
+        where = 'r.rev_timestamp > w.end_ts'
+    else:
+        where = 'r.rev_timestamp > w.start_ts AND r.rev_timestamp <= w.end_ts'
+
+    ns_cond = format_namespace(namespace)
+    if ns_cond:
+        where += ' AND ' + ns_cond
+
+    query = sub_tokens(query_store[rev_count_batch_query.__query_name__],
+                       db=escape_var(project), where=where)
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        for index in xrange(0, len(user_windows), USER_WINDOW_CHUNK_SIZE):
+            chunk = user_windows[index:index + USER_WINDOW_CHUNK_SIZE]
+            params = format_user_window_params(chunk)
+            chunk_query = sub_tokens(query, from_repl=format_user_window_table(
+                len(chunk)))
+            try:
+                conn._cur_.execute(chunk_query, params)
+            except (OperationalError, ProgrammingError) as e:
+                logging.error(__name__ + ' :: Query failed: {0}'.format(e))
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            for row in conn._cur_:
+                counts[long(row[0])] = int(row[1])
+        return counts
+    finally:
+        release_connection(conn)
+rev_count_batch_query.__query_name__ = 'rev_count_batch_query'
+
+
 @query_method_deco
 def live_account_query(users, project, args):
     """ Format query for live_account metric """
@@ -253,40 +400,80 @@ rev_query.__query_name__ = 'rev_query'
 
 def rev_len_query(rev_id, project):
     """ Get parent revision length - returns long """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[rev_len_query.__name__]
     query = sub_tokens(query, db=escape_var(project))
-    conn._cur_.execute(query, {'parent_rev_id': int(rev_id)})
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
-        rev_len = conn._cur_.fetchone()[0]
-    except (IndexError, KeyError, ProgrammingError) as e:
-        raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    del conn
-    return rev_len
+        conn._cur_.execute(query, {'parent_rev_id': int(rev_id)})
+        try:
+            rev_len = conn._cur_.fetchone()[0]
+        except (IndexError, KeyError, ProgrammingError) as e:
+            raise UMQueryCallError(__name__ + ' :: ' + str(e))
+        return rev_len
+    finally:
+        release_connection(conn)
 rev_len_query.__query_name__ = 'rev_len_query'
 
 
+def rev_len_batch_query(rev_ids, project):
+    """
+        Get the lengths of a set of revisions - returns a dict of revision
+        lengths keyed on revision id.  Lookups are issued over a single
+        connection in chunks of at most ``MAX_IN_CLAUSE_SIZE`` ids.  Ids
+        that do not map to a revision are absent from the result.
+    """
+    try:
+        rev_ids = sorted(set([long(rev_id) for rev_id in rev_ids]))
+    except (TypeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+    rev_lens = dict()
+    if not rev_ids:
+        return rev_lens
+
+    query = query_store[rev_len_batch_query.__query_name__]
+    query = sub_tokens(query, db=escape_var(project))
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        for index in xrange(0, len(rev_ids), MAX_IN_CLAUSE_SIZE):
+            rev_cond = DataLoader().format_condition_in(
+                'rev_id', rev_ids[index:index + MAX_IN_CLAUSE_SIZE])
+            try:
+                conn._cur_.execute(sub_tokens(query, where=rev_cond))
+            except (OperationalError, ProgrammingError) as e:
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            for row in conn._cur_:
+                rev_lens[row[0]] = row[1]
+        return rev_lens
+    finally:
+        release_connection(conn)
+rev_len_batch_query.__query_name__ = 'rev_len_batch_query'
+
+
 def rev_user_query(project, start, end):
     """ Produce all users that made a revision within period """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[rev_user_query.__name__]
     query = sub_tokens(query, db=escape_var(project))
     params = {
         'start': str(start),
         'end': str(end)
     }
-    conn._cur_.execute(query, params)
-    users = [str(row[0]) for row in conn._cur_]
-    del conn
-    return users
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        users = [str(row[0]) for row in conn._cur_]
+        return users
+    finally:
+        release_connection(conn)
 rev_user_query.__query_name__ = 'rev_user_query'
 
 
 def page_rev_hist_query(rev_id, page_id, n, project, namespace,
                         look_ahead=False):
     """ Compute revision history pegged to a given rev """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
-
     # Format namespace expression and comparator
     ns_cond = format_namespace(namespace)
 
@@ -305,13 +492,68 @@ def page_rev_hist_query(rev_id, page_id, n, project, namespace,
     except ValueError as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
-    conn._cur_.execute(query, params)
-    for row in conn._cur_:
-        yield row
-    del conn
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query, params)
+        for row in conn._cur_:
+            yield row
+    finally:
+        release_connection(conn)
 page_rev_hist_query.__query_name__ = 'page_rev_hist_query'
 
 
+# Number of revision windows fetched in a single statement
+REV_WINDOW_CHUNK_SIZE = 100
+
+
+def page_rev_window_query(rev_windows, project, look_back, look_ahead):
+    """
+        Fetch the page history surrounding a set of revisions.
+        ``rev_windows`` is a list of ``(page_id, rev_id)`` tuples.  For
+        each the ``look_back`` revisions of the page preceding ``rev_id``,
+        the revision itself and the ``look_ahead`` revisions following it
+        are returned, so at most ``look_back + look_ahead + 1`` rows per
+        window.  Each chunk of ``REV_WINDOW_CHUNK_SIZE`` windows is resolved
+        with a single statement of ordered range scans on ``rev_page``.
+        Windows of nearby revisions may overlap, rows are not deduplicated.
+
+        Returns a generator of ``(rev_page, rev_id, rev_user_text,
+        rev_sha1)`` rows.
+    """
+    rev_windows = list(rev_windows)
+    if not rev_windows:
+        return
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    sub_query = sub_tokens(query_store[page_rev_window_query.__query_name__],
+                           db=escape_var(project))
+
+    try:
+        for index in xrange(0, len(rev_windows), REV_WINDOW_CHUNK_SIZE):
+            chunk = rev_windows[index:index + REV_WINDOW_CHUNK_SIZE]
+            try:
+                params = list()
+                for page_id, rev_id in chunk:
+                    params.extend([long(page_id), long(rev_id),
+                                   int(look_back),
+                                   long(page_id), long(rev_id),
+                                   int(look_ahead) + 1])
+            except (TypeError, ValueError) as e:
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+            query = ' UNION ALL '.join([sub_query] * len(chunk))
+            try:
+                conn._cur_.execute(query, params)
+            except (OperationalError, ProgrammingError) as e:
+                logging.error(__name__ + ' :: Query failed: {0}'.format(e))
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            for row in conn._cur_:
+                yield row
+    finally:
+        release_connection(conn)
+page_rev_window_query.__query_name__ = 'page_rev_window_query'
+
+
 @query_method_deco
 def revert_rate_user_revs_query(user, project, args):
     """ Get revision history for a user """
@@ -339,23 +581,88 @@ def time_to_threshold_revs_query(user_id, project, args):
 time_to_threshold_revs_query.__query_name__ = 'time_to_threshold_revs_query'
 
 
+# Number of users whose revisions at given offsets are fetched in a single
+# statement
+REV_OFFSET_CHUNK_SIZE = 500
+
+
+def rev_offset_timestamp_query(users, offsets, project):
+    """
+        Fetch the timestamps of the revisions of users at given positions
+        of their revision history, ``offsets`` is a list of zero based
+        positions in ascending order of timestamp with -1 denoting the last
+        revision.  Each revision is fetched by an indexed scan limited to
+        the offset rather than by reading the full history.  Each chunk of
+        ``REV_OFFSET_CHUNK_SIZE`` users is resolved by a single statement.
+
+        Returns a dict of timestamps keyed on ``(user_id, offset)``.  Pairs
+        for which the user has too few revisions are absent.
+    """
+    try:
+        users = [long(user) for user in users]
+        offsets = [int(offset) for offset in set(offsets)]
+    except (TypeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    if any([offset < -1 for offset in offsets]):
+        raise UMQueryCallError(__name__ + ' :: Invalid revision offset.')
+
+    timestamps = dict()
+    if not users or not offsets:
+        return timestamps
+
+    query = sub_tokens(query_store[rev_offset_timestamp_query.__query_name__],
+                       db=escape_var(project))
+    sub_queries = {
+        'ASC': sub_tokens(query, order='ASC'),
+        'DESC': sub_tokens(query, order='DESC'),
+    }
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        for index in xrange(0, len(users), REV_OFFSET_CHUNK_SIZE):
+            chunk_queries = list()
+            params = list()
+            for user in users[index:index + REV_OFFSET_CHUNK_SIZE]:
+                for offset in offsets:
+                    if offset == -1:
+                        chunk_queries.append(sub_queries['DESC'])
+                        params.extend([user, offset, user, 0])
+                    else:
+                        chunk_queries.append(sub_queries['ASC'])
+                        params.extend([user, offset, user, offset])
+            try:
+                conn._cur_.execute(' UNION ALL '.join(chunk_queries), params)
+            except (OperationalError, ProgrammingError) as e:
+                logging.error(__name__ + ' :: Query failed: {0}'.format(e))
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            for row in conn._cur_:
+                timestamps[(long(row[0]), int(row[1]))] = str(row[2])
+        return timestamps
+    finally:
+        release_connection(conn)
+rev_offset_timestamp_query.__query_name__ = 'rev_offset_timestamp_query'
+
+
 def blocks_user_map_query(users, project):
     """ Obtain map to generate uname to uid"""
     # Get usernames for user ids to detect in block events
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     user_str = DataLoader().format_comma_separated_list(
         escape_var(users))
 
     query = query_store[blocks_user_map_query.__name__]
     query = sub_tokens(query, db=escape_var(project), users=user_str)
-    conn._cur_.execute(query)
 
-    # keys username on userid
-    user_map = dict()
-    for r in conn._cur_:
-        user_map[r[1]] = r[0]
-    del conn
-    return user_map
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        conn._cur_.execute(query)
+
+        # keys username on userid
+        user_map = dict()
+        for r in conn._cur_:
+            user_map[r[1]] = r[0]
+        return user_map
+    finally:
+        release_connection(conn)
 
 
 @query_method_deco
@@ -382,6 +689,44 @@ def edit_count_user_query(users, project, args):
 edit_count_user_query.__query_name__ = 'edit_count_user_query'
 
 
+def edit_count_batch_query(user_windows, project):
+    """
+        Obtain revision counts of many users.  ``user_windows`` is a list
+        of ``(uid, start, end)`` tuples, the revisions of each user in
+        ``[start, end)`` are counted.  Each chunk of
+        ``USER_WINDOW_CHUNK_SIZE`` windows is counted by a single grouped
+        statement joining a derived table of the windows.
+
+        Returns a list of ``(user_id, revs)`` rows, users without revisions
+        in their window are absent.
+    """
+    user_windows = list(user_windows)
+    rows = list()
+    if not user_windows:
+        return rows
+
+    query = sub_tokens(query_store[edit_count_batch_query.__query_name__],
+                       db=escape_var(project))
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        for index in xrange(0, len(user_windows), USER_WINDOW_CHUNK_SIZE):
+            chunk = user_windows[index:index + USER_WINDOW_CHUNK_SIZE]
+            params = format_user_window_params(chunk)
+            chunk_query = sub_tokens(query, from_repl=format_user_window_table(
+                len(chunk)))
+            try:
+                conn._cur_.execute(chunk_query, params)
+            except (OperationalError, ProgrammingError) as e:
+                logging.error(__name__ + ' :: Query failed: {0}'.format(e))
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            rows.extend(conn._cur_.fetchall())
+        return rows
+    finally:
+        release_connection(conn)
+edit_count_batch_query.__query_name__ = 'edit_count_batch_query'
+
+
 @query_method_deco
 def namespace_edits_rev_query(users, project, args):
     """ Obtain revisions by namespace """
@@ -394,6 +739,66 @@ def namespace_edits_rev_query(users, project, args):
 namespace_edits_rev_query.__query_name__ = 'namespace_edits_rev_query'
 
 
+def namespace_edits_batch_query(user_windows, project):
+    """
+        Obtain revision counts by namespace of many users.
+        ``user_windows`` is a list of ``(uid, start, end)`` tuples, the
+        revisions of each user in ``[start, end)`` are counted.  Each chunk
+        of ``USER_WINDOW_CHUNK_SIZE`` windows is counted by a single grouped
+        statement joining a derived table of the windows.
+
+        Returns a list of ``(user_id, namespace, revs)`` rows.
+    """
+    user_windows = list(user_windows)
+    rows = list()
+    if not user_windows:
+        return rows
+
+    query = sub_tokens(
+        query_store[namespace_edits_batch_query.__query_name__],
+        db=escape_var(project))
+
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
+    try:
+        for index in xrange(0, len(user_windows), USER_WINDOW_CHUNK_SIZE):
+            chunk = user_windows[index:index + USER_WINDOW_CHUNK_SIZE]
+            params = format_user_window_params(chunk)
+            chunk_query = sub_tokens(query, from_repl=format_user_window_table(
+                len(chunk)))
+            try:
+                conn._cur_.execute(chunk_query, params)
+            except (OperationalError, ProgrammingError) as e:
+                logging.error(__name__ + ' :: Query failed: {0}'.format(e))
+                raise UMQueryCallError(__name__ + ' :: ' + str(e))
+            rows.extend(conn._cur_.fetchall())
+        return rows
+    finally:
+        release_connection(conn)
+namespace_edits_batch_query.__query_name__ = 'namespace_edits_batch_query'
+
+
+@query_method_deco
+def rev_series_query(users, project, args):
+    """
+        Obtain the revisions of users over the full range of a time series,
+        ``args.namespace`` optionally restricts the namespace of the revisions.
+        Rows are ``(rev_user, rev_timestamp, page_namespace, rev_len,
+        rev_parent_id)``.
+    """
+    query = query_store[rev_series_query.__query_name__]
+    ns_cond = ''
+    try:
+        params = {'start': str(args.date_start), 'end': str(args.date_end)}
+        if args.namespace is not None:
+            ns_cond = format_namespace(args.namespace)
+    except AttributeError as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    if ns_cond:
+        query += ' AND ' + ns_cond
+    return query, params
+rev_series_query.__query_name__ = 'rev_series_query'
+
+
 @query_method_deco
 def user_registration_date_logging(users, project, args):
     """ Returns user registration date from logging table """
@@ -414,18 +819,20 @@ def delete_usertags(ut_tag):
         Delete records from usertags for a give tag ID.  This effectively
         empties a cohort.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[
-        conf.__cohort_data_instance__])
     del_query = query_store[delete_usertags.__query_name__]
     del_query = sub_tokens(del_query,
                            db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_db__)
+
+    conn = get_connection(conf.PROJECT_DB_MAP[
+        conf.__cohort_data_instance__])
     try:
         conn._cur_.execute(del_query, {'ut_tag': int(ut_tag)})
+        conn._db_.commit()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    conn._db_.commit()
-    del conn
+    finally:
+        release_connection(conn)
 delete_usertags.__query_name__ = 'delete_usertags'
 
 
@@ -434,18 +841,20 @@ def delete_usertags_meta(ut_tag):
         Delete record from usertags_meta for a give tag ID.  This effectively
         deletes a cohort.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[
-        conf.__cohort_data_instance__])
     del_query = query_store[delete_usertags_meta.__query_name__]
     del_query = sub_tokens(del_query,
                            db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_meta_db__)
+
+    conn = get_connection(conf.PROJECT_DB_MAP[
+        conf.__cohort_data_instance__])
     try:
         conn._cur_.execute(del_query, {'ut_tag': int(ut_tag)})
+        conn._db_.commit()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    conn._db_.commit()
-    del conn
+    finally:
+        release_connection(conn)
 delete_usertags_meta.__query_name__ = 'delete_usertags_meta'
 
 
@@ -462,8 +871,6 @@ def get_api_user(user, by_id=True):
             by_id : Bool(=True)
                 Flag to determine whether filtering by id or name.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
-
     if by_id:
         query = get_api_user.__query_name__ + '_by_id'
         try:
@@ -476,14 +883,14 @@ def get_api_user(user, by_id=True):
     query = query_store[query]
     query = sub_tokens(query, db=conf.__cohort_meta_instance__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(query, params)
+        return conn._cur_.fetchone()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    api_user_tuple = conn._cur_.fetchone()
-    del conn
-    return api_user_tuple
+    finally:
+        release_connection(conn)
 get_api_user.__query_name__ = 'get_api_user'
 
 
@@ -500,7 +907,6 @@ def insert_api_user(user, password):
             password : string
                 Password, this should be a salted hash string.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     query = insert_api_user.__query_name__
     query = query_store[query]
     params = {
@@ -509,13 +915,14 @@ def insert_api_user(user, password):
     }
     query = sub_tokens(query, db=conf.__cohort_meta_instance__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(query, params)
+        conn._db_.commit()
     except (ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    conn._db_.commit()
-    del conn
+    finally:
+        release_connection(conn)
 insert_api_user.__query_name__ = 'insert_api_user'
 
 
@@ -537,11 +944,13 @@ def add_cohort_data(cohort, users, project,
             project : string
                 Project of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
+    conn = get_connection(conf.__cohort_data_instance__)
     now = format_mediawiki_timestamp(datetime.now())
 
     # TODO: ALLOW THE COHORT DEF TO BE REFRESHED IF IT ALREADY EXISTS
 
+    # The cohort meta data and its users are committed in one transaction
+    # so that readers never see, and cache, a partially inserted cohort
     if add_meta:
         logging.debug(__name__ + ' :: Adding new cohort "{0}".'.
                       format(cohort))
@@ -562,44 +971,69 @@ def add_cohort_data(cohort, users, project,
                 'utm_enabled': 0
             }
         except ValueError as e:
+            release_connection(conn)
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
         utm_query = sub_tokens(utm_query, db=conf.__cohort_meta_instance__,
                                table=conf.__cohort_meta_db__)
         try:
             conn._cur_.execute(utm_query, params)
-            conn._db_.commit()
+            usertag = conn._cur_.lastrowid
         except (ProgrammingError, OperationalError) as e:
             conn._db_.rollback()
+            release_connection(conn)
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    else:
+        usertag = get_cohort_id(cohort)
 
     # add data to ``user_tags``
     if users:
-        # get uid for cohort
-        usertag = get_cohort_id(cohort)
-
-        logging.debug(__name__ + ' :: Adding cohort {0} users.'.
-                      format(len(users)))
-
         try:
-            value_list_ut = [('{0}'.format(project),
-                              int(uid),
-                              int(usertag))
+            value_list_ut = [(str(project), int(uid), int(usertag))
                              for uid in users]
-        except ValueError as e:
+        except (ValueError, TypeError) as e:
+            conn._db_.rollback()
+            release_connection(conn)
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
-        ut_query = query_store[add_cohort_data.__query_name__] + '(' + \
-                   ' %s,' * len(value_list_ut)[:-1] + ')'
-        ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
+        logging.debug(__name__ + ' :: Adding cohort {0} users.'.
+                      format(len(value_list_ut)))
+
+        ut_query = sub_tokens(query_store[add_cohort_data.__query_name__],
+                              db=conf.__cohort_meta_instance__,
                               table=conf.__cohort_db__)
+        touch_query = sub_tokens(
+            query_store[add_cohort_data.__query_name__ + '_touch'],
+            db=conf.__cohort_meta_instance__, table=conf.__cohort_meta_db__)
+
+        # Insert users in batches, the cohort is then touched with the time
+        # of completion so that cached copies of its users are refreshed
         try:
-            conn._cur_.execute(ut_query, value_list_ut)
-            conn._db_.commit()
+            for i in xrange(0, len(value_list_ut), COHORT_INSERT_CHUNK_SIZE):
+                conn._cur_.executemany(
+                    ut_query,
+                    value_list_ut[i:i + COHORT_INSERT_CHUNK_SIZE])
+                logging.info(__name__ + ' :: Inserted {0} of {1} cohort '
+                                        'users.'.
+                             format(min(i + COHORT_INSERT_CHUNK_SIZE,
+                                        len(value_list_ut)),
+                                    len(value_list_ut)))
+            conn._cur_.execute(
+                touch_query,
+                {'utm_id': int(usertag),
+                 'utm_touched': format_mediawiki_timestamp(datetime.now())})
         except (ProgrammingError, OperationalError) as e:
             conn._db_.rollback()
+            release_connection(conn)
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    del conn
+
+    try:
+        conn._db_.commit()
+    except OperationalError as e:
+        conn._db_.rollback()
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    finally:
+        release_connection(conn)
 add_cohort_data.__query_name__ = 'add_cohort'
 
 
@@ -613,18 +1047,18 @@ def get_cohort_data(cohort_name):
             cohort_name : string
                 Name of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     ut_query = query_store[get_cohort_data.__query_name__]
     ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
                            table=conf.__cohort_meta_db__)
 
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(ut_query, {'utm_name': str(cohort_name)})
+        return conn._cur_.fetchone()
     except (ValueError, ProgrammingError, OperationalError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-    data = conn._cur_.fetchone()
-    del conn
-    return data
+    finally:
+        release_connection(conn)
 get_cohort_data.__query_name__ = 'get_cohort_data'
 
 
@@ -652,21 +1086,48 @@ def get_cohort_users(tag_id):
             cohort_name : string
                 Name of cohort.
     """
-    conn = Connector(instance=conf.__cohort_data_instance__)
     ut_query = query_store[get_cohort_users.__query_name__]
     ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
                           table=conf.__cohort_db__)
+
+    conn = get_connection(conf.__cohort_data_instance__)
     try:
         conn._cur_.execute(ut_query, {'tag_id': int(tag_id)})
+        for row in conn._cur_:
+            yield unicode(row[0])
     except (ValueError, ProgrammingError, OperationalError):
         raise UMQueryCallError(__name__ + ' :: Failed to retrieve users.')
-
-    for row in conn._cur_:
-        yield unicode(row[0])
-    del conn
+    finally:
+        release_connection(conn)
 get_cohort_users.__query_name__ = 'get_cohort_users'
 
 
+def get_cohort_touched(tag_id):
+    """
+        Returns the datetime at which a cohort was last modified, None if
+        the cohort does not exist.
+
+        Parameters
+        ~~~~~~~~~~
+
+            tag_id : int
+                ID of cohort.
+    """
+    conn = get_connection(conf.__cohort_data_instance__)
+    utm_query = query_store[get_cohort_touched.__query_name__]
+    utm_query = sub_tokens(utm_query, db=conf.__cohort_meta_instance__,
+                           table=conf.__cohort_meta_db__)
+    try:
+        conn._cur_.execute(utm_query, {'tag_id': int(tag_id)})
+    except (ValueError, TypeError, ProgrammingError, OperationalError) as e:
+        release_connection(conn)
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    row = conn._cur_.fetchone()
+    release_connection(conn)
+    return row[0] if row else None
+get_cohort_touched.__query_name__ = 'get_cohort_touched'
+
+
 def get_mw_user_id(username, project):
     """
     Returns a UID given.
@@ -680,19 +1141,18 @@ def get_mw_user_id(username, project):
         project : string
             MediaWiki project.
     """
-    conn = Connector(instance=conf.PROJECT_DB_MAP[project])
     query = query_store[get_mw_user_id.__query_name__]
     query = sub_tokens(query, db=escape_var(project))
 
+    conn = get_connection(conf.PROJECT_DB_MAP[project])
     try:
         conn._cur_.execute(query, {'username': str(username)})
-        uid = conn._cur_.fetchone()[0]
+        return conn._cur_.fetchone()[0]
     except (IndexError, ValueError, ProgrammingError,
             OperationalError, TypeError) as e:
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
-
-    del conn
-    return uid
+    finally:
+        release_connection(conn)
 get_mw_user_id.__query_name__ = 'get_mw_user_id'
 
 
@@ -715,6 +1175,19 @@ query_store = {
                 ON r.rev_page = p.page_id
         WHERE <where> AND rev_user = %(uid)s
     """,
+    rev_count_batch_query.__query_name__:
+    """
+        SELECT
+            w.uid,
+            count(*) as revs
+        FROM <from> AS w
+            JOIN <database>.revision as r
+                ON r.rev_user = w.uid
+            JOIN <database>.page as p
+                ON r.rev_page = p.page_id
+        WHERE <where>
+        GROUP BY w.uid
+    """,
     live_account_query.__query_name__:
     """
         SELECT
@@ -745,6 +1218,12 @@ query_store = {
         FROM <database>.revision
         WHERE rev_id = %(parent_rev_id)s
     """,
+    rev_len_batch_query.__query_name__:
+    """
+        SELECT rev_id, rev_len
+        FROM <database>.revision
+        WHERE <where>
+    """,
     rev_user_query.__query_name__:
     """
         SELECT distinct rev_user
@@ -763,6 +1242,20 @@ query_store = {
         ORDER BY rev_id <order>
         LIMIT %(n)s
     """,
+    page_rev_window_query.__query_name__:
+    """
+        (SELECT rev_page, rev_id, rev_user_text, rev_sha1
+        FROM <database>.revision
+        WHERE rev_page = %s AND rev_id < %s
+        ORDER BY rev_id DESC
+        LIMIT %s)
+        UNION ALL
+        (SELECT rev_page, rev_id, rev_user_text, rev_sha1
+        FROM <database>.revision
+        WHERE rev_page = %s AND rev_id >= %s
+        ORDER BY rev_id ASC
+        LIMIT %s)
+    """,
     revert_rate_user_revs_query.__query_name__:
     """
            SELECT
@@ -785,6 +1278,14 @@ query_store = {
         WHERE rev_user = %(user_handle)s
         ORDER BY 1 ASC
     """,
+    rev_offset_timestamp_query.__query_name__:
+    """
+        (SELECT %s AS uid, %s AS rev_offset, rev_timestamp
+        FROM <database>.revision
+        WHERE rev_user = %s
+        ORDER BY rev_timestamp <order>
+        LIMIT %s, 1)
+    """,
     blocks_user_map_query.__name__:
     """
         SELECT
@@ -820,6 +1321,18 @@ query_store = {
             AND rev_timestamp < %(end)s
         GROUP BY 1
     """,
+    edit_count_batch_query.__query_name__:
+    """
+        SELECT
+            w.uid,
+            count(*)
+        FROM <from> AS w
+            JOIN <database>.revision AS r
+                ON r.rev_user = w.uid
+        WHERE r.rev_timestamp >= w.start_ts
+            AND r.rev_timestamp < w.end_ts
+        GROUP BY 1
+    """,
     namespace_edits_rev_query.__query_name__:
     """
         SELECT
@@ -834,6 +1347,36 @@ query_store = {
             AND rev_timestamp < %(end)s
         GROUP BY 1,2
     """,
+    namespace_edits_batch_query.__query_name__:
+    """
+        SELECT
+            w.uid,
+            p.page_namespace,
+            count(*) AS revs
+        FROM <from> AS w
+            JOIN <database>.revision AS r
+                ON r.rev_user = w.uid
+            JOIN <database>.page AS p
+                ON r.rev_page = p.page_id
+        WHERE r.rev_timestamp >= w.start_ts
+            AND r.rev_timestamp < w.end_ts
+        GROUP BY 1, 2
+    """,
+    rev_series_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            r.rev_timestamp,
+            p.page_namespace,
+            r.rev_len,
+            r.rev_parent_id
+        FROM <database>.revision AS r
+            JOIN <database>.page AS p
+            ON r.rev_page = p.page_id
+        WHERE rev_user in (<users>)
+            AND rev_timestamp >= %(start)s
+            AND rev_timestamp < %(end)s
+    """,
     user_registration_date_logging.__query_name__:
     """
         SELECT
@@ -885,7 +1428,13 @@ query_store = {
     add_cohort_data.__query_name__:
     """
         INSERT INTO <database>.<table>
-            VALUES
+            VALUES (%s, %s, %s)
+    """,
+    add_cohort_data.__query_name__ + '_touch':
+    """
+        UPDATE <database>.<table>
+        SET utm_touched = %(utm_touched)s
+        WHERE utm_id = %(utm_id)s
     """,
     add_cohort_data.__query_name__ + '_meta':
     """
@@ -914,6 +1463,12 @@ query_store = {
         FROM <database>.<table>
         WHERE ut_tag = %(tag_id)s
     """,
+    get_cohort_touched.__query_name__:
+    """
+        SELECT utm_touched
+        FROM <database>.<table>
+        WHERE utm_id = %(tag_id)s
+    """,
     get_latest_user_activity.__query_name__:
     """
         SELECT
@@ -18,9 +18,14 @@ from collections import namedtuple
 from user_metrics.metrics import edit_count
 from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_TYPE
 from user_metrics.config import settings
-from user_metrics.etl.data_loader import Connector, ConnectorError
+from user_metrics.etl.data_loader import Connector, ConnectorError, \
+    get_connection, release_connection
 
 from user_metrics.metrics import revert_rate
+from user_metrics.utils.multiprocessing_wrapper import build_thread_pool
+from user_metrics.etl.time_series_process_methods import build_time_series
+from user_metrics.etl.aggregator import list_sum_indices
+from user_metrics.metrics.user_metric import aggregator
 
 # User Metric tests
 # =================
@@ -60,6 +65,56 @@ def test_edit_count():
         index += 1
 
 
+def test_edit_count_time_series():
+    """ Decomposed time series match per interval metric runs """
+    users = ['13234584', '13234503', '13234565', '13234585', '13234556']
+    series = build_time_series('20121201000000', '20121208000000', 24,
+                               edit_count.EditCount, list_sum_indices, users,
+                               group='INPUT')
+    for row in series:
+        e = edit_count.EditCount(datetime_start=row[0], datetime_end=row[1],
+                                 group='INPUT').process(users)
+        assert row[3:] == aggregator(list_sum_indices, e,
+                                     edit_count.EditCount.header()).data[1:]
+
+
+def test_time_series_listener():
+    """ Events sent by a worker just before it exits are not dropped """
+    from user_metrics.etl.time_series_process_methods import \
+        time_series_listener, TS_EVENT_DATA, TS_EVENT_DONE
+    from Queue import Empty
+
+    class ExitedWorker(object):
+        pid = 1
+
+        def is_alive(self):
+            return False
+
+        def join(self):
+            pass
+
+    class LateQueue(object):
+        """ Times out once, the events arrive after the timeout """
+        def __init__(self, events):
+            self.events = events
+
+        def get(self, timeout=None):
+            raise Empty
+
+        def get_nowait(self):
+            if not self.events:
+                raise Empty
+            return self.events.pop(0)
+
+    rows = [['20130102000000', '20130103000000', 2],
+            ['20130101000000', '20130102000000', 1]]
+    event_queue = LateQueue([(1, TS_EVENT_DATA, rows[:1]),
+                             (1, TS_EVENT_DATA, rows[1:]),
+                             (1, TS_EVENT_DONE, None)])
+    assert time_series_listener([ExitedWorker()], event_queue) == \
+        sorted(rows)
+
+
 def test_live_account():
     assert False  # TODO: implement your test here
 
@@ -77,6 +132,124 @@ def test_bytes_added():
 
 
 
+def test_metric_results():
+    """ Columnar results iterate as the rows they were built from """
+    from user_metrics.metrics.user_metric import MetricResults
+    import cPickle
+
+    rows = [[1L, 5, 0.5], ['2', 7, 1.5]]
+    results = MetricResults(rows, edit_count.EditCount._data_model_meta)
+    assert list(results) == rows
+    assert results[1][1:] == [7, 1.5]
+    assert results.column(1).dtype.kind == 'i'
+    assert results.column(2).tolist() == [0.5, 1.5]
+    assert list(cPickle.loads(cPickle.dumps(results))) == rows
+
+    joined = MetricResults.concatenate([
+        MetricResults(rows[:1]), MetricResults([]), MetricResults(rows[1:])])
+    assert list(joined) == rows
+    assert joined.column(1).dtype.kind == 'i'
+    assert joined.column(0).dtype.kind == 'O'
+
+
+def test_metric_params():
+    """ Packed metric parameters are cast, read only and picklable """
+    import cPickle
+
+    e = edit_count.EditCount(t='48', namespace=[0, 1])
+    e.assign_attributes({}, 'process')
+    params = e._pack_params()
+    assert params.t == 48 and params.namespace == [0, 1]
+    assert type(params) is type(e._pack_params())
+
+    copy = cPickle.loads(cPickle.dumps(params, cPickle.HIGHEST_PROTOCOL))
+    assert type(copy) is type(params) and list(copy) == list(params)
+    try:
+        params.t = 1
+        assert False
+    except AttributeError:
+        pass
+
+
+def test_column_aggregators():
+    """ Aggregators give the same results on rows and on columns """
+    from user_metrics.metrics.user_metric import MetricResults
+    import user_metrics.etl.aggregator as agg
+
+    rows = [['1', 2, 1], ['2', 1, 4], ['3', 2, 2]]
+    for data in [rows, MetricResults(rows)]:
+        assert agg.list_sum_indices(data, [1, 2]) == [5, 7]
+        assert agg.list_sum_by_group(data, 1) == [['2', 1, 4], ['13', 2, 3]]
+        assert agg.list_average_by_group(data, 1)[1][2] == 1.5
+        assert agg.boolean_rate(data, val_idx=2,
+                                cmp_method=lambda x: x > 1)[:2] == [3, 2]
+        assert agg.weighted_rate(data, weight_idx=1, val_idx=2) == \
+            [3, 5.0, 7.0 / 3]
+
+
+def test_multi_aggregator():
+    """ Combined aggregators match the aggregators run one at a time """
+    from user_metrics.metrics.bytes_added import BytesAdded, ba_mean_agg, \
+        ba_median_agg, ba_max_agg
+    from user_metrics.etl.aggregator import build_multi_agg
+
+    aggs = [ba_mean_agg, ba_median_agg, ba_max_agg]
+    b = BytesAdded()
+    b._set_results([['1', 10, 2, 3, 4, 5], ['2', 20, 4, 5, 6, 7]])
+
+    r = aggregator(build_multi_agg(aggs), b, b.header())
+    assert r.data[1:] == sum([aggregator(agg, b, b.header()).data[1:]
+                              for agg in aggs], [])
+    assert len(r.header) == len(r.data) - 1
+
+
+def test_stream_aggregator():
+    """ Aggregates merged over batches of users match a single pass """
+    from user_metrics.metrics.threshold import Threshold, \
+        threshold_editors_agg
+    from user_metrics.metrics.user_metric import stream_aggregator
+
+    class ParityThreshold(Threshold):
+        def process(self, users, **kwargs):
+            self._set_results([[u, int(u) % 3 == 0] for u in users])
+            return self
+
+    users = [str(i) for i in xrange(1, 101)]
+    streamed = stream_aggregator(threshold_editors_agg, ParityThreshold(),
+                                 iter(users), Threshold.header(),
+                                 batch_size=7)
+    t = ParityThreshold().process(users)
+    assert streamed.data == \
+        aggregator(threshold_editors_agg, t, t.header()).data
+
+    # Aggregators without a merge method see the columns of all batches
+    def parity_count(results, indices):
+        assert results.column(1).dtype.kind == 'b'
+        return [len(results), int(results.column(1).sum())]
+    t._agg_indices = {'parity_count': [1]}
+    streamed = stream_aggregator(parity_count, t, iter(users),
+                                 Threshold.header(), batch_size=7)
+    assert streamed.data == ['parity_count', 100, 33]
+
+
+def test_namespace_edits_sum():
+    """ Namespace edit counts sum across users """
+    from user_metrics.metrics.namespace_of_edits import NamespaceEdits, \
+        namespace_edits_sum, namespace_rows
+    import numpy as np
+
+    counts = np.zeros((2, len(NamespaceEdits.VALID_NAMESPACES)), dtype=int)
+    counts[0, 2] = 3
+    counts[1, 2] = 4
+    counts[1, 3] = 1
+    n = NamespaceEdits()
+    n._results = namespace_rows(['1', '2'], counts)
+
+    totals = namespace_edits_sum(n)[1]
+    assert totals['0'] == 7 and totals['1'] == 1
+    assert sum(totals.values()) == 8
+
+
 def test_revert_rate():
     r = revert_rate.RevertRate()
     users = {
@@ -98,6 +271,41 @@ def test_revert_rate():
     assert True
 
 
+def test_reverted_revisions():
+    """ Reverts are detected over bounded windows of a page history """
+    page_rev_window_query = revert_rate.query_mod.page_rev_window_query
+
+    # rev_id, rev_user_text, rev_sha1 of the history of page 1
+    history = [(1, 'A', 'a'), (2, 'U', 'b'), (3, 'B', 'a'),
+               (4, 'U', 'c'), (5, 'B', 'd'), (6, 'B', 'e'),
+               (7, 'U', 'f'), (8, 'U', 'e'), (9, 'C', 'g'),
+               (10, 'D', 'h'), (11, 'D', 'i'), (12, 'D', 'f')]
+    fetched = list()
+
+    def window_query(rev_windows, project, look_back, look_ahead):
+        for page_id, rev_id in rev_windows:
+            fetched.append(rev_id)
+            index = [rev[0] for rev in history].index(rev_id)
+            for rev in history[max(0, index - look_back):
+                               index + look_ahead + 1]:
+                yield (page_id,) + rev
+
+    args = namedtuple('Args', 'project look_back look_ahead')(
+        'enwiki', 2, 2)
+    revisions = [(rev_id, 1, sha1, user) for rev_id, user, sha1 in history
+                 if user == 'U']
+    revert_rate.query_mod.page_rev_window_query = window_query
+    try:
+        reverted = revert_rate._get_reverted_revisions(revisions, args)
+    finally:
+        revert_rate.query_mod.page_rev_window_query = page_rev_window_query
+
+    # 2 is reverted by B, 7 is undone by its own editor and 12 restores 7
+    # beyond the look ahead of 8
+    assert reverted == set([2])
+    assert sorted(fetched) == [2, 4, 7, 8]
+
+
 def test_user():
     assert False  # TODO: implement your test here
 
@@ -121,6 +329,63 @@ def test_user_UMPRegistration():
         # @TODO check if user's reg date and reg date + t is start and end
 
 
+def test_registration_index():
+    """
+        Registration dates read through the index match those queried
+        from the project database.
+    """
+    from user_metrics.metrics.users import get_registration_index, \
+        get_registration_dates
+    from user_metrics.utils import format_mediawiki_timestamp
+
+    users = ['13234590', '13234584']
+    regs = get_registration_index('enwiki').lookup(users)
+    for row in get_registration_dates(users, 'enwiki'):
+        assert regs[long(row[0])] == format_mediawiki_timestamp(str(row[1]))
+
+
+def test_registration_index_unknown():
+    """ Users without a registration date are resolved again on lookup """
+    import shutil
+    from tempfile import mkdtemp
+    import numpy as np
+    import user_metrics.metrics.users as users_mod
+
+    dates = {'1': '20130101000000'}
+    queried = list()
+
+    def get_registration_dates(users, project):
+        queried.append(sorted(users))
+        return [(user, dates[user]) for user in users if user in dates]
+
+    data_file_dir = settings.__data_file_dir__
+    get_dates = users_mod.get_registration_dates
+    settings.__data_file_dir__ = mkdtemp() + '/'
+    users_mod.get_registration_dates = get_registration_dates
+    try:
+        index = users_mod.RegistrationIndex('enwiki')
+        assert index.lookup([1, 2]) == {1L: '20130101000000'}
+        assert list(np.load(index.path)['user']) == [1]
+
+        # A user replicated since the last lookup is picked up
+        dates['2'] = '20130102000000'
+        assert index.lookup([1, 2]) == {1L: '20130101000000',
+                                        2L: '20130102000000'}
+        assert queried == [['1', '2'], ['2']]
+
+        # Unknown entries left in an index file are resolved again
+        index._store(np.array([(3, users_mod.REGISTRATION_UNKNOWN)],
+                              dtype=users_mod.REGISTRATION_INDEX_DTYPE))
+        dates['3'] = '20130103000000'
+        assert index.lookup([3]) == {3L: '20130103000000'}
+        assert list(np.load(index.path)['reg']) == \
+            [20130101000000, 20130102000000, 20130103000000]
+    finally:
+        shutil.rmtree(settings.__data_file_dir__)
+        settings.__data_file_dir__ = data_file_dir
+        users_mod.get_registration_dates = get_dates
+
+
 def test_user_UMPInput():
     """
         Test for UMPInput in user_metrics.metrics.users module.
@@ -191,6 +456,42 @@ def test_rev_count_query():
     assert rev_count == 14
 
 
+def test_rev_count_batch_query():
+    """
+    Test batched revision counts agree with the revision count query.
+    """
+    windows = [(UID_1, '20100101000000', '20130301000000'),
+               (UID_2, '20100101000000', '20130301000000')]
+    counts = qSQL.rev_count_batch_query(windows, False, [0], PROJECT)
+    for uid, start, end in windows:
+        assert counts.get(uid, 0) == \
+            qSQL.rev_count_query(uid, False, [0], PROJECT, start, end)
+
+
+def test_rev_offset_timestamp_query():
+    """
+    Test revision timestamps at offsets match the full revision history.
+    """
+    revs = [str(rev[0]) for rev in
+            qSQL.time_to_threshold_revs_query(UID_1, PROJECT, None)]
+    timestamps = qSQL.rev_offset_timestamp_query([UID_1], [0, 1, -1],
+                                                 PROJECT)
+    assert timestamps[(UID_1, 0)] == revs[0]
+    assert timestamps[(UID_1, 1)] == revs[1]
+    assert timestamps[(UID_1, -1)] == revs[-1]
+
+
+def test_edit_count_batch_query():
+    """
+    Test batched edit counts agree with the edit count query.
+    """
+    args = namedtuple('QueryArgs', 'date_start date_end')(
+        '20100101000000', '20130301000000')
+    counts = dict(qSQL.edit_count_batch_query(
+        [(UID_1, args.date_start, args.date_end)], PROJECT))
+    assert counts == dict(qSQL.edit_count_user_query([UID_1], PROJECT, args))
+
+
 def test_live_account_query():
     """
     Test Live account query.
@@ -219,6 +520,14 @@ def test_rev_len_query():
     assert 17039 == qSQL.rev_len_query(412553375, 'enwiki')
 
 
+def test_rev_len_batch_query():
+    """
+    Test batched revision length query.
+    """
+    assert {412553375: 17039} == \
+        qSQL.rev_len_batch_query([412553375, 412553375], 'enwiki')
+
+
 # ETL tests
 # =========
 
@@ -234,12 +543,192 @@ def test_connect_to_dbs():
         assert True
 
 
+def test_connection_pool():
+    """ Released connections are handed out again by the pool """
+    conn = get_connection(settings.__cohort_data_instance__)
+    release_connection(conn)
+    assert conn is get_connection(settings.__cohort_data_instance__)
+    conn._cur_.execute('SELECT 1')
+    assert conn._cur_.fetchone()[0] == 1
+    release_connection(conn)
+
+
+def test_stream_query_results():
+    """ Streamed rows match buffered rows and release the connection """
+    query = 'SELECT 1 UNION ALL SELECT 2'
+    instance = settings.__cohort_data_instance__
+    conn = get_connection(instance)
+    release_connection(conn)
+    assert list(qSQL.stream_query_results(instance, query)) == [(1,), (2,)]
+
+    # Generators closed before iterating never take a connection
+    qSQL.stream_query_results(instance, query).close()
+
+    assert conn is get_connection(instance)
+    conn._cur_.execute(query)
+    assert list(conn._cur_) == [(1,), (2,)]
+    release_connection(conn)
+
+
 # API tests
 # =========
 
 
 def test_cohort_parse():
-    assert False  # TODO: implement your test here
+    """ Cohort expressions evaluate as sets of the users of each cohort """
+    import numpy as np
+    import user_metrics.api.engine as engine
+    from user_metrics.api import MetricsAPIError
+
+    cohorts = {'1': [1, 3, 5, 7], '2': [3, 7, 9], '3': [1, 2]}
+    get_cohort_user_ids = engine.get_cohort_user_ids
+    engine.get_cohort_user_ids = lambda cid: np.array(cohorts[cid])
+    try:
+        assert engine.parse_cohorts('1&2') == ['3', '7']
+        assert engine.parse_cohorts('1&2~3') == ['1', '2', '3', '7']
+        assert engine.parse_cohorts('1&^(2~3)') == ['5']
+        assert engine.parse_cohorts('(1~2)&^3') == ['3', '5', '7', '9']
+        for expression in ['^1', '(1&2', '1&2)']:
+            try:
+                engine.parse_cohorts(expression)
+                assert False
+            except MetricsAPIError:
+                pass
+    finally:
+        engine.get_cohort_user_ids = get_cohort_user_ids
+
+
+def test_cohort_snapshot():
+    """ Cohort snapshots store and load sorted user IDs """
+    import numpy as np
+    from user_metrics.api.engine import read_cohort_snapshot, \
+        write_cohort_snapshot
+
+    touched = datetime(2013, 1, 1)
+    user_ids = np.array([1, 5, 300, 70000, 13234584], dtype=np.int64)
+    write_cohort_snapshot('test', touched, user_ids)
+    assert read_cohort_snapshot('test', touched).tolist() == \
+        user_ids.tolist()
+    assert read_cohort_snapshot('test', datetime(2013, 1, 2)) is None
+
+
+def test_response_transport():
+    """ Responses survive framing inline and through a temporary file """
+    from user_metrics.api.engine.request_manager import pack_response, \
+        unpack_response, MAX_INLINE_RESPONSE_SIZE
+    from collections import OrderedDict
+
+    small = OrderedDict([('header', ['user_id', 'edit_count']),
+                         ('data', OrderedDict([('1', [2])]))])
+    assert unpack_response(pack_response(small)) == small
+
+    large = OrderedDict([('data', 'x' * (MAX_INLINE_RESPONSE_SIZE + 1))])
+    record = pack_response(large)
+    assert len(record) < MAX_INLINE_RESPONSE_SIZE
+    assert unpack_response(record) == large
+
+
+def test_raw_key_signature():
+    """ Requests differing only in aggregator share raw results """
+    from user_metrics.api.engine.data import build_key_signature, \
+        build_raw_key_signature
+    from user_metrics.api.engine.request_meta import RequestMetaFactory
+
+    rm_sum = RequestMetaFactory('e3_ob2b', '20130101000000', 'edit_count')
+    rm_sum.aggregator = 'sum'
+    rm_mean = RequestMetaFactory('e3_ob2b', '20130101000000', 'edit_count')
+    rm_mean.aggregator = 'mean'
+
+    assert build_key_signature(rm_sum, hash_result=True) != \
+        build_key_signature(rm_mean, hash_result=True)
+    assert build_raw_key_signature(rm_sum, hash_result=True) == \
+        build_raw_key_signature(rm_mean, hash_result=True)
+    assert build_raw_key_signature(rm_sum, hash_result=True) != \
+        build_key_signature(rm_sum, hash_result=True)
+
+
+def test_response_cache():
+    """ Cached responses expire, are evicted LRU and follow cohort updates """
+    import user_metrics.api.engine.data as data
+    from user_metrics.api.engine.request_meta import RequestMetaFactory
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import cPickle
+
+    def request(cohort, cohort_gen_timestamp='20130101000000'):
+        return RequestMetaFactory(cohort, cohort_gen_timestamp, 'edit_count')
+
+    clock = [1000.0]
+    saved = (data.time, settings.__data_file_dir__, data.CACHE_TTL,
+             data.CACHE_MAX_SIZE, data._CACHE_CONN)
+    settings.__data_file_dir__ = mkdtemp() + '/'
+    data.time = lambda: clock[0]
+    data._CACHE_CONN = None
+    try:
+        # Time to live
+        data.CACHE_TTL = 100
+        data.set_data([1], request('a'))
+        clock[0] += 50
+        assert data.get_data(request('a')) == [1]
+        clock[0] += 51
+        assert data.get_data(request('a')) is None
+
+        # Least recently used entries are evicted past the maximum size
+        data.CACHE_TTL = 1 << 30
+        size = len(cPickle.dumps(['x' * 100], cPickle.HIGHEST_PROTOCOL))
+        data.CACHE_MAX_SIZE = 2 * size
+        for cohort in 'bcd':
+            clock[0] += 1
+            if cohort == 'd':
+                # "b" is read and so "c" is the least recently used
+                data.get_data(request('b'))
+                clock[0] += 1
+            data.set_data(['x' * 100], request(cohort))
+        assert data.get_data(request('b')) is not None
+        assert data.get_data(request('c')) is None
+        assert data.get_data(request('d')) is not None
+
+        # A refreshed cohort invalidates its entries
+        data.set_data([2], request('e'))
+        assert data.get_data(request('e', '20130102000000')) is None
+        assert data.get_data(request('e')) is None
+    finally:
+        if data._CACHE_CONN is not None:
+            data._CACHE_CONN.close()
+        rmtree(settings.__data_file_dir__)
+        (data.time, settings.__data_file_dir__, data.CACHE_TTL,
+         data.CACHE_MAX_SIZE, data._CACHE_CONN) = saved
+
+
+def test_refresh_raw_results():
+    """ Refreshed requests recompute and replace cached raw results """
+    from user_metrics.api.engine.data import get_raw_data, set_raw_data
+    from user_metrics.api.engine.request_manager import process_raw_results
+    from user_metrics.api.engine.request_meta import RequestMetaFactory
+
+    class ProcessCounter(object):
+        def __init__(self):
+            self.processed = 0
+            self._results = None
+
+        def process(self, users, **kwargs):
+            self.processed += 1
+            self._results = [['1', 5]]
+
+        def _set_results(self, results):
+            self._results = results
+
+    rm = RequestMetaFactory('e3_ob2b', '20130101000000', 'edit_count')
+    set_raw_data([['1', 2]], rm)
+
+    metric_obj = ProcessCounter()
+    process_raw_results(metric_obj, ['1'], rm, {})
+    assert metric_obj.processed == 0 and metric_obj._results == [['1', 2]]
+
+    rm.refresh = True
+    process_raw_results(metric_obj, ['1'], rm, {})
+    assert metric_obj.processed == 1
+    assert get_raw_data(rm) == [['1', 5]]
 
 
 # Utilities tests
@@ -250,5 +739,55 @@ def test_recordtype():
     assert False  # TODO: implement your test here
 
 
+def test_mediawiki_timestamp_epoch():
+    """ Vectorised timestamp conversion agrees with the calendar """
+    from user_metrics.utils import mediawiki_timestamp_to_epoch, \
+        epoch_to_mediawiki_timestamp
+    from calendar import timegm
+    import numpy as np
+
+    dates = [datetime(1970, 1, 1), datetime(2000, 2, 29, 23, 59, 59),
+             datetime(2012, 12, 31, 12, 30, 1), datetime(2100, 3, 1)]
+    timestamps = np.array([int(d.strftime('%Y%m%d%H%M%S')) for d in dates])
+    epoch = mediawiki_timestamp_to_epoch(timestamps)
+    assert epoch.tolist() == [timegm(d.timetuple()) for d in dates]
+    assert epoch_to_mediawiki_timestamp(epoch).tolist() == \
+        timestamps.tolist()
+
+
+def _square_chunk(args):
+    return [x * x for x in args[0]]
+
+
+def _nested_square_chunk(args):
+    return build_thread_pool(args[0], _square_chunk, 2, [])
+
+
+def test_build_thread_pool():
+    """ Results keep partition order and nested calls run inline """
+    assert build_thread_pool(range(10), _square_chunk, 3, []) == \
+        [x * x for x in range(10)]
+    assert build_thread_pool(range(10), _nested_square_chunk, 3, []) == \
+        [x * x for x in range(10)]
+
+
+def _pid_chunk(args):
+    from os import getpid
+    return [getpid()] * len(args[0])
+
+
+def test_limit_pool():
+    """ Processes capped below two workers run jobs inline """
+    import user_metrics.utils.multiprocessing_wrapper as mpw
+    from os import getpid
+
+    try:
+        mpw.limit_pool(0)
+        assert set(build_thread_pool(range(10), _pid_chunk, 3, [])) == \
+            set([getpid()])
+    finally:
+        mpw._POOL_MAX = None
+
+
 if __name__ == '__main__':
     test_revert_rate()
@@ -6,6 +6,7 @@ MW_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
 from dateutil.parser import parse as date_parse
 from collections import namedtuple, OrderedDict
 from hashlib import sha1
+import numpy as np
 
 
 def format_mediawiki_timestamp(timestamp_repr):
@@ -26,6 +27,69 @@ def format_mediawiki_timestamp(timestamp_repr):
             MW_TIMESTAMP_FORMAT)
 
 
+def mediawiki_timestamp_to_epoch(timestamps):
+    """
+        Convert an array of MediaWiki timestamps, as 14 digit integers, to
+        seconds since the epoch.  Dates are computed arithmetically over
+        the whole array rather than parsed one at a time.
+
+        Parameters
+        ~~~~~~~~~~
+
+        timestamps : numpy.ndarray
+           Integer timestamps of the form YYYYMMDDHHMMSS.
+    """
+    timestamps = np.asarray(timestamps, dtype='i8')
+    year = timestamps // 10 ** 10
+    month = timestamps // 10 ** 8 % 100
+    day = timestamps // 10 ** 6 % 100
+
+    # Count days from a calendar starting in March so that leap days fall
+    # at the end of the year
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - \
+        year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+
+    return days * 86400 + timestamps // 10 ** 4 % 100 * 3600 + \
+        timestamps // 100 % 100 * 60 + timestamps % 100
+
+
+def epoch_to_mediawiki_timestamp(seconds):
+    """
+        Convert an array of seconds since the epoch to MediaWiki timestamps
+        as 14 digit integers, the inverse of
+        ``mediawiki_timestamp_to_epoch``.
+
+        Parameters
+        ~~~~~~~~~~
+
+        seconds : numpy.ndarray
+           Integer seconds since the epoch.
+    """
+    seconds = np.asarray(seconds, dtype='i8')
+    days = seconds // 86400 + 719468
+    time_of_day = seconds % 86400
+
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 -
+                   day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 -
+                                year_of_era // 100)
+    month = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month + 2) // 5 + 1
+    month = np.where(month < 10, month + 3, month - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+
+    return year * 10 ** 10 + month * 10 ** 8 + day * 10 ** 6 + \
+        time_of_day // 3600 * 10 ** 4 + time_of_day // 60 % 60 * 100 + \
+        time_of_day % 60
+
+
 def enum(*sequential, **named):
     """
         Implemetents an enumeration::
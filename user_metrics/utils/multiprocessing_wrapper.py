@@ -11,18 +11,119 @@
 import multiprocessing as mp
 import multiprocessing.pool as mp_pool
 import math
+import atexit
+from os import getpid
+from threading import Lock
+
+from user_metrics.config import settings
 
 __author__ = "ryan faulkner"
 __date__ = "12/12/2012"
 __license__ = "GPL (version 2 or later)"
 
 
+# Number of tasks a pool worker completes before it is replaced by a fresh
+# process, this bounds the memory held by long lived workers
+MAX_TASKS_PER_CHILD = 50
+
+# The worker pool of this process.  The pool is created lazily on first use
+# and reused by subsequent calls to ``build_thread_pool``.  It grows on
+# demand up to ``settings.__process_max__`` processes.  A forked child does
+# not reuse the pool of its parent.
+_POOL = None
+_POOL_SIZE = 0
+_POOL_PID = None
+_POOL_LOCK = Lock()
+
+# Set in pool workers, calls to ``build_thread_pool`` made from within a
+# worker are executed inline rather than spawning another level of processes
+_IN_POOL_WORKER = False
+
+# Cap on the pool of this process set by ``limit_pool``, None if only
+# ``settings.__process_max__`` applies
+_POOL_MAX = None
+
+
+def _init_worker():
+    """ Initializer of pool worker processes """
+    global _POOL, _POOL_SIZE, _POOL_PID, _IN_POOL_WORKER
+    _POOL, _POOL_SIZE, _POOL_PID = None, 0, None
+    _IN_POOL_WORKER = True
+
+
+def _call_indexed(args):
+    """ Calls a job and tags its result with the index of the job """
+    index, callback, callback_args = args
+    return index, callback(callback_args)
+
+
+def limit_pool(processes):
+    """
+        Caps the worker pool of this process at ``processes`` processes.
+        With fewer than two processes calls to ``build_thread_pool`` are run
+        inline.  Processes that are not pool workers but run alongside one
+        another, API jobs and time series workers, call this so that their
+        pools share ``settings.__process_max__`` rather than each holding as
+        many processes.  Child processes inherit the cap.
+    """
+    global _POOL_MAX
+    _POOL_MAX = max(0, int(processes))
+
+
+def _pool_max():
+    """ Returns the maximum number of processes in the pool of this process """
+    if _POOL_MAX is None:
+        return settings.__process_max__
+    return min(_POOL_MAX, settings.__process_max__)
+
+
+def get_pool(k):
+    """
+        Returns the worker pool of this process, creating it or growing it
+        such that it holds ``k`` processes if ``settings.__process_max__``
+        and ``limit_pool`` allow.
+    """
+    global _POOL, _POOL_SIZE, _POOL_PID
+
+    size = max(1, min(k, _pool_max()))
+    with _POOL_LOCK:
+        if _POOL_PID != getpid():
+            # The pool of the parent process can not be used from a fork
+            _POOL, _POOL_SIZE, _POOL_PID = None, 0, getpid()
+        if _POOL is None or _POOL_SIZE < size:
+            if _POOL is not None:
+                _POOL.close()
+                _POOL.join()
+            _POOL = NonDaemonicPool(processes=size,
+                                    initializer=_init_worker,
+                                    maxtasksperchild=MAX_TASKS_PER_CHILD)
+            _POOL_SIZE = size
+        return _POOL
+
+
+def shutdown():
+    """ Terminate the worker pool of this process if one exists """
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_PID == getpid():
+            _POOL.terminate()
+            _POOL.join()
+        _POOL, _POOL_SIZE = None, 0
+
+atexit.register(shutdown)
+
+
 def build_thread_pool(data, callback, k, args):
     """
-        Handles initializing, executing, and cleanup for thread pools. Given
+        Handles executing and combining jobs on the worker pool. Given
         the iterable ``data`` and a thread count ``k`` partition the data and
         execute ``k`` independent jobs on ``callback`` with ``args`` passed.
-        Finally combine the results of each job.
+        Finally combine the results of each job in partition order.
+
+        The pool persists across calls and holds at most
+        ``settings.__process_max__`` processes, or the cap set by
+        ``limit_pool``.  When called from within a pool worker, or when the
+        cap is below two processes, the jobs are run inline.
     """
 
     # partition data
@@ -37,16 +138,25 @@ def build_thread_pool(data, callback, k, args):
     if not arg_list:
         return []
 
-    pool = NonDaemonicPool(processes=len(arg_list))
-    results = list()
     # Call worker threads and aggregate results
-    if arg_list:
-        for elem in pool.map(callback, arg_list):
-            if hasattr(elem, '__iter__'):
-                results.extend(elem)
-            else:
-                results.extend([elem])
-    pool.terminate()
+    if _IN_POOL_WORKER or len(arg_list) == 1 or _pool_max() < 2:
+        job_results = [callback(arg) for arg in arg_list]
+    else:
+        job_results = [None] * len(arg_list)
+        pool = get_pool(len(arg_list))
+        for index, elem in pool.imap_unordered(
+                _call_indexed,
+                [(index, callback, arg) for index, arg in enumerate(arg_list)],
+                chunksize=int(math.ceil(float(len(arg_list)) /
+                                        _POOL_SIZE / 4))):
+            job_results[index] = elem
+
+    results = list()
+    for elem in job_results:
+        if hasattr(elem, '__iter__'):
+            results.extend(elem)
+        else:
+            results.extend([elem])
     return results
 
 